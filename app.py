@@ -1,46 +1,190 @@
 #!/usr/bin/env python
-"""Receive SMTP messages and route them to S3 storage."""
-import signal
-import time
+"""
+Receive SMTP messages and route them to S3 storage.
 
-from aiosmtpd.controller import Controller
+Only the config is read when this is imported.  The modules that serve SMTP
+are imported when the service is run, as the compression workers import
+this module again when they are spawned but need none of them.
+"""
+import asyncio
+import functools
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from typing import TYPE_CHECKING, Optional
 
 import smtp2s3
-from smtp2s3.handler import Handler
+from smtp2s3.startup import STARTUP
+from smtp2s3.workers import Supervisor
+
+if TYPE_CHECKING:
+    from smtp2s3.service import SMTPService
+
+with STARTUP.phase('config'):
+    config = smtp2s3.EnvironmentConfig()
 
-config = smtp2s3.EnvironmentConfig()
 logger = smtp2s3.get_logger('smtp2s3')
 logger.setLevel(config.log_level)
 
 
-if __name__ == '__main__':
-    running = True
+def import_service() -> None:
+    """
+    Import the modules that serve SMTP, timing them as a startup phase.
 
-    def signal_handler(sig, frame) -> None:
-        """Handle signals so that we know when to stop."""
-        global running
-        running = False
+    boto3 is left to be imported in the background once the SMTP port is
+    bound (see Handler.warm_up).
+    """
+    with STARTUP.phase('imports'):
+        import smtp2s3.handler  # noqa: F401
+        import smtp2s3.service  # noqa: F401
 
-    try:
+
+def prepare_spool(worker: Optional[int]) -> None:
+    """
+    Point the config at the spool of a worker, if spooling.
+
+    The first worker (or the single process) first adopts the segments of
+    the spools that no worker appends to, to replay them with its own.
+
+    Parameters
+    ----------
+    worker : int
+        The index of the worker process, or None for a single process.
+    """
+    from smtp2s3.spool import adopt_orphans
+
+    if not config.spool_directory:
+        return
+    elif not worker:
+        adopt_orphans(config.spool_directory, config.smtp_workers, logger)
+
+    if worker is not None:
+        config.spool_directory = os.path.join(config.spool_directory,
+                                              f'worker-{worker}')
+
+
+def create_service(worker: Optional[int],
+                   metrics_directory: Optional[str]) -> 'SMTPService':
+    """
+    Create the handler and the SMTP service.
+
+    Parameters
+    ----------
+    worker : int
+        The index of the worker process that the service is running in, or
+        None if it is running in a single process.  Each worker has its own
+        subdirectory of the spool directory.
+    metrics_directory : str
+        The directory shared by the workers to dump their metrics to, or
+        None if running in a single process.
+
+    Returns
+    -------
+    SMTPService
+        The service, yet to be started.
+    """
+    from smtp2s3.handler import Handler
+    from smtp2s3.service import SMTPService
+
+    prepare_spool(worker)
+    metrics_path = None
+
+    if metrics_directory is not None:
+        metrics_path = os.path.join(metrics_directory, f'worker-{worker}.json')
+
+    with STARTUP.phase('handler'):
         handler = Handler(config, logger)
-        msg = f'v{smtp2s3.__version__} listening on '
-        msg += f'{config.smtp_hostname}:{config.smtp_port}'
-        logger.info(msg)
-
-        controller = Controller(
-            handler,
-            hostname=config.smtp_hostname,
-            port=config.smtp_port,
-            data_size_limit=config.smtp_data_size_limit
-        )
-        controller.start()
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
+
+    return SMTPService(
+        handler,
+        logger,
+        hostname=config.smtp_hostname,
+        port=config.smtp_port,
+        data_size_limit=config.smtp_data_size_limit,
+        reuse_port=worker is not None,
+        drain_delay=config.smtp_drain_delay,
+        drain_timeout=config.smtp_drain_timeout,
+        http_port=config.http_port,
+        metrics_path=metrics_path
+    )
+
+
+async def serve(worker: Optional[int],
+                metrics_directory: Optional[str]) -> None:
+    """
+    Run the SMTP service until a SIGINT or SIGTERM, then drain it.
+
+    Parameters
+    ----------
+    worker : int
+        The index of the worker process, or None for a single process.
+    metrics_directory : str
+        The directory shared by the workers to dump their metrics to, or
+        None for a single process.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    service = create_service(worker, metrics_directory)
+    handler = service.handler
+    loop.add_signal_handler(signal.SIGHUP, handler.reload_access, config)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+
+    await service.start()
+    msg = f'v{smtp2s3.__version__} listening on '
+    msg += f'{config.smtp_hostname}:{config.smtp_port}'
+    logger.info(msg)
+    logger.info(STARTUP.summary('Listening'))
+
+    await stopping.wait()
+    logger.warning('Draining SMTP connections.')
+    await service.stop()
+    handler.uploader.shutdown()
+    logger.warning('Closed down SMTP.')
+
+
+def run(worker: Optional[int] = None,
+        metrics_directory: Optional[str] = None) -> None:
+    """
+    Run the SMTP service on the configured event loop.
+
+    Parameters
+    ----------
+    worker : int, optional
+        The index of the worker process that the service is running in, by
+        default None for a single process.
+    metrics_directory : str, optional
+        The directory shared by the workers to dump their metrics to, by
+        default None for a single process.
+    """
+    import_service()
+    from smtp2s3.service import loop_factory
+
+    try:
+        with asyncio.Runner(
+            loop_factory=loop_factory(config.event_loop, logger)
+        ) as runner:
+            runner.run(serve(worker, metrics_directory))
     except Exception as ex:
-        logger.debug(ex)
+        logger.error(ex)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    if config.smtp_workers > 1:
+        logger.info(f'Starting {config.smtp_workers} workers.')
+        # Import the modules before forking, for the workers to share.
+        import_service()
+        directory = tempfile.mkdtemp(prefix='smtp2s3-metrics-')
+        target = functools.partial(run, metrics_directory=directory)
 
-    while running:
-        time.sleep(1)
+        try:
+            exitcode = Supervisor(config.smtp_workers, target, logger).run()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
 
-    logger.warning('Closing down SMTP.')
-    controller.stop()
+        sys.exit(exitcode)
+    else:
+        run()
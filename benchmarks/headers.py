@@ -0,0 +1,83 @@
+"""
+Compare reading the Message-ID with the email package and smtp2s3.headers.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=. python benchmarks/headers.py
+"""
+import base64
+import os
+import timeit
+from email import message_from_bytes
+
+from smtp2s3.headers import parse_headers
+
+SIZES = (1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+def make_message(size: int) -> bytes:
+    """
+    Make a MIME message with an attachment of about a size.
+
+    Parameters
+    ----------
+    size : int
+        The approximate size in bytes of the message.
+
+    Returns
+    -------
+    bytes
+        The message content.
+    """
+    attachment = base64.encodebytes(os.urandom(size * 3 // 4))
+    return b'\r\n'.join([
+        b'From: anne@example.com',
+        b'To: bob@example.com',
+        b'Subject: Benchmark',
+        b'Message-ID:',
+        b' <benchmark@example.com>',
+        b'MIME-Version: 1.0',
+        b'Content-Type: multipart/mixed; boundary="BOUNDARY"',
+        b'',
+        b'--BOUNDARY',
+        b'Content-Type: text/plain',
+        b'',
+        b'Hello, world!',
+        b'--BOUNDARY',
+        b'Content-Type: application/octet-stream',
+        b'Content-Transfer-Encoding: base64',
+        b'',
+        attachment.replace(b'\n', b'\r\n'),
+        b'--BOUNDARY--',
+        b''
+    ])
+
+
+def full_parse(content: bytes) -> str:
+    """Get the Message-ID with a full parse of the message."""
+    return message_from_bytes(content).get('Message-ID')
+
+
+def header_parse(content: bytes) -> str:
+    """Get the Message-ID by parsing only the headers."""
+    return parse_headers(content).get('Message-ID')
+
+
+def main() -> None:
+    """Time each way of reading the Message-ID for each message size."""
+    print(f'{"size":>10} {"full (ms)":>12} {"headers (ms)":>12} {"speedup":>8}')
+
+    for size in SIZES:
+        content = make_message(size)
+        number = max(1, 10 * 1024 * 1024 // size)
+        times = [
+            min(timeit.repeat(lambda: func(content), number=number,
+                              repeat=5)) / number * 1000
+            for func in (full_parse, header_parse)
+        ]
+        print(f'{len(content):>10} {times[0]:>12.3f} {times[1]:>12.3f} '
+              f'{times[0] / times[1]:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
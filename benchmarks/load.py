@@ -0,0 +1,454 @@
+"""
+Load test the SMTP service offline, against a fake S3 with latency.
+
+The service (the real Handler and SMTPService) runs in a child process,
+writing to an in-process fake S3 whose requests take a random time (with
+the given mean) and which answers SlowDown once more than the given number
+of requests per second are made.  The parent process opens the given number
+of concurrent SMTP sessions and sends messages with a mix of sizes and
+recipient counts over them.
+
+Reported are the messages per second, the p50, p95 and p99 latency of DATA
+(from sending the content to the reply), and the peak RSS and CPU time per
+message of the service process.  The results can be written to a JSON file and
+compared with those of an earlier run, so that a regression between releases
+shows up as a ratio.  Any smtp2s3 environment variables that are set (such
+as COMPRESSION_CODEC or STORAGE_LAYOUT) are passed on to the service.
+
+Run from the root of the repository with, for example:
+
+    PYTHONPATH=. python benchmarks/load.py --output results.json
+    PYTHONPATH=. python benchmarks/load.py --compare results.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import socket
+import statistics
+import sys
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import smtp2s3
+from smtp2s3.handler import Handler
+from smtp2s3.service import SMTPService
+
+DOMAIN = 'example.com'
+
+
+class FakeS3Client:
+    """
+    A stand in for the S3 client that only counts and sizes the requests.
+
+    Parameters
+    ----------
+    latency : float
+        The mean number of seconds that each request takes, exponentially
+        distributed.
+    throttle : int
+        The number of requests per second above which requests fail with
+        SlowDown, or 0 for no limit.
+    seed : int
+        The seed of the latency.
+    """
+
+    def __init__(self, latency: float, throttle: int, seed: int) -> None:
+        self.requests = {}
+        self._latency = latency
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._throttle = throttle
+        self._window = (0, 0)
+
+    def abort_multipart_upload(self, **kwargs) -> dict:
+        """Abort a multipart upload."""
+        return self._request('abort_multipart_upload')
+
+    def complete_multipart_upload(self, **kwargs) -> dict:
+        """Complete a multipart upload."""
+        return self._request('complete_multipart_upload')
+
+    def create_multipart_upload(self, **kwargs) -> dict:
+        """Start a multipart upload."""
+        return dict(self._request('create_multipart_upload'), UploadId='1')
+
+    def head_bucket(self, **kwargs) -> dict:
+        """Check that a bucket exists."""
+        return self._request('head_bucket')
+
+    def put_object(self, **kwargs) -> dict:
+        """Put an object."""
+        return self._request('put_object')
+
+    def upload_part(self, PartNumber: int, **kwargs) -> dict:
+        """Upload part of a multipart upload."""
+        return dict(self._request('upload_part'), ETag=str(PartNumber))
+
+    def _count_in_window(self) -> int:
+        """Count a request in the current second, returning the count."""
+        second, count = self._window
+        now = int(time.monotonic())
+        self._window = (now, count + 1 if now == second else 1)
+        return self._window[1]
+
+    def _request(self, method: str) -> dict:
+        """Count a request, then wait for it or fail if throttled."""
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            throttled = self._count_in_window() > (self._throttle or math.inf)
+            delay = self._rng.expovariate(1 / self._latency)
+
+        if throttled:
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, method)
+
+        time.sleep(delay)
+        return {}
+
+
+def choose(mix: list[tuple[int, float]], rng: random.Random) -> int:
+    """Choose a value from a mix of values and weights."""
+    values, weights = zip(*mix)
+    return rng.choices(values, weights)[0]
+
+
+def free_port() -> int:
+    """Get a free TCP port on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_attachment(size: int) -> bytes:
+    """Make base64 lines of random data of about a size in bytes."""
+    attachment = base64.encodebytes(os.urandom(size * 3 // 4))
+    return attachment.replace(b'\n', b'\r\n')
+
+
+def make_message(index: int, recipients: list[str],
+                 attachment: bytes) -> bytes:
+    """
+    Make a message with an attachment.
+
+    Parameters
+    ----------
+    index : int
+        The number of the message, to make its Message-ID unique.
+    recipients : list[str]
+        The recipients to address the message to.
+    attachment : bytes
+        The lines of the attachment.
+
+    Returns
+    -------
+    bytes
+        The message content, ending with the lone dot.
+    """
+    return b'\r\n'.join([
+        b'From: anne@example.org',
+        b'To: ' + ', '.join(recipients).encode(),
+        b'Subject: Load test',
+        f'Message-ID: <{index}@example.org>'.encode(),
+        b'',
+        attachment + b'.',
+        b''
+    ])
+
+
+def parse_mix(text: str) -> list[tuple[int, float]]:
+    """
+    Parse a mix of values and weights, such as "1024:0.9,1048576:0.1".
+
+    Parameters
+    ----------
+    text : str
+        The comma separated values, each with an optional weight.
+
+    Returns
+    -------
+    list[tuple[int, float]]
+        The values and their weights.
+    """
+    mix = []
+
+    for item in text.split(','):
+        value, _, weight = item.partition(':')
+        mix.append((int(value), float(weight or 1)))
+
+    return mix
+
+
+def percentiles(latencies: list[float]) -> dict:
+    """Get the p50, p95 and p99 of latencies in seconds, in milliseconds."""
+    if len(latencies) < 2:
+        return {'p50': None, 'p95': None, 'p99': None}
+
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {f'p{p}': round(cuts[p - 1] * 1000, 3) for p in (50, 95, 99)}
+
+
+async def read_reply(reader: asyncio.StreamReader) -> str:
+    """Read an SMTP reply, returning its last line."""
+    while True:
+        line = (await reader.readline()).decode()
+
+        if len(line) < 4 or line[3] != '-':
+            return line.strip()
+
+
+async def command(reader: asyncio.StreamReader,
+                  writer: asyncio.StreamWriter, line: str) -> str:
+    """Send an SMTP command and read its reply."""
+    writer.write(f'{line}\r\n'.encode())
+    await writer.drain()
+    return await read_reply(reader)
+
+
+class LoadGenerator:
+    """
+    Send messages over concurrent SMTP sessions, recording the replies.
+
+    Attributes
+    ----------
+    latencies : list[float]
+        The number of seconds from sending the content of each message to
+        the reply.
+    replies : dict[str, int]
+        The number of messages by the code of the reply to DATA, or to the
+        command that refused the message.
+
+    Parameters
+    ----------
+    port : int
+        The port number of the SMTP service.
+    options : argparse.Namespace
+        The options of the load test.
+    """
+
+    def __init__(self, port: int, options: argparse.Namespace) -> None:
+        self.latencies = []
+        self.replies = {}
+        self._options = options
+        self._port = port
+        self._remaining = options.messages
+        self._rng = random.Random(options.seed)
+        self._attachments = {
+            size: make_attachment(size) for size, _ in options.sizes
+        }
+
+    async def run(self) -> None:
+        """Send all of the messages."""
+        await asyncio.gather(*(
+            self._session() for _ in range(self._options.concurrency)
+        ))
+
+    def _next_message(self) -> tuple[list[str], bytes]:
+        """Get the recipients and content of the next message to send."""
+        index = self._remaining
+        self._remaining -= 1
+        count = choose(self._options.recipients, self._rng)
+        recipients = [f'user{self._rng.randrange(1000)}@{DOMAIN}'
+                      for _ in range(count)]
+        attachment = self._attachments[choose(self._options.sizes, self._rng)]
+        return recipients, make_message(index, recipients, attachment)
+
+    def _record(self, reply: str) -> None:
+        """Count the reply that a message ended with."""
+        code = reply[:3] or 'closed'
+        self.replies[code] = self.replies.get(code, 0) + 1
+
+    async def _send(self, reader: asyncio.StreamReader,
+                    writer: asyncio.StreamWriter) -> bool:
+        """Send a message, returning False if the session has ended."""
+        recipients, content = self._next_message()
+
+        for line in ['MAIL FROM:<anne@example.org>'] + [
+            f'RCPT TO:<{address}>' for address in recipients
+        ] + ['DATA']:
+            reply = await command(reader, writer, line)
+
+            if reply[:1] not in ('2', '3'):
+                self._record(reply)
+                return not reply.startswith('421') and reply != ''
+
+        start = time.perf_counter()
+        writer.write(content)
+        reply = await read_reply(reader)
+        self.latencies.append(time.perf_counter() - start)
+        self._record(reply)
+        return reply != ''
+
+    async def _session(self) -> None:
+        """Send messages over a session, reconnecting if it is closed."""
+        while self._remaining > 0:
+            reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                           self._port)
+
+            if (await read_reply(reader)).startswith('220'):
+                await command(reader, writer, 'EHLO load.example.org')
+
+                while self._remaining > 0 and await self._send(reader,
+                                                               writer):
+                    await command(reader, writer, 'RSET')
+            else:
+                await asyncio.sleep(0.01)
+
+            writer.close()
+
+
+async def serve(port: int, options: argparse.Namespace, ready, stop,
+                requests) -> None:
+    """Serve SMTP until told to stop, then send back the S3 requests."""
+    environ = {
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://load/{YYYY}/{MM}/{dd}',
+        'SMTP_RECIPIENT_REGEX': rf'.*@{DOMAIN}',
+        **os.environ
+    }
+    config = smtp2s3.EnvironmentConfig(environ)
+    logger = smtp2s3.get_logger('load')
+    logger.setLevel('CRITICAL')
+    client = FakeS3Client(options.latency, options.throttle, options.seed)
+    handler = Handler(config, logger)
+    handler.transport_params['client'] = client
+    service = SMTPService(handler, logger, '127.0.0.1', port,
+                          data_size_limit=config.smtp_data_size_limit)
+    await service.start()
+    ready.set()
+    await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+    await service.stop()
+    handler.uploader.shutdown()
+    requests.put(client.requests)
+
+
+def run_service(*args) -> None:
+    """Run the service in the child process."""
+    asyncio.run(serve(*args))
+
+
+def run(options: argparse.Namespace) -> dict:
+    """
+    Run the load test.
+
+    Parameters
+    ----------
+    options : argparse.Namespace
+        The options of the load test.
+
+    Returns
+    -------
+    dict
+        The results.
+    """
+    context = multiprocessing.get_context('fork')
+    port = free_port()
+    ready, stop, requests = context.Event(), context.Event(), context.Queue()
+    process = context.Process(target=run_service,
+                              args=(port, options, ready, stop, requests))
+    process.start()
+    ready.wait()
+    generator = LoadGenerator(port, options)
+    start = time.perf_counter()
+    asyncio.run(generator.run())
+    elapsed = time.perf_counter() - start
+    stop.set()
+    s3_requests = requests.get()
+    process.join()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'version': smtp2s3.__version__,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'options': {key: value for key, value in vars(options).items()
+                    if key not in ('compare', 'output')},
+        'messages_per_second': round(options.messages / elapsed, 1),
+        'data_latency_ms': percentiles(generator.latencies),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'cpu_ms_per_message': round(
+            (usage.ru_utime + usage.ru_stime) * 1000 / options.messages, 3
+        ),
+        'replies': generator.replies,
+        's3_requests': s3_requests
+    }
+
+
+def headline(results: dict) -> dict:
+    """Get the headline figures of some results, by name."""
+    figures = {
+        f'data_latency_ms.{key}': value
+        for key, value in results['data_latency_ms'].items()
+    }
+    figures.update({
+        key: results[key] for key in ('messages_per_second', 'peak_rss_mb',
+                                      'cpu_ms_per_message')
+    })
+    return figures
+
+
+def compare(results: dict, path: str) -> None:
+    """Print the ratio of the headline figures to those of a baseline."""
+    with open(path) as stream:
+        baseline = json.load(stream)
+
+    print(f'Compared with v{baseline["version"]} ({path}):')
+    old = headline(baseline)
+
+    for name, new in headline(results).items():
+        if new and old.get(name):
+            print(f'  {name:>22} {old[name]:>10} -> {new:>10} '
+                  f'({new / old[name]:.2f}x)')
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line options."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='the number of concurrent SMTP sessions')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='the number of messages to send')
+    parser.add_argument('--sizes', type=parse_mix,
+                        default='4096:0.7,65536:0.25,1048576:0.05',
+                        help='the mix of message sizes in bytes and weights')
+    parser.add_argument('--recipients', type=parse_mix,
+                        default='1:0.8,2:0.15,10:0.05',
+                        help='the mix of recipient counts and weights')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='the mean seconds taken by each S3 request')
+    parser.add_argument('--throttle', type=int, default=0,
+                        help='the S3 requests per second before SlowDown')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='a file to write the results to')
+    parser.add_argument('--compare', help='the results of an earlier run')
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> None:
+    """Run the load test and report the results."""
+    options = parse_args(argv)
+    results = run(options)
+    latency = results['data_latency_ms']
+    print(f'{options.messages} messages at {results["messages_per_second"]}'
+          f'/s, DATA p50/p95/p99 {latency["p50"]}/{latency["p95"]}/'
+          f'{latency["p99"]} ms, peak RSS {results["peak_rss_mb"]} MB, '
+          f'{results["cpu_ms_per_message"]} CPU ms per message')
+    print(f'Replies: {results["replies"]}')
+    print(f'S3 requests: {results["s3_requests"]}')
+
+    if options.output:
+        with open(options.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+"""
+Compare admitting recipients with a regex and with smtp2s3.recipients.
+
+The recipients follow a Zipf distribution over the mailboxes of a few
+domains, as most mail goes to a few busy addresses, with a share of unique
+addresses that are never seen again (as in a dictionary attack).  Two
+policies are timed:
+
+- default: the default SMTP_RECIPIENT_REGEX, which is cheap for everyday
+  addresses, so the verdict cache only adds a little overhead.
+- allowlist: a list of accepted mailboxes plus a wildcard domain, written
+  as a regex alternation (with and without the verdict cache) and as
+  SMTP_RECIPIENTS entries.
+
+Run from the root of the repository with:
+
+    PYTHONPATH=. python benchmarks/recipients.py
+"""
+import random
+import re
+import timeit
+
+from smtp2s3 import EnvironmentConfig
+from smtp2s3.recipients import RecipientPolicy
+
+ALLOWED = 1000
+CACHE_SIZE = 10000
+DOMAINS = ('example.com', 'mail.example.org', 'example.net')
+MAILBOXES = 5000
+RECIPIENTS = 100000
+UNIQUE_SHARE = 0.1
+
+
+def make_recipients(rng: random.Random) -> list[str]:
+    """
+    Make the recipient addresses of a stream of RCPT commands.
+
+    Parameters
+    ----------
+    rng : random.Random
+        The random number generator.
+
+    Returns
+    -------
+    list[str]
+        The addresses, in the order they are received.
+    """
+    mailboxes = [
+        f'user{index}@{DOMAINS[index % len(DOMAINS)]}'
+        for index in range(MAILBOXES)
+    ]
+    rng.shuffle(mailboxes)
+    weights = [1 / rank for rank in range(1, MAILBOXES + 1)]
+    recipients = rng.choices(mailboxes, weights, k=RECIPIENTS)
+
+    for index in rng.sample(range(RECIPIENTS), int(RECIPIENTS * UNIQUE_SHARE)):
+        recipients[index] = f'x{index}@{rng.choice(DOMAINS)}'
+
+    return recipients
+
+
+def allowlist() -> tuple[re.Pattern, list[str]]:
+    """
+    Make an allowlist policy as both a regex and index entries.
+
+    Returns
+    -------
+    tuple[re.Pattern, list[str]]
+        The regex and the equivalent SMTP_RECIPIENTS entries.
+    """
+    addresses = [f'user{index}@example.com' for index in range(0, ALLOWED)]
+    alternation = '|'.join(re.escape(address) for address in addresses)
+    pattern = re.compile(rf'{alternation}|[^@]+@(?:.+\.)?example\.org')
+    return pattern, addresses + ['*.example.org']
+
+
+def time_admit(admit, recipients: list[str]) -> float:
+    """Get the best time in microseconds to admit each recipient."""
+    elapsed = min(timeit.repeat(lambda: list(map(admit, recipients)),
+                                number=1, repeat=5))
+    return elapsed / len(recipients) * 1e6
+
+
+def main() -> None:
+    """Time each way of admitting the recipients for each policy."""
+    recipients = make_recipients(random.Random(42))
+    default = EnvironmentConfig({}).smtp_rcpt_regex
+    pattern, entries = allowlist()
+    paths = [
+        ('default', 'regex', default.fullmatch),
+        ('default', 'cache',
+         RecipientPolicy(default, cache_size=CACHE_SIZE).admit),
+        ('allowlist', 'regex', pattern.fullmatch),
+        ('allowlist', 'cache',
+         RecipientPolicy(pattern, cache_size=CACHE_SIZE).admit),
+        ('allowlist', 'index',
+         RecipientPolicy(re.compile('(?!)'), entries).admit)
+    ]
+    baselines = {}
+    print(f'{"policy":>10} {"path":>6} {"us/rcpt":>8} {"speedup":>8}')
+
+    for policy, path, admit in paths:
+        per_rcpt = time_admit(admit, recipients)
+        baseline = baselines.setdefault(policy, per_rcpt)
+        print(f'{policy:>10} {path:>6} {per_rcpt:>8.3f} '
+              f'{baseline / per_rcpt:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
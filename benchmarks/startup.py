@@ -0,0 +1,189 @@
+"""
+Measure the time from starting the service to its first accepted connection.
+
+The service (app.py) is started in a new process, and connections are
+attempted on its SMTP port until one is answered with the 220 greeting.
+The time from starting the process to reading the greeting is reported for
+each run, with the median, as is the median of each phase of the startup
+profile that the service logs once it has warmed up (which includes the S3
+client, created in the background once the port is bound).  No S3 service is
+needed, as the S3 client makes no requests until a message is stored.  Any
+smtp2s3 environment variables that are set are passed on to the service.
+
+The results can be written to a JSON file and compared with those of an
+earlier run, as with benchmarks/load.py.  Run from the root of the
+repository with, for example:
+
+    PYTHONPATH=. python benchmarks/startup.py --output startup.json
+    PYTHONPATH=. python benchmarks/startup.py --compare startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import smtp2s3
+
+PHASE = re.compile(r'(\w+) ([\d.]+)s')
+TIMEOUT = 30
+
+
+def free_port() -> int:
+    """Get a free TCP port on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def greeted(port: int) -> bool:
+    """Check if a connection to a port is answered with a 220 greeting."""
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+            return sock.recv(1024).startswith(b'220')
+    except OSError:
+        return False
+
+
+def read_phases(process: subprocess.Popen) -> dict:
+    """Read the log of the service until it is warmed up, for its phases."""
+    for line in process.stderr:
+        if 'Warmed up after ' in line:
+            phases = line.partition('(')[2]
+            return {name: float(seconds)
+                    for name, seconds in PHASE.findall(phases)}
+
+    return {}
+
+
+def start_once() -> tuple[float, dict]:
+    """
+    Start the service and time its first accepted connection.
+
+    Returns
+    -------
+    tuple[float, dict]
+        The seconds to the greeting and the seconds of each phase logged.
+
+    Raises
+    ------
+    TimeoutError
+        If no connection is accepted within the timeout.
+    """
+    port = free_port()
+    environ = {
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://startup/{YYYY}/{MM}/{dd}',
+        **os.environ,
+        'LOG_LEVEL': 'INFO',
+        'SMTP_DRAIN_DELAY': '0',
+        'SMTP_PORT': str(port),
+        'SMTP_WORKERS': '1'
+    }
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], env=environ,
+                               stderr=subprocess.PIPE, text=True)
+
+    try:
+        while not greeted(port):
+            if time.perf_counter() - start > TIMEOUT:
+                raise TimeoutError('The service did not accept a connection.')
+
+            time.sleep(0.001)
+
+        elapsed = time.perf_counter() - start
+        phases = read_phases(process)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.communicate(timeout=TIMEOUT)
+
+    return elapsed, phases
+
+
+def run(options: argparse.Namespace) -> dict:
+    """
+    Start the service a number of times.
+
+    Parameters
+    ----------
+    options : argparse.Namespace
+        The options of the benchmark.
+
+    Returns
+    -------
+    dict
+        The results.
+    """
+    times = []
+    phases = {}
+
+    for _ in range(options.runs):
+        elapsed, run_phases = start_once()
+        times.append(elapsed)
+
+        for name, seconds in run_phases.items():
+            phases.setdefault(name, []).append(seconds)
+
+    return {
+        'version': smtp2s3.__version__,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'runs': options.runs,
+        'first_connection_ms': [round(value * 1000, 1) for value in times],
+        'median_ms': round(statistics.median(times) * 1000, 1),
+        'phase_ms': {name: round(statistics.median(values) * 1000, 1)
+                     for name, values in phases.items()}
+    }
+
+
+def compare(results: dict, path: str) -> None:
+    """Print the ratio of the median times to those of a baseline."""
+    with open(path) as stream:
+        baseline = json.load(stream)
+
+    print(f'Compared with v{baseline["version"]} ({path}):')
+    old = dict(baseline['phase_ms'], first_connection=baseline['median_ms'])
+    new = dict(results['phase_ms'], first_connection=results['median_ms'])
+
+    for name, value in new.items():
+        if value and old.get(name):
+            print(f'  {name:>16} {old[name]:>8} -> {value:>8} ms '
+                  f'({value / old[name]:.2f}x)')
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the command line options."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='the number of times to start the service')
+    parser.add_argument('--output', help='a file to write the results to')
+    parser.add_argument('--compare', help='the results of an earlier run')
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> None:
+    """Run the benchmark and report the results."""
+    options = parse_args(argv)
+    results = run(options)
+    phases = ', '.join(f'{name} {value} ms'
+                       for name, value in results['phase_ms'].items())
+    print(f'First connection accepted after {results["median_ms"]} ms '
+          f'(median of {options.runs} runs)')
+    print(f'Startup phases: {phases}')
+
+    if options.output:
+        with open(options.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,9 +1,16 @@
 """A module for receiving SMTP messages and loading onto S3."""
+import functools
 import logging
 import os
 import re
 
+from smtp2s3.workers import available_cpus
+
 __version__ = '0.2.0'
+DNSBL_STAGES = ('MAIL', 'RCPT', 'DATA')
+EVENT_LOOPS = ('asyncio', 'uvloop')
+S3_RETRY_MODES = ('legacy', 'standard', 'adaptive')
+STORAGE_LAYOUTS = ('pair', 'batch', 'single')
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -30,18 +37,179 @@ class EnvironmentConfig:
 
     Attributes
     ----------
+    attachment_cache_size : int
+        The number of stored MIME parts to remember, so that they are not
+        looked up in S3 again.
+    attachment_min_size : int
+        The size in bytes of the smallest MIME part to store once in its
+        own object.  If 0, parts are stored within their messages.
+    attachment_prefix : str
+        The S3 URL to store MIME parts under, or None for "attachments/" in
+        the bucket of the messages.
+    batch_max_age : float
+        The number of seconds after which a batch archive is flushed.
+    batch_max_bytes : int
+        The size in bytes at which a batch archive is flushed.
+    cidr_allow : list[str]
+        CIDR ranges that peers are always accepted from, without DNSBL
+        checks.
+    cidr_allow_file : str
+        A file of further CIDR ranges to allow, one per line, or None.
+    cidr_deny : list[str]
+        CIDR ranges that peers are always rejected from.
+    cidr_deny_file : str
+        A file of further CIDR ranges to deny, one per line, or None.
+    compression_codec : str
+        The codec to compress messages with.  One of "gzip", "zstd" or
+        "none".
+    compression_level : int
+        The compression level.  None for the codec's default.
+    compression_min_size : int
+        The size in bytes below which messages are not compressed.
+    compression_workers : int
+        The number of processes (of each SMTP worker) to compress messages
+        in.  If 0, messages are compressed in threads instead.
+    dedup_cache_size : int
+        The number of stored deliveries to remember, so that a retry of one
+        is acknowledged without being stored again.  If 0, retries are
+        stored again.
+    dedup_database : str
+        The path of an SQLite database on local disk to share the
+        remembered deliveries between worker processes in, or None for none.
+    dnsbl_breaker_cooldown : float
+        The number of seconds to skip a failing DNSBL zone for.
+    dnsbl_breaker_threshold : int
+        The number of failures in a row after which a DNSBL zone is skipped.
+    dnsbl_cache_size : int
+        The maximum number of DNSBL answers to cache.
+    dnsbl_cache_ttl : int
+        The number of seconds to cache a DNSBL listing for when the resolver
+        does not give the TTL of the record.
+    dnsbl_deadline : float
+        The number of seconds to wait for all of the DNSBL zones.
+    dnsbl_negative_ttl : int
+        The number of seconds to cache an IP not being listed for.
+    dnsbl_stage : str
+        The SMTP command at which a peer listed in a DNSBL zone is rejected.
+        One of "MAIL", "RCPT" or "DATA".
+    dnsbl_timeout : float
+        The number of seconds to wait for each DNSBL zone.
     dnsbl_zones : list[str]
         DNSBL Zones to test the session peer IP against.
+    event_loop : str
+        The event loop to run on.  One of "asyncio" or "uvloop".
+    http_port : int
+        The port number to answer probes and metrics scrapes on, or None for
+        none.
     log_level : int
         The log level to run at.
+    manifest_enabled : bool
+        True to also list the messages stored in each partition in
+        manifests.
+    manifest_max_age : float
+        The number of seconds after which a manifest is flushed.
+    manifest_max_bytes : int
+        The size in bytes at which a manifest is flushed.
+    s3_breaker_cooldown : float
+        The number of seconds to refuse uploads for once the circuit breaker
+        around S3 opens.
+    s3_breaker_threshold : float
+        The share of recent uploads failing, from 0 to 1, at which the
+        circuit breaker around S3 opens, or 0 for no breaker.
+    s3_breaker_window : int
+        The number of recent uploads to take the share failing of.
+    s3_connect_timeout : float
+        The number of seconds to wait for a connection to S3.
+    s3_latency_target : float
+        The number of seconds an S3 upload may take before the number of
+        uploads run at once is decreased, or 0 for no target.
+    s3_max_attempts : int
+        The maximum number of attempts at an S3 request, including the first.
+    s3_max_pool_connections : int
+        The maximum number of connections to S3 to keep in the pool.
+    s3_max_uploads : int
+        The maximum number of S3 uploads to have in flight at once.
+    s3_min_uploads : int
+        The number of S3 uploads run at once that the adaptive limit may
+        fall to.
+    s3_prewarm_connections : int
+        The number of connections to S3 to open before reporting ready.
+    s3_read_timeout : float
+        The number of seconds to wait for S3 to answer a request.
+    s3_retry_mode : str
+        How failed S3 requests are retried.  One of "legacy", "standard" or
+        "adaptive".
+    s3_shard_count : int
+        The number of shards for the {shard} token of the S3 prefix pattern.
+    s3_tcp_keepalive : bool
+        True if TCP keep-alive is enabled on the connections to S3.
     smtp_data_size_limit : int
         The maximum size in bytes for a message to be accepted.
+    smtp_drain_delay : float
+        The number of seconds between reporting not ready and no longer
+        accepting connections when stopping.
+    smtp_drain_timeout : float
+        The number of seconds to wait for messages being received to finish
+        when stopping.
     smtp_hostname : str
         The hostname to listen on for SMTPD.
+    smtp_max_bytes_in_flight : int
+        The bytes of messages received but not yet stored at which new
+        sessions and messages are refused, or 0 for no limit.
+    smtp_max_sessions : int
+        The maximum number of SMTP sessions open at once, or 0 for no limit.
+    smtp_max_sessions_per_ip : int
+        The maximum number of SMTP sessions open from one address, or 0 for
+        no limit.
+    smtp_max_upload_backlog : int
+        The number of uploads waiting for a free slot at which new sessions
+        and messages are refused, or 0 for no limit.
     smtp_port : int
         The port number to listen on for SMTPD.
+    smtp_rate_burst : int
+        The number of messages that an address may send at once before
+        smtp_rate_limit applies.
+    smtp_rate_limit : float
+        The number of messages per second allowed from one address, or 0 for
+        no limit.
+    smtp_rcpt_pattern : str
+        The regex to match recipient emails against.
     smtp_rcpt_regex : re.Pattern
-        The compiled regex to match recipient emails against.
+        The compiled regex to match recipient emails against, compiled when
+        first used.
+    smtp_recipient_cache_size : int
+        The maximum number of recipient regex verdicts to cache.  If 0,
+        none are cached.
+    smtp_recipients : list[str]
+        Recipient addresses, domains and wildcard domains that are accepted
+        without matching the recipient regex.
+    smtp_streaming : bool
+        True if message content is to be uploaded to S3 as it arrives.
+    smtp_streaming_part_size : int
+        The size in bytes of the parts of a streamed multipart upload.
+    smtp_workers : int
+        The number of worker processes to share the SMTP port between.  If
+        1, the service runs in a single process.
+    spool_commit_interval : float
+        The number of seconds to batch spool appends for before flushing
+        them to disk.
+    spool_directory : str
+        The directory to spool messages to before uploading them to S3.
+        None if messages are to be uploaded directly.
+    spool_drain_batch : int
+        The number of spooled messages to upload at once.
+    spool_max_attempts : int
+        The number of times a spooled message may fail to upload (other
+        than while S3 is unavailable) before it is moved to the dead
+        letters.  If 0, it is retried without limit.
+    spool_max_bytes : int
+        The bytes of spool segments on disk at which further messages are
+        refused.  If 0, there is no limit.
+    spool_segment_size : int
+        The size in bytes after which a new spool segment is started.
+    storage_layout : str
+        How messages are laid out in S3.  One of "pair", "batch" or
+        "single".
 
     Parameters
     ----------
@@ -52,29 +220,282 @@ class EnvironmentConfig:
 
     def __init__(self, environ: dict = os.environ) -> None:
         self._environ = environ
+        self.attachment_cache_size = int(
+            environ.get('ATTACHMENT_CACHE_SIZE', '10000')
+        )
+        self.attachment_min_size = int(
+            environ.get('ATTACHMENT_MIN_SIZE', '0')
+        )
+        self.attachment_prefix = environ.get('ATTACHMENT_PREFIX', None)
         self.aws_access_key_id = environ.get('AWS_ACCESS_KEY_ID', None)
         self.aws_secret_access_key = environ.get('AWS_SECRET_ACCESS_KEY', None)
+        self.batch_max_age = float(environ.get('BATCH_MAX_AGE', '5'))
+        self.batch_max_bytes = int(
+            environ.get(
+                'BATCH_MAX_BYTES',
+                str(16 * 1024 * 1024)
+            )
+        )
+        self.cidr_allow = environ.get('CIDR_ALLOW', '').split(',')
+        self.cidr_allow_file = environ.get('CIDR_ALLOW_FILE', None)
+        self.cidr_deny = environ.get('CIDR_DENY', '').split(',')
+        self.cidr_deny_file = environ.get('CIDR_DENY_FILE', None)
+        self.compression_codec = self._get_compression_codec()
+        self.compression_level = environ.get('COMPRESSION_LEVEL', None)
+
+        if self.compression_level is not None:
+            self.compression_level = int(self.compression_level)
+
+        self.compression_min_size = int(
+            environ.get('COMPRESSION_MIN_SIZE', '0')
+        )
+        self.dedup_cache_size = int(environ.get('DEDUP_CACHE_SIZE', '0'))
+        self.dedup_database = environ.get('DEDUP_DATABASE', None)
+        self.dnsbl_breaker_cooldown = float(
+            environ.get('DNSBL_BREAKER_COOLDOWN', '60')
+        )
+        self.dnsbl_breaker_threshold = int(
+            environ.get('DNSBL_BREAKER_THRESHOLD', '5')
+        )
+        self.dnsbl_cache_size = int(environ.get('DNSBL_CACHE_SIZE', '10000'))
+        self.dnsbl_cache_ttl = int(environ.get('DNSBL_CACHE_TTL', '300'))
+        self.dnsbl_deadline = float(environ.get('DNSBL_DEADLINE', '5'))
+        self.dnsbl_negative_ttl = int(
+            environ.get('DNSBL_NEGATIVE_TTL', '60')
+        )
+        self.dnsbl_stage = self._get_dnsbl_stage()
+        self.dnsbl_timeout = float(environ.get('DNSBL_TIMEOUT', '2'))
         self.dnsbl_zones = environ.get('DNSBL_ZONES', '').split(',')
+        self.event_loop = self._get_event_loop()
+        self.http_port = environ.get('HTTP_PORT', None)
+
+        if self.http_port is not None:
+            self.http_port = int(self.http_port)
+
         self.log_level = self._get_log_level()
+        self.manifest_enabled = environ.get(
+            'MANIFEST_ENABLED', 'false').lower() == 'true'
+        self.manifest_max_age = float(environ.get('MANIFEST_MAX_AGE', '60'))
+        self.manifest_max_bytes = int(
+            environ.get(
+                'MANIFEST_MAX_BYTES',
+                str(8 * 1024 * 1024)
+            )
+        )
+        self.s3_breaker_cooldown = float(
+            environ.get('S3_BREAKER_COOLDOWN', '30')
+        )
+        self.s3_breaker_threshold = float(
+            environ.get('S3_BREAKER_THRESHOLD', '0.5')
+        )
+        self.s3_breaker_window = int(environ.get('S3_BREAKER_WINDOW', '20'))
+        self.s3_connect_timeout = float(
+            environ.get('S3_CONNECT_TIMEOUT', '60')
+        )
         self.s3_endpoint_url = environ.get('S3_ENDPOINT_URL', None)
+        self.s3_latency_target = float(
+            environ.get('S3_LATENCY_TARGET', '5')
+        )
+        self.s3_max_attempts = int(environ.get('S3_MAX_ATTEMPTS', '3'))
+        self.s3_max_uploads = int(environ.get('S3_MAX_UPLOADS', '10'))
+        self.s3_max_pool_connections = int(
+            environ.get('S3_MAX_POOL_CONNECTIONS', str(self.s3_max_uploads))
+        )
+        self.s3_min_uploads = int(environ.get('S3_MIN_UPLOADS', '1'))
         self.s3_prefix_pattern = environ.get('S3_PREFIX_PATTERN')
+        self.s3_prewarm_connections = int(
+            environ.get('S3_PREWARM_CONNECTIONS', '0')
+        )
+        self.s3_read_timeout = float(environ.get('S3_READ_TIMEOUT', '60'))
+        self.s3_retry_mode = self._get_s3_retry_mode()
+        self.s3_shard_count = int(environ.get('S3_SHARD_COUNT', '16'))
+        self.s3_tcp_keepalive = environ.get(
+            'S3_TCP_KEEPALIVE', 'true').lower() == 'true'
         self.smtp_data_size_limit = int(
             environ.get(
                 'SMTP_DATA_SIZE_LIMIT',
                 str(10 * 1024 * 1024)
             )
         )
+        self.smtp_drain_delay = float(environ.get('SMTP_DRAIN_DELAY', '5'))
+        self.smtp_drain_timeout = float(
+            environ.get('SMTP_DRAIN_TIMEOUT', '20')
+        )
         self.smtp_hostname = environ.get('SMTP_HOSTNAME', '127.0.0.1')
+        self.smtp_max_bytes_in_flight = int(
+            environ.get('SMTP_MAX_BYTES_IN_FLIGHT', '0')
+        )
+        self.smtp_max_sessions = int(environ.get('SMTP_MAX_SESSIONS', '0'))
+        self.smtp_max_sessions_per_ip = int(
+            environ.get('SMTP_MAX_SESSIONS_PER_IP', '0')
+        )
+        self.smtp_max_upload_backlog = int(
+            environ.get('SMTP_MAX_UPLOAD_BACKLOG', '0')
+        )
         self.smtp_port = int(environ.get('SMTP_PORT', '8025'))
+        self.smtp_rate_burst = int(environ.get('SMTP_RATE_BURST', '10'))
+        self.smtp_rate_limit = float(environ.get('SMTP_RATE_LIMIT', '0'))
         default_regex = """
         (?:[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\\.[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9!#$%&'*+/=?^_`{|}~-]+)*|"(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|\\[\x01-\x09\x0b\x0c\x0e-\x7f])*")@(?:(?:[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9](?:[\u00A0-\uD7FF\uE000-\uFFFF-a-z0-9-]*[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9])?\\.)+[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9](?:[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9-]*[\u00A0-\uD7FF\uE000-\uFFFFa-z0-9])?|\\[(?:(?:(2(5[0-5]|[0-4][0-9])|1[0-9][0-9]|[1-9]?[0-9]))\\.){3}\\])
         """.replace(' ', '')
-        self.smtp_rcpt_regex = re.compile(
+        self.smtp_rcpt_pattern = environ.get(
+            'SMTP_RECIPIENT_REGEX',
+            default_regex
+        )
+
+        if 'SMTP_RECIPIENT_REGEX' in environ:
+            # Fail now on an invalid regex, leaving the default until used.
+            self.smtp_rcpt_regex
+
+        self.smtp_recipient_cache_size = int(
+            environ.get('SMTP_RECIPIENT_CACHE_SIZE', '0')
+        )
+        self.smtp_recipients = environ.get('SMTP_RECIPIENTS', '').split(',')
+        self.smtp_streaming = environ.get(
+            'SMTP_STREAMING', 'false').lower() == 'true'
+        self.smtp_streaming_part_size = int(
             environ.get(
-                'SMTP_RECIPIENT_REGEX',
-                default_regex
+                'SMTP_STREAMING_PART_SIZE',
+                str(8 * 1024 * 1024)
             )
         )
+        self.smtp_workers = int(
+            environ.get('SMTP_WORKERS', str(available_cpus()))
+        )
+        self.spool_commit_interval = float(
+            environ.get('SPOOL_COMMIT_INTERVAL', '0.01')
+        )
+        self.spool_directory = environ.get('SPOOL_DIRECTORY', None)
+        self.spool_drain_batch = int(environ.get('SPOOL_DRAIN_BATCH', '100'))
+        self.spool_max_attempts = int(environ.get('SPOOL_MAX_ATTEMPTS', '5'))
+        self.spool_max_bytes = int(environ.get('SPOOL_MAX_BYTES', '0'))
+        self.spool_segment_size = int(
+            environ.get(
+                'SPOOL_SEGMENT_SIZE',
+                str(64 * 1024 * 1024)
+            )
+        )
+        self.storage_layout = self._get_storage_layout()
+        self.compression_workers = self._get_compression_workers()
+
+    @functools.cached_property
+    def smtp_rcpt_regex(self) -> re.Pattern:
+        """
+        Compile the regex to match recipient emails against.
+
+        The default regex takes longer to compile than the rest of the
+        config takes to read, so it is only compiled once it is used.
+
+        Returns
+        -------
+        re.Pattern
+            The compiled regex.
+        """
+        return re.compile(self.smtp_rcpt_pattern)
+
+    def _check_zstandard(self) -> None:
+        """Check that the zstandard package for the zstd codec is installed."""
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            message = 'Environment COMPRESSION_CODEC ("zstd") requires the '
+            message += 'zstandard package.  Install it with "pip install '
+            message += 'zstandard" or "pip install -r requirements.txt".'
+            raise ValueError(message)
+
+    def _get_compression_codec(self) -> str:
+        """
+        Get the codec to compress messages with.
+
+        Returns
+        -------
+        str
+            One of the values in smtp2s3.codec.CODECS.
+
+        Raises
+        ------
+        ValueError
+            If the codec provided is not valid, or its package is not
+            installed.
+        """
+        from smtp2s3.codec import CODECS
+
+        codec = self._environ.get('COMPRESSION_CODEC', 'gzip').lower()
+
+        if codec not in CODECS:
+            valid_names = ', '.join(CODECS)
+            message = f'Environment COMPRESSION_CODEC ("{codec}") is '
+            message += f'invalid.  Must be one of {valid_names}.'
+            raise ValueError(message)
+        elif codec == 'zstd':
+            self._check_zstandard()
+
+        return codec
+
+    def _get_compression_workers(self) -> int:
+        """
+        Get the number of processes to compress messages in.
+
+        By default, the CPUs available are shared between the SMTP workers,
+        each keeping one CPU for itself and compressing in processes on the
+        rest.  So that is 0 (compressing in threads) when there are as many
+        SMTP workers as CPUs.
+
+        Returns
+        -------
+        int
+            The number of processes of each SMTP worker.
+        """
+        default = max(available_cpus() // self.smtp_workers - 1, 0)
+        return int(self._environ.get('COMPRESSION_WORKERS', str(default)))
+
+    def _get_dnsbl_stage(self) -> str:
+        """
+        Get the SMTP command at which DNSBL listed peers are rejected.
+
+        Returns
+        -------
+        str
+            One of the values in DNSBL_STAGES.
+
+        Raises
+        ------
+        ValueError
+            If the stage provided is not valid.
+        """
+        dnsbl_stage = self._environ.get('DNSBL_STAGE', 'MAIL').upper()
+
+        if dnsbl_stage not in DNSBL_STAGES:
+            valid_names = ', '.join(DNSBL_STAGES)
+            message = f'Environment DNSBL_STAGE ("{dnsbl_stage}") is '
+            message += f'invalid.  Must be one of {valid_names}.'
+            raise ValueError(message)
+
+        return dnsbl_stage
+
+    def _get_event_loop(self) -> str:
+        """
+        Get the event loop to run on.
+
+        Returns
+        -------
+        str
+            One of the values in EVENT_LOOPS.
+
+        Raises
+        ------
+        ValueError
+            If the event loop provided is not valid.
+        """
+        event_loop = self._environ.get('EVENT_LOOP', 'asyncio').lower()
+
+        if event_loop not in EVENT_LOOPS:
+            valid_names = ', '.join(EVENT_LOOPS)
+            message = f'Environment EVENT_LOOP ("{event_loop}") is '
+            message += f'invalid.  Must be one of {valid_names}.'
+            raise ValueError(message)
+
+        return event_loop
 
     def _get_log_level(self) -> int:
         """
@@ -102,3 +523,51 @@ class EnvironmentConfig:
             raise ValueError(message)
 
         return log_level
+
+    def _get_s3_retry_mode(self) -> str:
+        """
+        Get how failed S3 requests are retried.
+
+        Returns
+        -------
+        str
+            One of the values in S3_RETRY_MODES.
+
+        Raises
+        ------
+        ValueError
+            If the retry mode provided is not valid.
+        """
+        retry_mode = self._environ.get('S3_RETRY_MODE', 'adaptive').lower()
+
+        if retry_mode not in S3_RETRY_MODES:
+            valid_names = ', '.join(S3_RETRY_MODES)
+            message = f'Environment S3_RETRY_MODE ("{retry_mode}") is '
+            message += f'invalid.  Must be one of {valid_names}.'
+            raise ValueError(message)
+
+        return retry_mode
+
+    def _get_storage_layout(self) -> str:
+        """
+        Get how messages are to be laid out in S3.
+
+        Returns
+        -------
+        str
+            One of the values in STORAGE_LAYOUTS.
+
+        Raises
+        ------
+        ValueError
+            If the storage layout provided is not valid.
+        """
+        storage_layout = self._environ.get('STORAGE_LAYOUT', 'pair')
+
+        if storage_layout not in STORAGE_LAYOUTS:
+            valid_names = ', '.join(STORAGE_LAYOUTS)
+            message = f'Environment STORAGE_LAYOUT ("{storage_layout}") is '
+            message += f'invalid.  Must be one of {valid_names}.'
+            raise ValueError(message)
+
+        return storage_layout
@@ -0,0 +1,263 @@
+"""Limit the sessions and messages admitted, shedding load early."""
+import collections
+import math
+import time
+from typing import Callable, Optional
+
+from smtp2s3.metrics import ADMISSION_REJECTIONS
+
+OVERLOADED = '421 4.3.2 System overloaded, try again later'
+RATE_LIMITED = '451 4.7.1 Rate limit exceeded, try again later'
+STORAGE_UNAVAILABLE = '451 4.3.0 Storage unavailable, try again later'
+TOO_BUSY = '451 4.3.2 System busy, try again later'
+TOO_MANY_SESSIONS = '421 4.7.0 Too many connections, try again later'
+
+
+class TokenBucket:
+    """
+    A token bucket, refilled at a steady rate up to its burst size.
+
+    Parameters
+    ----------
+    rate : float
+        The number of tokens added per second.
+    burst : int
+        The maximum number of tokens held, which the bucket starts with.
+    clock : Callable[[], float], optional
+        The clock to measure the refill with, by default time.monotonic.
+    """
+
+    def __init__(self, rate: float, burst: int,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.burst = burst
+        self.rate = rate
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def take(self) -> bool:
+        """
+        Take a token, if there is one.
+
+        Returns
+        -------
+        bool
+            True if a token was taken, False if the bucket is empty.
+        """
+        if self._refill() < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    def _refill(self) -> float:
+        """Add the tokens due since the last refill, returning the total."""
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        return self._tokens
+
+
+class AdmissionControl:
+    """
+    Admit sessions and messages only while the service has room for them.
+
+    A new session is refused with a 421 if the maximum number of sessions
+    (or of sessions from the peer's address) are already open, or if the
+    service is overloaded.  A new message (at MAIL FROM) is refused with a
+    451 if the peer has used up its rate or if the service is overloaded.
+    The service is overloaded while the uploads waiting for a free slot, or
+    the bytes of messages received but not yet stored, are at their maximum.
+    A new message is also refused with a 451 while the circuit breaker of
+    the uploader is open, unless messages are stored without uploading them
+    first (as with a spool).
+
+    Refusing early in the dialogue costs far less than accepting DATA that
+    cannot be stored in time, and the peer is told to retry later rather
+    than left to time out.  A limit of 0 disables it.
+
+    Attributes
+    ----------
+    bytes_in_flight : int
+        The bytes of messages received but not yet stored.
+    sessions : int
+        The number of sessions open.
+
+    Parameters
+    ----------
+    max_sessions : int, optional
+        The maximum number of sessions open at once, by default 0.
+    max_sessions_per_ip : int, optional
+        The maximum number of sessions open from one address, by default 0.
+    rate : float, optional
+        The number of messages per second allowed from one address, by
+        default 0.
+    burst : int, optional
+        The number of messages that an address may send at once before the
+        rate applies, by default 10.
+    max_upload_backlog : int, optional
+        The number of uploads waiting for a free slot at which the service
+        is overloaded, by default 0.
+    max_bytes_in_flight : int, optional
+        The bytes of messages not yet stored at which the service is
+        overloaded, by default 0.
+    uploader : Uploader, optional
+        The uploader to check the backlog and breaker of, by default None.
+    check_storage : bool, optional
+        False to admit messages while the breaker of the uploader is open,
+        by default True.
+    max_buckets : int, optional
+        The number of addresses to keep a token bucket for, dropping the
+        least recently used first, by default 10000.
+    clock : Callable[[], float], optional
+        The clock to refill the token buckets by, by default time.monotonic.
+    """
+
+    def __init__(self, max_sessions: int = 0, max_sessions_per_ip: int = 0,
+                 rate: float = 0, burst: int = 10,
+                 max_upload_backlog: int = 0, max_bytes_in_flight: int = 0,
+                 uploader: Optional[object] = None,
+                 check_storage: bool = True, max_buckets: int = 10000,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.bytes_in_flight = 0
+        self.sessions = 0
+        self._buckets = collections.OrderedDict()
+        self._burst = burst
+        self._check_storage = check_storage
+        self._clock = clock
+        self._max_buckets = max_buckets
+        self._max_bytes_in_flight = max_bytes_in_flight or math.inf
+        self._max_sessions = max_sessions or math.inf
+        self._max_sessions_per_ip = max_sessions_per_ip or math.inf
+        self._max_upload_backlog = max_upload_backlog or math.inf
+        self._peers = {}
+        self._rate = rate
+        self._uploader = uploader
+
+    def admit_message(self, peer_ip: str, limited: bool = True
+                      ) -> Optional[str]:
+        """
+        Check that a peer may start a new message.
+
+        Parameters
+        ----------
+        peer_ip : str
+            The address of the peer.
+        limited : bool, optional
+            False to exempt the peer from its rate, by default True.
+
+        Returns
+        -------
+        str
+            The reply refusing the message, or None if it is admitted.
+        """
+        if self.overloaded():
+            return self._refuse('overload', TOO_BUSY)
+        elif not self._storage_available():
+            return self._refuse('storage', STORAGE_UNAVAILABLE)
+        elif limited and not self._take_token(peer_ip):
+            return self._refuse('rate', RATE_LIMITED)
+
+        return None
+
+    def close(self, peer_ip: str) -> None:
+        """
+        Release a session admitted by open.
+
+        Parameters
+        ----------
+        peer_ip : str
+            The address of the peer.
+        """
+        self.sessions -= 1
+        count = self._peers.get(peer_ip, 0) - 1
+
+        if count > 0:
+            self._peers[peer_ip] = count
+        else:
+            self._peers.pop(peer_ip, None)
+
+    def open(self, peer_ip: str, limited: bool = True) -> Optional[str]:
+        """
+        Admit a new session, unless the limits have been reached.
+
+        Parameters
+        ----------
+        peer_ip : str
+            The address of the peer.
+        limited : bool, optional
+            False to exempt the peer from the maximum number of sessions per
+            address, by default True.
+
+        Returns
+        -------
+        str
+            The reply refusing the session, or None if it is admitted (and
+            must later be released with close).
+        """
+        reason = self._session_limit(peer_ip, limited)
+
+        if reason is not None:
+            return self._refuse(reason, TOO_MANY_SESSIONS)
+        elif self.overloaded():
+            return self._refuse('overload', OVERLOADED)
+
+        self.sessions += 1
+        self._peers[peer_ip] = self._peers.get(peer_ip, 0) + 1
+        return None
+
+    def overloaded(self) -> bool:
+        """
+        Check if the backlog of uploads or bytes is at its maximum.
+
+        Returns
+        -------
+        bool
+            True if new work is to be refused.
+        """
+        if self.bytes_in_flight >= self._max_bytes_in_flight:
+            return True
+
+        return (self._uploader is not None
+                and self._uploader.waiting >= self._max_upload_backlog)
+
+    def _refuse(self, reason: str, reply: str) -> str:
+        """Count a refusal and return its reply."""
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        return reply
+
+    def _session_limit(self, peer_ip: str, limited: bool) -> Optional[str]:
+        """Get the session limit that has been reached, if any."""
+        if self.sessions >= self._max_sessions:
+            return 'sessions'
+        elif limited and self._peers.get(peer_ip, 0) >= (
+            self._max_sessions_per_ip
+        ):
+            return 'peer_sessions'
+
+        return None
+
+    def _storage_available(self) -> bool:
+        """Check that the breaker of the uploader is not refusing uploads."""
+        return (not self._check_storage or self._uploader is None
+                or self._uploader.available())
+
+    def _take_token(self, peer_ip: str) -> bool:
+        """Take a token from the bucket of a peer, if rates are limited."""
+        if not self._rate:
+            return True
+
+        bucket = self._buckets.get(peer_ip)
+
+        if bucket is not None:
+            self._buckets.move_to_end(peer_ip)
+        else:
+            if len(self._buckets) >= self._max_buckets:
+                self._buckets.popitem(last=False)
+
+            bucket = self._buckets[peer_ip] = TokenBucket(
+                self._rate, self._burst, self._clock
+            )
+
+        return bucket.take()
@@ -0,0 +1,337 @@
+"""Store large MIME parts once each, as content-addressed objects."""
+import asyncio
+import hashlib
+import re
+from typing import Any, Callable, Coroutine, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+
+from smtp2s3.codec import SUFFIXES, Compressor, decompress
+from smtp2s3.dedup import DedupIndex
+from smtp2s3.headers import HEADER_END, parse_headers
+from smtp2s3.metrics import ATTACHMENTS
+
+BOUNDARY = re.compile(r'boundary\s*=\s*(?:"([^"]+)"|([^\s;]+))', re.I)
+LINE_BREAK = re.compile(rb'\r?\n')
+
+
+def join_parts(skeleton: bytes, parts: Iterable[tuple[int, bytes]]) -> bytes:
+    """
+    Put the bodies of the parts removed by split_parts back in a message.
+
+    Parameters
+    ----------
+    skeleton : bytes
+        The message with the bodies removed.
+    parts : Iterable[tuple[int, bytes]]
+        The offset in the skeleton and the body of each part, in order.
+
+    Returns
+    -------
+    bytes
+        The message as it was before it was split.
+    """
+    chunks = []
+    last = 0
+
+    for offset, body in parts:
+        chunks.extend([skeleton[last:offset], body])
+        last = offset
+
+    chunks.append(skeleton[last:])
+    return b''.join(chunks)
+
+
+def large_parts(content: bytes, min_size: int, start: int = 0,
+                end: Optional[int] = None,
+                nested: bool = False) -> list[tuple[int, int]]:
+    """
+    Find the bodies of the MIME parts of a message of at least a size.
+
+    The MIME structure is walked on the raw bytes, rather than with the
+    email package, so that the offsets are exact.  Only the leaf parts of
+    a multipart message are found, never the body of the message itself.
+
+    Parameters
+    ----------
+    content : bytes
+        The content of the message.
+    min_size : int
+        The size in bytes of the smallest body to find.
+    start : int, optional
+        The offset of the entity to search, by default 0.
+    end : int, optional
+        The end of the entity to search, by default that of the content.
+    nested : bool, optional
+        True if the entity is a part of a multipart, by default False.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The start and end offsets of each body found, in order.
+    """
+    end = len(content) if end is None else end
+    body = _body_start(content, start, end)
+    boundary = _boundary(content[start:body])
+
+    if boundary is None:
+        return _large_leaf(body, end, min_size, nested)
+
+    spans = []
+
+    for part_start, part_end in _subparts(content, boundary, body, end):
+        spans.extend(
+            large_parts(content, min_size, part_start, part_end, True)
+        )
+
+    return spans
+
+
+def read_attachments(client: Any, skeleton: bytes, parts: list[dict]) -> bytes:
+    """
+    Fetch the parts of a stored message to restore it byte for byte.
+
+    Parameters
+    ----------
+    client : Any
+        A boto3 S3 client.
+    skeleton : bytes
+        The content of the stored message, as decompressed.
+    parts : list[dict]
+        The "attachments" of the message metadata.
+
+    Returns
+    -------
+    bytes
+        The content of the message as it was received.
+
+    Raises
+    ------
+    ValueError
+        If a part fetched does not match its digest.
+    """
+    bodies = []
+
+    for part in parts:
+        parse_result = urlparse(part['path'])
+        response = client.get_object(Bucket=parse_result.netloc,
+                                     Key=parse_result.path.lstrip('/'))
+        body = decompress(part['compression'], response['Body'].read())
+
+        if hashlib.sha256(body).hexdigest() != part['sha256']:
+            raise ValueError(f'Part "{part["path"]}" does not match.')
+
+        bodies.append((part['offset'], body))
+
+    return join_parts(skeleton, bodies)
+
+
+def split_parts(content: bytes,
+                min_size: int) -> tuple[bytes, list[tuple[int, bytes]]]:
+    """
+    Remove the bodies of the MIME parts of a message of at least a size.
+
+    Parameters
+    ----------
+    content : bytes
+        The content of the message.
+    min_size : int
+        The size in bytes of the smallest body to remove.
+
+    Returns
+    -------
+    tuple[bytes, list[tuple[int, bytes]]]
+        The message with the bodies removed (its skeleton) and, for each
+        body, its offset in the skeleton and its content.
+    """
+    chunks = []
+    parts = []
+    last = 0
+    offset = 0
+
+    for start, end in large_parts(content, min_size):
+        chunks.append(content[last:start])
+        offset += start - last
+        parts.append((offset, content[start:end]))
+        last = end
+
+    chunks.append(content[last:])
+    return b''.join(chunks), parts
+
+
+def _body_start(content: bytes, start: int, end: int) -> int:
+    """Get the offset of the body of an entity, after its headers."""
+    blank = LINE_BREAK.match(content, start, end)
+
+    if blank is not None:
+        return blank.end()
+
+    match = HEADER_END.search(content, start, end)
+    return end if match is None else match.end()
+
+
+def _boundary(header_block: bytes) -> Optional[bytes]:
+    """Get the boundary of a multipart entity, or None if it is not one."""
+    content_type = parse_headers(header_block).get('Content-Type', '')
+    match = BOUNDARY.search(content_type)
+
+    if match is None or not content_type.lower().startswith('multipart/'):
+        return None
+
+    boundary = match.group(1) or match.group(2)
+    return boundary.encode('ascii', 'surrogateescape')
+
+
+def _large_leaf(start: int, end: int, min_size: int,
+                nested: bool) -> list[tuple[int, int]]:
+    """Get the body of a leaf entity as a span, if it is to be split out."""
+    return [(start, end)] if nested and end - start >= min_size else []
+
+
+def _line_before(content: bytes, index: int) -> int:
+    """Get the offset of the line break that ends the line before one."""
+    index -= 1
+    return index - 1 if content[index - 1:index] == b'\r' else index
+
+
+def _subparts(content: bytes, boundary: bytes, start: int,
+              end: int) -> Iterator[tuple[int, int]]:
+    """Get the start and end offsets of each part of a multipart body."""
+    delimiter = re.compile(
+        rb'(?m)^--' + re.escape(boundary) + rb'(--)?[ \t]*\r?$'
+    )
+    previous = None
+
+    for match in delimiter.finditer(content, start, end):
+        if previous is not None:
+            yield previous.end() + 1, _line_before(content, match.start())
+
+        if match.group(1):
+            return
+
+        previous = match
+
+
+class AttachmentStore:
+    """
+    Split the large MIME parts out of messages and store each only once.
+
+    The body of each part of at least the minimum size is removed from the
+    message and written to its own object, named by the SHA-256 digest of
+    the body, unless that object already exists.  The paths of the objects
+    known to exist are cached, so that a part sent many times (such as the
+    attachment of a newsletter) is looked up and written only once.  Parts
+    being written are shared with any other message holding them.
+
+    Parameters
+    ----------
+    upload : Callable[[str, bytes], Coroutine]
+        A coroutine function that writes bytes to an S3 URL.
+    exists : Callable[[str], Coroutine]
+        A coroutine function that checks if an S3 URL exists.
+    compressor : Compressor
+        The compressor for the parts.
+    prefix : str
+        The S3 URL to write the parts under.
+    min_size : int
+        The size in bytes of the smallest part to split out.
+    cache_size : int
+        The maximum number of paths known to exist to cache.
+    """
+
+    def __init__(self, upload: Callable[[str, bytes], Coroutine[Any, Any, Any]],
+                 exists: Callable[[str], Coroutine[Any, Any, bool]],
+                 compressor: Compressor, prefix: str, min_size: int,
+                 cache_size: int) -> None:
+        self.min_size = min_size
+        self._compressor = compressor
+        self._exists = exists
+        self._known = DedupIndex(cache_size)
+        self._pending = {}
+        self._prefix = prefix
+        self._upload = upload
+
+    async def split(self, content: bytes, metadata: dict) -> bytes:
+        """
+        Store the large parts of a message, returning the rest of it.
+
+        The parts are recorded in the metadata under "attachments", each
+        with its offset in the rest of the message, its path, codec and
+        digest, to be restored with read_attachments.
+
+        Parameters
+        ----------
+        content : bytes
+            The content of the message.
+        metadata : dict
+            The metadata of the message.
+
+        Returns
+        -------
+        bytes
+            The message with the bodies of the large parts removed, or the
+            content as it is if it has none.
+        """
+        skeleton, parts = split_parts(content, self.min_size)
+
+        if not parts:
+            return content
+
+        metadata['attachments'] = await asyncio.gather(
+            *(self.store(offset, body) for offset, body in parts)
+        )
+        return skeleton
+
+    async def store(self, offset: int, body: bytes) -> dict:
+        """
+        Store the body of a part, unless it is already stored.
+
+        Parameters
+        ----------
+        offset : int
+            The offset of the part in the rest of the message.
+        body : bytes
+            The body of the part.
+
+        Returns
+        -------
+        dict
+            The reference to the part, for the metadata of the message.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        codec = self._compressor.codec_for(len(body))
+        path = f'{self._prefix}{digest}{SUFFIXES[codec]}'
+
+        if self._known.seen(path):
+            ATTACHMENTS.inc(result='cached')
+        else:
+            await asyncio.shield(self._write_once(path, body))
+
+        return {
+            'compression': codec,
+            'offset': offset,
+            'path': path,
+            'sha256': digest
+        }
+
+    def _write_once(self, path: str, body: bytes) -> asyncio.Future:
+        """Get the write of a part, sharing one already in progress."""
+        write = self._pending.get(path)
+
+        if write is None:
+            write = self._pending[path] = asyncio.ensure_future(
+                self._write(path, body)
+            )
+            write.add_done_callback(lambda _: self._pending.pop(path, None))
+
+        return write
+
+    async def _write(self, path: str, body: bytes) -> None:
+        """Write a part, unless its object exists already."""
+        if await self._exists(path):
+            ATTACHMENTS.inc(result='existing')
+        else:
+            _, data = await self._compressor.compress(body)
+            await self._upload(path, data)
+            ATTACHMENTS.inc(result='stored')
+
+        self._known.add(path)
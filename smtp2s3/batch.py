@@ -0,0 +1,195 @@
+"""Roll many messages into one S3 archive per partition."""
+import asyncio
+import json
+import uuid
+from logging import Logger
+from typing import Any, Callable, Coroutine
+from urllib.parse import urlparse
+
+from smtp2s3.codec import SUFFIXES, Compressor, decompress
+
+
+def read_message(client: Any, archive_path: str, offset: int, length: int,
+                 compression: str = 'gzip') -> bytes:
+    """
+    Fetch a single message from an archive with a ranged GET.
+
+    Parameters
+    ----------
+    client : Any
+        A boto3 S3 client.
+    archive_path : str
+        The S3 URL of the archive.
+    offset : int
+        The offset of the message in the archive, as found in the index.
+    length : int
+        The length of the message in the archive, as found in the index.
+    compression : str, optional
+        The codec the message was compressed with, as found in the index,
+        by default "gzip".
+
+    Returns
+    -------
+    bytes
+        The content of the message.
+    """
+    parse_result = urlparse(archive_path)
+    response = client.get_object(
+        Bucket=parse_result.netloc,
+        Key=parse_result.path.lstrip('/'),
+        Range=f'bytes={offset}-{offset + length - 1}'
+    )
+    return decompress(compression, response['Body'].read())
+
+
+class Batch:
+    """
+    The messages collected for one archive.
+
+    Attributes
+    ----------
+    archive : bytearray
+        The concatenated compressed members, one for each message.
+    entries : list[dict]
+        The index entries, one for each message.
+    flushed : asyncio.Future
+        Resolved once the archive and its index have been written.
+    timer : asyncio.TimerHandle
+        The timer that flushes the batch once it reaches its maximum age.
+    """
+
+    def __init__(self) -> None:
+        self.archive = bytearray()
+        self.entries = []
+        self.flushed = asyncio.get_running_loop().create_future()
+        self.timer = None
+
+
+class BatchWriter:
+    """
+    Collect messages into one archive per partition.
+
+    Each message is compressed as a separate gzip member (or zstd frame)
+    and appended to the archive for its partition, so the archive as a
+    whole is a valid compressed stream and any single message can be
+    fetched and decompressed on its own with a ranged GET.  Alongside each
+    archive an index is written holding the metadata, offset and length of
+    every message.
+
+    Parameters
+    ----------
+    upload : Callable[[str, bytes], Coroutine]
+        A coroutine function that writes bytes to an S3 URL.
+    compressor : Compressor
+        The compressor for the members of the archive.
+    logger : logging.Logger
+        A logger to be used.
+    max_bytes : int
+        The size in bytes at which an archive is flushed.
+    max_age : float
+        The number of seconds after its first message that an archive is
+        flushed.
+    """
+
+    def __init__(self, upload: Callable[[str, bytes], Coroutine[Any, Any, Any]],
+                 compressor: Compressor, logger: Logger, max_bytes: int,
+                 max_age: float) -> None:
+        self._batches = {}
+        self._compressor = compressor
+        self._flushes = set()
+        self._logger = logger
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._upload = upload
+
+    async def add(self, content: bytes, metadata: dict) -> str:
+        """
+        Add a message to the archive for its partition.
+
+        Returns once the archive holding the message has been written.
+
+        Parameters
+        ----------
+        content : bytes
+            The content of the message.
+        metadata : dict
+            The metadata of the message.  The partition is taken from the
+            path.
+
+        Returns
+        -------
+        str
+            The S3 URL of the archive holding the message.
+        """
+        codec, member = await self._compressor.compress(content, always=True)
+        partition = metadata['path'].rsplit('/', 1)[0] + '/'
+        batch = self._batch_for(partition)
+        entry = dict(metadata, compression=codec, offset=len(batch.archive),
+                     length=len(member))
+        batch.archive += member
+        batch.entries.append(entry)
+        flushed = batch.flushed
+
+        if len(batch.archive) >= self._max_bytes:
+            self._begin_flush(partition)
+
+        return await asyncio.shield(flushed)
+
+    async def stop(self) -> None:
+        """Flush every open archive."""
+        for partition in list(self._batches):
+            self._begin_flush(partition)
+
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _batch_for(self, partition: str) -> Batch:
+        """Get the open batch for a partition, starting one if required."""
+        batch = self._batches.get(partition)
+
+        if batch is None:
+            batch = Batch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                self._max_age, self._begin_flush, partition
+            )
+            self._batches[partition] = batch
+
+        return batch
+
+    def _begin_flush(self, partition: str) -> None:
+        """Start writing the open batch for a partition."""
+        batch = self._batches.pop(partition, None)
+
+        if batch is None:
+            return
+
+        batch.timer.cancel()
+        task = asyncio.get_running_loop().create_task(
+            self._flush(partition, batch)
+        )
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, partition: str, batch: Batch) -> None:
+        """Write the archive and index for a batch."""
+        name = f'{partition}batch-{uuid.uuid4()}'
+        archive_path = f'{name}.eml{SUFFIXES[self._compressor.codec]}'
+        index_path = f'{name}.idx.json'
+
+        for entry in batch.entries:
+            entry['path'] = archive_path
+
+        index = {'archive': archive_path, 'messages': batch.entries}
+        index_bytes = json.dumps(index, separators=(',', ':')).encode()
+
+        try:
+            await self._upload(archive_path, bytes(batch.archive))
+            await self._upload(index_path, index_bytes)
+        except Exception as ex:
+            self._logger.error(f'Unable to write "{archive_path}" {ex}.')
+            batch.flushed.set_exception(ex)
+            return
+
+        self._logger.debug(
+            f'Archived {len(batch.entries)} messages to "{archive_path}".'
+        )
+        batch.flushed.set_result(archive_path)
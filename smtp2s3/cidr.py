@@ -0,0 +1,190 @@
+"""Allow or deny peers by the CIDR ranges that their addresses fall in."""
+import ipaddress
+from typing import Iterable, Optional
+
+ALLOW = 'allow'
+DENY = 'deny'
+
+
+class PrefixTree:
+    """
+    A binary prefix tree of the networks of one IP version.
+
+    Each node is a list of its two children (for a 0 and a 1 bit) and the
+    value of the network ending at the node, if any.  A lookup walks the
+    bits of an address from the most significant, so it costs no more than
+    the length of the longest prefix held.
+
+    Parameters
+    ----------
+    bits : int
+        The number of bits in an address: 32 for IPv4 or 128 for IPv6.
+    """
+
+    def __init__(self, bits: int) -> None:
+        self._bits = bits
+        self._root = [None, None, None]
+
+    def add(self, network: int, prefixlen: int, value: str) -> None:
+        """
+        Add a network, replacing the value of any that is the same.
+
+        Parameters
+        ----------
+        network : int
+            The network address as an integer.
+        prefixlen : int
+            The length of the network prefix.
+        value : str
+            The value to find for addresses in the network.
+        """
+        node = self._root
+
+        for shift in range(self._bits - 1, self._bits - 1 - prefixlen, -1):
+            bit = (network >> shift) & 1
+
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+
+            node = node[bit]
+
+        node[2] = value
+
+    def lookup(self, address: int) -> Optional[str]:
+        """
+        Find the value of the longest network holding an address.
+
+        Parameters
+        ----------
+        address : int
+            The address as an integer.
+
+        Returns
+        -------
+        str or None
+            The value of the most specific network holding the address or
+            None if no network does.
+        """
+        node = self._root
+        value = node[2]
+
+        for shift in range(self._bits - 1, -1, -1):
+            node = node[(address >> shift) & 1]
+
+            if node is None:
+                break
+            elif node[2] is not None:
+                value = node[2]
+
+        return value
+
+
+class CIDRIndex:
+    """
+    An index of the CIDR ranges to allow and deny peers from.
+
+    Where ranges overlap, the most specific range decides.  A range that is
+    both allowed and denied is denied.
+
+    Parameters
+    ----------
+    allow : Iterable[str], optional
+        The CIDR ranges to allow, by default none.
+    deny : Iterable[str], optional
+        The CIDR ranges to deny, by default none.
+
+    Raises
+    ------
+    ValueError
+        If a range is not a valid IPv4 or IPv6 network.
+    """
+
+    def __init__(self, allow: Iterable[str] = (),
+                 deny: Iterable[str] = ()) -> None:
+        self._size = 0
+        self._trees = {4: PrefixTree(32), 6: PrefixTree(128)}
+
+        for cidr in allow:
+            self.add(cidr, ALLOW)
+
+        for cidr in deny:
+            self.add(cidr, DENY)
+
+    def __len__(self) -> int:
+        """Get the number of ranges added."""
+        return self._size
+
+    def add(self, cidr: str, verdict: str) -> None:
+        """
+        Add a CIDR range.
+
+        Parameters
+        ----------
+        cidr : str
+            The range, such as "192.0.2.0/24" or "2001:db8::/32".  A single
+            address is taken as a range of that address alone.
+        verdict : str
+            Either ALLOW or DENY.
+
+        Raises
+        ------
+        ValueError
+            If the range is not a valid IPv4 or IPv6 network.
+        """
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        tree = self._trees[network.version]
+        tree.add(int(network.network_address), network.prefixlen, verdict)
+        self._size += 1
+
+    def lookup(self, ipaddr: str) -> Optional[str]:
+        """
+        Get the verdict for an IP address.
+
+        Parameters
+        ----------
+        ipaddr : str
+            The IPv4 or IPv6 address.  IPv4 addresses mapped to IPv6 are
+            looked up as IPv4.
+
+        Returns
+        -------
+        str or None
+            ALLOW or DENY, or None if the address is in neither list or is
+            not a valid address.
+        """
+        try:
+            ip = ipaddress.ip_address(ipaddr)
+        except ValueError:
+            return None
+
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+
+        return self._trees[ip.version].lookup(int(ip))
+
+
+def read_cidrs(values: list[str], path: Optional[str] = None) -> list[str]:
+    """
+    Collect CIDR ranges from a list and, optionally, a file.
+
+    Parameters
+    ----------
+    values : list[str]
+        Ranges, as given in the environment.  Empty values are skipped.
+    path : str, optional
+        A file holding a range per line.  Blank lines and anything after a
+        "#" are skipped.  By default, None for no file.
+
+    Returns
+    -------
+    list[str]
+        The ranges.
+    """
+    cidrs = list(filter(None, map(str.strip, values)))
+
+    if path is not None:
+        with open(path) as stream:
+            lines = (line.split('#', 1)[0].strip() for line in stream)
+            cidrs.extend(filter(None, lines))
+
+    return cidrs
@@ -0,0 +1,245 @@
+"""Compress messages away from the event loop."""
+import asyncio
+import gzip
+import io
+import multiprocessing
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Optional
+
+CODECS = ('gzip', 'zstd', 'none')
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3, 'none': 0}
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+
+def compress(codec: str, level: int, content: bytes) -> bytes:
+    """
+    Compress content with a codec.
+
+    This is a module level function so that it can be run in a process
+    pool.
+
+    Parameters
+    ----------
+    codec : str
+        One of the values in CODECS.
+    level : int
+        The compression level.
+    content : bytes
+        The content to be compressed.
+
+    Returns
+    -------
+    bytes
+        The compressed content.
+    """
+    if codec == 'gzip':
+        return gzip.compress(content, compresslevel=level, mtime=0)
+    elif codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(content)
+
+    return content
+
+
+def compressobj(codec: str, level: int) -> Any:
+    """
+    Create an object to compress a stream of content with a codec.
+
+    Parameters
+    ----------
+    codec : str
+        One of the values in CODECS.
+    level : int
+        The compression level.
+
+    Returns
+    -------
+    Any
+        An object with compress and flush methods, as zlib.compressobj.
+    """
+    if codec == 'gzip':
+        return zlib.compressobj(level, wbits=31)
+    elif codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compressobj()
+
+    return Uncompressed()
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """
+    Decompress data compressed with a codec.
+
+    Parameters
+    ----------
+    codec : str
+        One of the values in CODECS.
+    data : bytes
+        The compressed data.
+
+    Returns
+    -------
+    bytes
+        The original content.
+    """
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    elif codec == 'zstd':
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True
+        )
+        return reader.read()
+
+    return data
+
+
+class Uncompressed:
+    """A stream compressor for the "none" codec that leaves data as it is."""
+
+    def compress(self, data: bytes) -> bytes:
+        """
+        Return the data as it is.
+
+        Parameters
+        ----------
+        data : bytes
+            The data to be compressed.
+
+        Returns
+        -------
+        bytes
+            The same data.
+        """
+        return data
+
+    def flush(self) -> bytes:
+        """
+        Return no more data.
+
+        Returns
+        -------
+        bytes
+            An empty bytes object.
+        """
+        return b''
+
+
+class Compressor:
+    """
+    Compress messages with a configured codec.
+
+    Compression runs in a process pool so that it scales across cores
+    rather than contending for the GIL with the event loop.  Content
+    smaller than the minimum size is not compressed at all.
+
+    Attributes
+    ----------
+    codec : str
+        The codec used for content of at least the minimum size.
+    level : int
+        The compression level.
+    min_size : int
+        The size in bytes below which content is not compressed.
+
+    Parameters
+    ----------
+    codec : str
+        One of the values in CODECS.
+    level : int, optional
+        The compression level, by default the codec's default level.
+    min_size : int, optional
+        The size in bytes below which content is not compressed, by default
+        0.
+    workers : int, optional
+        The number of processes to compress in.  If 0, compression runs in
+        the default thread pool instead.  By default, 0.
+
+    Raises
+    ------
+    ValueError
+        If the codec is not valid or if its package is not installed.
+    """
+
+    def __init__(self, codec: str, level: Optional[int] = None,
+                 min_size: int = 0, workers: int = 0) -> None:
+        if codec not in CODECS:
+            raise ValueError(f'Compression codec "{codec}" is not valid.')
+        elif codec == 'zstd':
+            self._check_zstandard()
+
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.min_size = min_size
+        self._executor = self._create_executor(workers)
+
+    def codec_for(self, size: int) -> str:
+        """
+        Get the codec that content of a size is compressed with.
+
+        Parameters
+        ----------
+        size : int
+            The size in bytes of the content.
+
+        Returns
+        -------
+        str
+            The codec, or "none" if the content is below the minimum size.
+        """
+        return 'none' if size < self.min_size else self.codec
+
+    async def compress(self, content: bytes,
+                       always: bool = False) -> tuple[str, bytes]:
+        """
+        Compress content in the pool.
+
+        Parameters
+        ----------
+        content : bytes
+            The content to be compressed.
+        always : bool, optional
+            Compress the content even if it is smaller than the minimum
+            size, by default False.
+
+        Returns
+        -------
+        tuple[str, bytes]
+            The codec used and the compressed content.
+        """
+        codec = self.codec if always else self.codec_for(len(content))
+
+        if codec == 'none':
+            return codec, content
+
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(self._executor, compress, codec,
+                                          self.level, content)
+        return codec, data
+
+    def shutdown(self) -> None:
+        """Shut down the compression pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def _check_zstandard(self) -> None:
+        """Check that the optional zstandard package is installed."""
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                'Compression codec "zstd" requires the zstandard package.'
+            )
+
+    def _create_executor(self, workers: int) -> Optional[Executor]:
+        """Create the process pool, or None to use the default threads."""
+        if workers < 1:
+            return None
+
+        # Spawn rather than fork, as forking a process that runs an event
+        # loop (with executor threads) copies the loop and any held locks.
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
@@ -0,0 +1,162 @@
+"""Suppress the duplicate deliveries of messages that are retried."""
+import collections
+import hashlib
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+# Forgotten keys are pruned from the database after every this many adds.
+PRUNE_INTERVAL = 1000
+
+
+def message_key(message_id: Optional[str], mail_from: Optional[str],
+                rcpt_tos: Iterable[str], content: bytes) -> str:
+    """
+    Get the key of a delivery: a digest of its envelope and content.
+
+    Parameters
+    ----------
+    message_id : str
+        The Message-ID header of the message, or None if it has none.
+    mail_from : str
+        The sender of the envelope.
+    rcpt_tos : Iterable[str]
+        The recipients of the envelope, in any order.
+    content : bytes
+        The content of the message.
+
+    Returns
+    -------
+    str
+        The SHA-256 digest of the fields, in hex.
+    """
+    digest = hashlib.sha256()
+
+    for field in [message_id or '', mail_from or '', *sorted(rcpt_tos)]:
+        digest.update(field.encode('utf-8', 'surrogateescape') + b'\0')
+
+    digest.update(content)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    A bounded index of the deliveries already stored.
+
+    The most recently stored keys are held in memory, least recently used
+    first out.  If a database path is given, the keys are also written to
+    an SQLite database there, which the worker processes on a host can
+    share, so that a retry is recognised whichever of them stored the first
+    delivery.  The database holds the same number of keys as memory does.
+    It is in WAL mode, which needs the memory shared between the processes
+    using it, so it must be on a local disk, never a network filesystem.
+
+    With a database, the index is only to be used in its executor, which
+    has a single thread, so that queries do not block the event loop.
+
+    Attributes
+    ----------
+    capacity : int
+        The maximum number of keys held.
+    executor : ThreadPoolExecutor
+        The executor to use the index in, or None if there is no database.
+    hits : int
+        The number of deliveries found to be duplicates.
+
+    Parameters
+    ----------
+    capacity : int
+        The maximum number of keys held.
+    path : str, optional
+        The path of the SQLite database, by default None for none.
+    """
+
+    def __init__(self, capacity: int, path: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.hits = 0
+        self.executor = None
+        self._db = None
+        self._keys = collections.OrderedDict()
+
+        if path is not None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='smtp2s3-dedup'
+            )
+            self._db = sqlite3.connect(path, timeout=5,
+                                       isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS deliveries '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE)'
+            )
+
+    def add(self, key: str) -> None:
+        """
+        Record that a delivery has been stored.
+
+        Parameters
+        ----------
+        key : str
+            The key of the delivery (see message_key).
+        """
+        self._remember(key)
+
+        if self._db is None:
+            return
+
+        row_id = self._db.execute(
+            'INSERT OR REPLACE INTO deliveries (key) VALUES (?)', (key,)
+        ).lastrowid
+
+        if row_id % PRUNE_INTERVAL == 0:
+            self._db.execute('DELETE FROM deliveries WHERE id <= ?',
+                             (row_id - self.capacity,))
+
+    def close(self) -> None:
+        """Close the database, if there is one."""
+        if self._db is not None:
+            self.executor.shutdown(wait=True)
+            self._db.close()
+
+    def seen(self, key: str) -> bool:
+        """
+        Check if a delivery has already been stored.
+
+        Parameters
+        ----------
+        key : str
+            The key of the delivery (see message_key).
+
+        Returns
+        -------
+        bool
+            True if the delivery is a duplicate.
+        """
+        if key in self._keys:
+            self._keys.move_to_end(key)
+        elif not self._in_database(key):
+            return False
+        else:
+            self._remember(key)
+
+        self.hits += 1
+        return True
+
+    def _in_database(self, key: str) -> bool:
+        """Check if the database holds a key."""
+        if self._db is None:
+            return False
+
+        return self._db.execute(
+            'SELECT 1 FROM deliveries WHERE key = ?', (key,)
+        ).fetchone() is not None
+
+    def _remember(self, key: str) -> None:
+        """Hold a key in memory, forgetting the least recently used."""
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+
+        if len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
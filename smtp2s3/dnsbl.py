@@ -0,0 +1,426 @@
+"""Check peer IP addresses against DNS blocklists."""
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+# The getaddrinfo errors that mean the name does not exist.
+NOT_FOUND_ERRORS = {
+    getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA')
+    if hasattr(socket, name)
+}
+
+
+class DNSBLCache:
+    """
+    A bounded cache of DNSBL answers keyed on IP address and zone.
+
+    Entries expire after their TTL and, once the cache is full, the least
+    recently used entry is evicted to make room for a new one.
+
+    Attributes
+    ----------
+    hits : int
+        The number of lookups answered from the cache.
+    misses : int
+        The number of lookups not in the cache (or expired).
+
+    Parameters
+    ----------
+    max_size : int
+        The maximum number of entries to hold.
+    clock : Callable[[], float], optional
+        The clock to expire entries by, by default time.monotonic.
+    """
+
+    def __init__(self, max_size: int,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._max_size = max_size
+
+    def __len__(self) -> int:
+        """Get the number of entries held, including any expired ones."""
+        return len(self._entries)
+
+    def get(self, ip: str, zone: str) -> Optional[bool]:
+        """
+        Get a cached answer.
+
+        Parameters
+        ----------
+        ip : str
+            The IP address that was looked up.
+        zone : str
+            The DNSBL zone that it was looked up in.
+
+        Returns
+        -------
+        bool or None
+            True if the IP is listed in the zone, False if not or None if
+            there is no unexpired answer in the cache.
+        """
+        key = (ip, zone)
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] <= self._clock():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, ip: str, zone: str, listed: bool, ttl: float) -> None:
+        """
+        Cache an answer.
+
+        Parameters
+        ----------
+        ip : str
+            The IP address that was looked up.
+        zone : str
+            The DNSBL zone that it was looked up in.
+        listed : bool
+            True if the IP is listed in the zone.
+        ttl : float
+            The number of seconds to hold the answer for.
+        """
+        key = (ip, zone)
+        self._entries[key] = (self._clock() + ttl, listed)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+
+class DNSPythonResolver:
+    """Resolve DNSBL names with dnspython, which gives the record TTL."""
+
+    def __init__(self) -> None:
+        import dns.asyncresolver
+        import dns.exception
+        import dns.resolver
+        self._not_found = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+        self._error = dns.exception.DNSException
+        self._resolver = dns.asyncresolver.Resolver()
+
+    async def resolve(self, qname: str) -> tuple[Optional[bool],
+                                                 Optional[int]]:
+        """
+        Resolve the A record of a DNSBL name.
+
+        Parameters
+        ----------
+        qname : str
+            The name to resolve.
+
+        Returns
+        -------
+        tuple[bool or None, int or None]
+            Whether the name exists (or None if the lookup failed) and the
+            TTL of the answer.
+        """
+        try:
+            answer = await self._resolver.resolve(qname, 'A')
+        except self._not_found:
+            return False, None
+        except self._error:
+            return None, None
+
+        return True, answer.rrset.ttl
+
+
+class SystemResolver:
+    """Resolve DNSBL names with the system resolver, without a TTL."""
+
+    async def resolve(self, qname: str) -> tuple[Optional[bool],
+                                                 Optional[int]]:
+        """
+        Resolve the IPv4 address of a DNSBL name.
+
+        Parameters
+        ----------
+        qname : str
+            The name to resolve.
+
+        Returns
+        -------
+        tuple[bool or None, int or None]
+            Whether the name exists (or None if the lookup failed) and None
+            as the system resolver does not give the TTL.
+        """
+        loop = asyncio.get_running_loop()
+
+        try:
+            await loop.getaddrinfo(qname, None, family=socket.AF_INET)
+        except socket.gaierror as ex:
+            return (False if ex.errno in NOT_FOUND_ERRORS else None), None
+
+        return True, None
+
+
+def create_resolver() -> object:
+    """
+    Create a resolver, using dnspython if it is installed.
+
+    Returns
+    -------
+    DNSPythonResolver or SystemResolver
+        The resolver.
+    """
+    try:
+        return DNSPythonResolver()
+    except ImportError:
+        return SystemResolver()
+
+
+class ZoneBreaker:
+    """
+    Skip DNSBL zones that keep failing, as a circuit breaker.
+
+    Once a zone has failed (timed out or returned an error) a number of
+    times in a row, it is skipped until a cool down has passed.  The next
+    lookup is then let through as a trial, and the zone skipped by any
+    other until the trial ends: a success closes the breaker again and a
+    failure opens it for another cool down.  A trial cancelled without an
+    answer lets the next lookup through as the trial instead.
+
+    Parameters
+    ----------
+    threshold : int
+        The number of failures in a row after which a zone is skipped.
+    cooldown : float
+        The number of seconds to skip a failing zone for.
+    clock : Callable[[], float], optional
+        The clock to time the cool down by, by default time.monotonic.
+    """
+
+    def __init__(self, threshold: int, cooldown: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._cooldown = cooldown
+        self._failures = {}
+        self._open_until = {}
+        self._threshold = threshold
+        self._trials = set()
+
+    def allow(self, zone: str) -> bool:
+        """
+        Check if a zone may be queried, letting a trial through if it is time.
+
+        Parameters
+        ----------
+        zone : str
+            The DNSBL zone.
+
+        Returns
+        -------
+        bool
+            False if the zone is being skipped.
+        """
+        if zone not in self._open_until:
+            return True
+        elif zone in self._trials or self._clock() < self._open_until[zone]:
+            return False
+
+        self._trials.add(zone)
+        return True
+
+    def record(self, zone: str, ok: bool) -> None:
+        """
+        Record the outcome of a query of a zone.
+
+        Parameters
+        ----------
+        zone : str
+            The DNSBL zone.
+        ok : bool
+            True if the zone answered.
+        """
+        self._trials.discard(zone)
+
+        if ok:
+            self._failures.pop(zone, None)
+            self._open_until.pop(zone, None)
+            return
+
+        failures = self._failures.get(zone, 0) + 1
+        self._failures[zone] = failures
+
+        if failures >= self._threshold:
+            self._open_until[zone] = self._clock() + self._cooldown
+
+    def release(self, zone: str) -> None:
+        """
+        End a trial of a zone that was cancelled without an answer.
+
+        Parameters
+        ----------
+        zone : str
+            The DNSBL zone.
+        """
+        self._trials.discard(zone)
+
+
+def query_prefix(ip: IPAddress) -> str:
+    """
+    Get the DNSBL query name of an IP address, less the zone.
+
+    Parameters
+    ----------
+    ip : IPAddress
+        The IP address.
+
+    Returns
+    -------
+    str
+        The octets of an IPv4 address or the nibbles of an IPv6 address, in
+        reverse order and separated by dots.
+    """
+    return ip.reverse_pointer.rsplit('.', 2)[0]
+
+
+class DNSBL:
+    """
+    Check IP addresses against DNSBL zones, caching the answers.
+
+    Every zone is queried at once and the check finishes as soon as one
+    zone lists the address.  Each query has a timeout and the check as a
+    whole a deadline, after which any outstanding zones are taken not to
+    list the address.
+
+    Parameters
+    ----------
+    zones : list[str]
+        The DNSBL zones to check against.
+    cache : DNSBLCache
+        The cache of answers.
+    ttl : int
+        The number of seconds to cache a listing for if the resolver does
+        not give the TTL of the record.
+    negative_ttl : int
+        The number of seconds to cache an IP address not being listed for.
+    timeout : float, optional
+        The number of seconds to wait for each zone, by default 2.
+    deadline : float, optional
+        The number of seconds to wait for all of the zones, by default 5.
+    breaker : ZoneBreaker, optional
+        The circuit breaker for failing zones, by default one that skips a
+        zone for 60 seconds after 5 failures in a row.
+    resolver : object, optional
+        An object with an async resolve method as SystemResolver, by default
+        the one chosen by create_resolver.
+    """
+
+    def __init__(self, zones: list[str], cache: DNSBLCache, ttl: int,
+                 negative_ttl: int, timeout: float = 2,
+                 deadline: float = 5, breaker: Optional[ZoneBreaker] = None,
+                 resolver: object = None) -> None:
+        self.breaker = breaker or ZoneBreaker(5, 60)
+        self.cache = cache
+        self.zones = zones
+        self._deadline = deadline
+        self._negative_ttl = negative_ttl
+        self._resolver = resolver or create_resolver()
+        self._timeout = timeout
+        self._ttl = ttl
+
+    async def is_listed(self, ipaddr: str) -> bool:
+        """
+        Check if an IP address is listed in any of the zones.
+
+        Parameters
+        ----------
+        ipaddr : str
+            The IPv4 or IPv6 address to be checked.
+
+        Returns
+        -------
+        bool
+            True if the IP is listed.  Addresses that are not valid are
+            never listed.
+        """
+        try:
+            ip = ipaddress.ip_address(ipaddr)
+        except ValueError:
+            return False
+
+        zones = self._zones_to_query(ip)
+
+        if zones is None:
+            return True
+
+        return await self._query_zones(ip, zones)
+
+    async def _any_listed(self, tasks: list[asyncio.Task]) -> bool:
+        """Wait for the zone queries, returning on the first listing."""
+        for task in asyncio.as_completed(tasks):
+            if await task:
+                return True
+
+        return False
+
+    async def _query_zone(self, ip: IPAddress,
+                          zone: str) -> bool:
+        """Query a zone, caching the answer and recording any failure."""
+        qname = f'{query_prefix(ip)}.{zone}'
+        listed, ttl = await self._resolve(qname, zone)
+        self.breaker.record(zone, listed is not None)
+
+        if listed is None:
+            return False
+        elif not listed:
+            ttl = self._negative_ttl
+        elif ttl is None:
+            ttl = self._ttl
+
+        self.cache.set(str(ip), zone, listed, ttl)
+        return listed
+
+    async def _query_zones(self, ip: IPAddress,
+                           zones: list[str]) -> bool:
+        """Query zones at once, giving up on any left at the deadline."""
+        tasks = [asyncio.ensure_future(self._query_zone(ip, zone))
+                 for zone in zones]
+
+        try:
+            return await asyncio.wait_for(self._any_listed(tasks),
+                                          self._deadline)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _resolve(self, qname: str, zone: str) -> tuple:
+        """Resolve a DNSBL name, as (None, None) if it timed out."""
+        try:
+            return await asyncio.wait_for(self._resolver.resolve(qname),
+                                          self._timeout)
+        except asyncio.TimeoutError:
+            return None, None
+        except asyncio.CancelledError:
+            self.breaker.release(zone)
+            raise
+
+    def _zones_to_query(self, ip: IPAddress) -> Optional[list]:
+        """Get the zones to query, or None if a cached answer lists the IP."""
+        zones = []
+
+        for zone in self.zones:
+            listed = self.cache.get(str(ip), zone)
+
+            if listed:
+                return None
+            elif listed is None and self.breaker.allow(zone):
+                zones.append(zone)
+
+        return zones
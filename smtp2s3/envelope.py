@@ -0,0 +1,60 @@
+"""Carry message metadata on the S3 object holding the message."""
+import base64
+import json
+from typing import Optional
+
+ENVELOPE_KEY = 'smtp2s3-envelope'
+ENVELOPE_PATH_KEY = 'smtp2s3-envelope-path'
+USER_METADATA_LIMIT = 2048
+
+
+def decode_envelope(user_metadata: dict) -> Optional[dict]:
+    """
+    Get the message metadata from the S3 user metadata of an object.
+
+    Parameters
+    ----------
+    user_metadata : dict
+        The user metadata, as returned in the Metadata of a HEAD or GET
+        response.
+
+    Returns
+    -------
+    dict or None
+        The message metadata or None if it is too large to be held in the
+        user metadata.  In that case the object URL of the metadata is
+        held under ENVELOPE_PATH_KEY.
+    """
+    value = user_metadata.get(ENVELOPE_KEY)
+
+    if value is None:
+        return None
+
+    return json.loads(base64.urlsafe_b64decode(value))
+
+
+def encode_envelope(metadata: dict) -> Optional[dict]:
+    """
+    Encode the message metadata as S3 user metadata.
+
+    User metadata travels as HTTP headers, so the JSON is base64 encoded
+    to keep non-ASCII addresses intact.
+
+    Parameters
+    ----------
+    metadata : dict
+        The message metadata.
+
+    Returns
+    -------
+    dict or None
+        The user metadata or None if the metadata is too large to be held
+        in the 2KB S3 allows for user metadata.
+    """
+    data = json.dumps(metadata, separators=(',', ':')).encode()
+    value = base64.urlsafe_b64encode(data).decode()
+
+    if len(ENVELOPE_KEY) + len(value) > USER_METADATA_LIMIT:
+        return None
+
+    return {ENVELOPE_KEY: value}
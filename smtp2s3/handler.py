@@ -1,29 +1,45 @@
 """A handler for use with aiosmtpd."""
 import asyncio
 import datetime
+import functools
 import hashlib
-import ipaddress
 import json
-import socket
+import threading
 import uuid
-from email import message_from_bytes
-from email.message import Message
 from logging import Logger
+from typing import Any, Callable, Optional
 from urllib.parse import urlparse
 
-import boto3
-import smart_open
 from aiosmtpd.smtp import SMTP, Envelope, Session
 
 from smtp2s3 import EnvironmentConfig
-
-utc = datetime.timezone.utc
+from smtp2s3.admission import AdmissionControl
+from smtp2s3.attachments import AttachmentStore
+from smtp2s3.batch import BatchWriter
+from smtp2s3.cidr import ALLOW, DENY, CIDRIndex, read_cidrs
+from smtp2s3.codec import SUFFIXES, Compressor
+from smtp2s3.dedup import DedupIndex, message_key
+from smtp2s3.dnsbl import DNSBL, DNSBLCache, ZoneBreaker
+from smtp2s3.envelope import ENVELOPE_PATH_KEY, encode_envelope
+from smtp2s3.headers import Headers, parse_headers
+from smtp2s3.manifest import ManifestWriter
+from smtp2s3.metrics import DEDUPLICATED, STAGE_SECONDS
+from smtp2s3.prefix import PrefixTemplate
+from smtp2s3.recipients import RecipientPolicy
+from smtp2s3.spool import Spool
+from smtp2s3.startup import STARTUP
+from smtp2s3.stream import MessageStream
+from smtp2s3.uploader import UploadBreaker, Uploader, is_outage
 
 
 class Handler:
     """
     A custom SMTPD handler.
 
+    As importing boto3 and creating the S3 client take longer than the rest
+    of starting, the client is created when first needed, which is usually
+    in the background once the SMTP port is bound (see warm_up).
+
     Parameters
     ----------
     config : EnvironmentConfig
@@ -33,43 +49,572 @@ class Handler:
     """
 
     def __init__(self, config: EnvironmentConfig, logger: Logger) -> None:
+        self._client_lock = threading.Lock()
+        self._config = config
+        self._logger = logger
+        self.transport_params = {}
+        self.uploader = self._create_uploader(config)
+        self.admission = AdmissionControl(
+            max_sessions=config.smtp_max_sessions,
+            max_sessions_per_ip=config.smtp_max_sessions_per_ip,
+            rate=config.smtp_rate_limit,
+            burst=config.smtp_rate_burst,
+            max_upload_backlog=config.smtp_max_upload_backlog,
+            max_bytes_in_flight=config.smtp_max_bytes_in_flight,
+            uploader=self.uploader,
+            check_storage=not config.spool_directory
+        )
+        self.compressor = Compressor(
+            config.compression_codec,
+            level=config.compression_level,
+            min_size=config.compression_min_size,
+            workers=config.compression_workers
+        )
+
+        if config.s3_prefix_pattern is None:
+            raise KeyError(
+                'Require S3_PREFIX_PATTERN to be set in the environment.')
+        else:
+            self.prefix = PrefixTemplate(config.s3_prefix_pattern,
+                                         shards=config.s3_shard_count)
+
+        self.recipients = RecipientPolicy(
+            config.smtp_rcpt_pattern,
+            config.smtp_recipients,
+            cache_size=config.smtp_recipient_cache_size
+        )
+        self.access = self.load_access(config)
+        self._reloading = None
+        self.attachments = self._create_attachment_store(config)
+        self.dedup = self._create_dedup(config)
+        self.dnsbl = self._create_dnsbl(config)
+        self.dnsbl_stage = config.dnsbl_stage
+        self.storage_layout = config.storage_layout
+        self.spool = self._create_spool(config)
+        self.batch = self._create_batch_writer(config)
+        self.manifest = self._create_manifest_writer(config)
+        self.streaming = self._streaming_enabled(config)
+        self._part_size = config.smtp_streaming_part_size
+        self._prewarm_connections = config.s3_prewarm_connections
+
+    async def _call_dedup(self, method: Callable[[str], Any], key: str) -> Any:
+        """
+        Call a method of the dedup index, in its executor if it has one.
+
+        Parameters
+        ----------
+        method : Callable[[str], Any]
+            The method of the dedup index to call.
+        key : str
+            The key of the delivery.
+
+        Returns
+        -------
+        Any
+            What the method returns.
+        """
+        if self.dedup.executor is None:
+            return method(key)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.dedup.executor, method, key)
+
+    def _create_attachment_store(self,
+                                 config: EnvironmentConfig) -> AttachmentStore:
+        """
+        Create the attachment store if ATTACHMENT_MIN_SIZE is set.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        AttachmentStore
+            The attachment store or None if parts are stored within their
+            messages.
+        """
+        if config.attachment_min_size < 1:
+            return None
+
+        bucket = urlparse(self.prefix.render()).netloc
+        return AttachmentStore(
+            self.upload,
+            self.object_exists,
+            self.compressor,
+            config.attachment_prefix or f's3://{bucket}/attachments/',
+            min_size=config.attachment_min_size,
+            cache_size=config.attachment_cache_size
+        )
+
+    def _create_batch_writer(self, config: EnvironmentConfig) -> BatchWriter:
+        """
+        Create the batch writer if the batch storage layout is configured.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        BatchWriter
+            The batch writer or None if messages are not batched.
+        """
+        if config.storage_layout != 'batch':
+            return None
+
+        return BatchWriter(
+            self.upload,
+            self.compressor,
+            self._logger,
+            max_bytes=config.batch_max_bytes,
+            max_age=config.batch_max_age
+        )
+
+    def _create_dedup(self, config: EnvironmentConfig) -> DedupIndex:
+        """
+        Create the index of stored deliveries, unless it is disabled.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        DedupIndex
+            The index, or None if DEDUP_CACHE_SIZE is 0.
+        """
+        if config.dedup_cache_size < 1:
+            return None
+
+        return DedupIndex(config.dedup_cache_size, config.dedup_database)
+
+    def _create_dnsbl(self, config: EnvironmentConfig) -> DNSBL:
+        """
+        Create the DNSBL checker if any DNSBL zones are configured.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        DNSBL
+            The DNSBL checker or None if there are no zones.
+        """
+        zones = list(filter(None, config.dnsbl_zones))
+        self._logger.debug(f'DNSBL zones are {zones}.')
+
+        if not zones:
+            return None
+
+        return DNSBL(
+            zones,
+            DNSBLCache(config.dnsbl_cache_size),
+            ttl=config.dnsbl_cache_ttl,
+            negative_ttl=config.dnsbl_negative_ttl,
+            timeout=config.dnsbl_timeout,
+            deadline=config.dnsbl_deadline,
+            breaker=ZoneBreaker(config.dnsbl_breaker_threshold,
+                                config.dnsbl_breaker_cooldown)
+        )
+
+    def _create_manifest_writer(self, config: EnvironmentConfig
+                                ) -> ManifestWriter:
+        """
+        Create the manifest writer if MANIFEST_ENABLED is true.
+
+        Manifests are not written with the batch storage layout, as the index
+        of each archive already lists the messages in it.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        ManifestWriter
+            The manifest writer or None if there are no manifests.
+        """
+        if not config.manifest_enabled:
+            return None
+        elif self.batch is not None:
+            self._logger.warning(
+                'MANIFEST_ENABLED is ignored with the batch storage layout.'
+            )
+            return None
+
+        return ManifestWriter(
+            self.upload,
+            self.compressor,
+            self._logger,
+            max_bytes=config.manifest_max_bytes,
+            max_age=config.manifest_max_age
+        )
+
+    def _create_s3_client(self, config: EnvironmentConfig):
+        """
+        Create the boto3 S3 client.
+
+        The connection pool, timeouts, retries and TCP keep-alive are set
+        from the config.  boto3 is only imported here, as it takes longer to
+        import than the rest of the service.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        S3.Client
+            The client to be used for uploads.
+        """
+        import boto3
+        from botocore.config import Config
+
         session = boto3.Session(
             aws_access_key_id=config.aws_access_key_id,
             aws_secret_access_key=config.aws_secret_access_key
         )
+        client_config = Config(
+            connect_timeout=config.s3_connect_timeout,
+            max_pool_connections=config.s3_max_pool_connections,
+            read_timeout=config.s3_read_timeout,
+            retries={
+                'total_max_attempts': config.s3_max_attempts,
+                'mode': config.s3_retry_mode
+            },
+            tcp_keepalive=config.s3_tcp_keepalive
+        )
         endpoint = config.s3_endpoint_url
 
         if endpoint:
-            logger.debug(f'S3 endpoint is "{endpoint}".')
+            self._logger.debug(f'S3 endpoint is "{endpoint}".')
             use_ssl = True
 
             if endpoint.startswith('http:'):
                 use_ssl = False
 
-            s3client = session.client(
+            return session.client(
                 's3',
                 endpoint_url=endpoint,
-                use_ssl=use_ssl
+                use_ssl=use_ssl,
+                config=client_config
             )
-        else:
-            s3client = session.client('s3')
 
-        self.transport_params = {
-            'client': s3client
-        }
-        self._logger = logger
+        return session.client('s3', config=client_config)
 
-        if config.s3_prefix_pattern is None:
-            raise KeyError(
-                'Require S3_PREFIX_PATTERN to be set in the environment.')
-        else:
-            self.object_prefix = self.path_prefix(config.s3_prefix_pattern)
+    def _create_spool(self, config: EnvironmentConfig) -> Spool:
+        """
+        Create the spool if a spool directory is configured.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        Spool
+            The spool or None if messages are uploaded directly.
+        """
+        if not config.spool_directory:
+            return None
+
+        self._logger.debug(f'Spool directory is "{config.spool_directory}".')
+        return Spool(
+            config.spool_directory,
+            self.store_spooled,
+            self._logger,
+            commit_interval=config.spool_commit_interval,
+            segment_size=config.spool_segment_size,
+            batch_size=config.spool_drain_batch,
+            max_attempts=config.spool_max_attempts,
+            max_bytes=config.spool_max_bytes,
+            is_outage=is_outage
+        )
+
+    def _create_uploader(self, config: EnvironmentConfig) -> Uploader:
+        """
+        Create the uploader, with a circuit breaker if a threshold is set.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        Uploader
+            The uploader.
+        """
+        breaker = None
+
+        if config.s3_breaker_threshold > 0:
+            breaker = UploadBreaker(config.s3_breaker_threshold,
+                                    config.s3_breaker_window,
+                                    config.s3_breaker_cooldown)
+
+        return Uploader(config.s3_max_uploads,
+                        min_uploads=config.s3_min_uploads,
+                        latency_target=config.s3_latency_target,
+                        breaker=breaker)
+
+    def _streaming_enabled(self, config: EnvironmentConfig) -> bool:
+        """
+        Check if message content is to be streamed to S3 as it arrives.
+
+        Streaming is not possible when messages are spooled or batched, as
+        those need the whole message before it can be stored.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        bool
+            True if messages are to be streamed.
+        """
+        if not config.smtp_streaming:
+            return False
+        elif self.spool is not None or self.batch is not None:
+            self._logger.warning(
+                'SMTP_STREAMING is ignored when spooling or batching.'
+            )
+            return False
+
+        return True
+
+    async def check_peer(self, session: Session, stage: str) -> Optional[str]:
+        """
+        Check if the peer is listed in a DNSBL zone, if this is the stage.
+
+        The lookup is normally started when the client connects, so that it
+        runs alongside the SMTP dialogue.  If it was not, it is started now.
+        Peers in the allowed (or denied) CIDR ranges are not looked up.
+
+        Parameters
+        ----------
+        session : Session
+            The session instance currently being handled.
+        stage : str
+            The SMTP command being handled.  One of the values in
+            DNSBL_STAGES.
+
+        Returns
+        -------
+        str
+            The response rejecting the command if the peer is listed,
+            otherwise None.
+        """
+        if self.dnsbl is None or stage != self.dnsbl_stage:
+            return None
+        elif self.access.lookup(session.peer[0]) is not None:
+            return None
+        elif await self._dnsbl_listed(session):
+            return self._reject_peer(session)
+
+        return None
+
+    def connect(self, session: Session) -> Optional[str]:
+        """
+        Admit a new connection and start checking its peer.
+
+        The session is refused if the admission limits have been reached.
+        Otherwise the peer is checked against the DNSBL zones, unless it is
+        in the allowed or denied CIDR ranges.  The verdict is held on the
+        session as the task dnsbl_listed, to be awaited by check_peer.
+
+        Parameters
+        ----------
+        session : Session
+            The session instance of the connection.
+
+        Returns
+        -------
+        str
+            The response refusing the session, or None if it is admitted.
+        """
+        peer_ip = session.peer[0]
+        self._logger.debug(f'Peer IP address is {peer_ip}')
+        response = self.admission.open(peer_ip, self._limited(peer_ip))
+
+        if response is not None:
+            self._logger.warning(f'{response} "{peer_ip}".')
+            return response
+
+        session.admitted = True
+        self._start_dnsbl(session)
+        return None
+
+    def disconnect(self, session: Session) -> None:
+        """
+        Release the session and cancel any DNSBL check of its peer.
+
+        Parameters
+        ----------
+        session : Session
+            The session instance of the connection.
+        """
+        if getattr(session, 'admitted', False):
+            self.admission.close(session.peer[0])
+
+        listed = getattr(session, 'dnsbl_listed', None)
+
+        if listed is not None:
+            listed.cancel()
+
+    def list_in_manifest(self, metadata: dict,
+                         content: Optional[bytes] = None, size: int = 0,
+                         sha256: Optional[str] = None) -> None:
+        """
+        Add a stored message to the manifest of its partition, if enabled.
+
+        Parameters
+        ----------
+        metadata : dict
+            The metadata of the message.
+        content : bytes, optional
+            The content of the message, to take the size and digest of.
+        size : int, optional
+            The size of the message, if the content is not given.
+        sha256 : str, optional
+            The SHA-256 digest of the message, if the content is not given.
+        """
+        if self.manifest is None:
+            return
+        elif content is not None:
+            size = len(content)
+            sha256 = hashlib.sha256(content).hexdigest()
+
+        self.manifest.add(metadata, size, sha256)
+
+    def load_access(self, config: EnvironmentConfig) -> CIDRIndex:
+        """
+        Load the CIDR ranges to allow and deny peers from.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        CIDRIndex
+            The index of the ranges.
+
+        Raises
+        ------
+        OSError
+            If a file of ranges cannot be read.
+        ValueError
+            If a range is not valid.
+        """
+        access = CIDRIndex(
+            allow=read_cidrs(config.cidr_allow, config.cidr_allow_file),
+            deny=read_cidrs(config.cidr_deny, config.cidr_deny_file)
+        )
+        self._logger.debug(f'Loaded {len(access)} CIDR ranges.')
+        return access
+
+    def reload_access(self, config: EnvironmentConfig) -> asyncio.Future:
+        """
+        Reload the CIDR ranges to allow and deny peers from.
+
+        The new index is built in the default executor, so sessions carry on
+        while it loads, and replaces the old one once it is complete.  If it
+        cannot be loaded, the old one is kept.  Should the ranges be
+        reloaded again before an index is complete, only the index of the
+        last reload replaces the old one.
+
+        Parameters
+        ----------
+        config : EnvironmentConfig
+            The config is extracted from the environment variables.
+
+        Returns
+        -------
+        asyncio.Future
+            Done once the new index has replaced the old one (or not).
+        """
+        loop = asyncio.get_running_loop()
+        self._reloading = loop.run_in_executor(None, self.load_access, config)
+        self._reloading.add_done_callback(self._swap_access)
+        return self._reloading
+
+    def _swap_access(self, reloading: asyncio.Future) -> None:
+        """
+        Replace the CIDR index with one that has been reloaded.
+
+        Parameters
+        ----------
+        reloading : asyncio.Future
+            The future of the reloaded index.
+        """
+        if reloading.cancelled():
+            return
+        elif reloading.exception() is not None:
+            self._logger.error(
+                f'Unable to reload CIDR ranges {reloading.exception()}.')
+        elif reloading is self._reloading:
+            self.access = reloading.result()
+            self._logger.info(f'Reloaded {len(self.access)} CIDR ranges.')
+
+    def delivery_key(self, envelope: Envelope, msg: Headers,
+                     content: bytes) -> Optional[str]:
+        """
+        Get the key that identifies a delivery to the dedup index.
+
+        Parameters
+        ----------
+        envelope : Envelope
+            The envelope instance of the current SMTP transaction.
+        msg : Headers
+            The headers of the message.
+        content : bytes
+            The content of the message.
+
+        Returns
+        -------
+        str
+            The key, or None if the dedup index is disabled.
+        """
+        if self.dedup is None:
+            return None
+
+        return message_key(msg.get('Message-ID'), envelope.mail_from,
+                           envelope.rcpt_tos, content)
+
+    def get_transport_params(self) -> dict:
+        """
+        Get the transport parameters for smart_open, with the S3 client.
+
+        The client is created on first use, unless warm_up has created it.
+        This is a method rather than a property, as aiosmtpd reads every
+        attribute of the handler for each connection.
 
-        self._rcpt_pattern = config.smtp_rcpt_regex
-        self._dnsbl_zones = list(filter(None, config.dnsbl_zones))
-        logger.debug(f'DNSBL zones are {self._dnsbl_zones}.')
+        Returns
+        -------
+        dict
+            The transport parameters.
+        """
+        with self._client_lock:
+            if 'client' not in self.transport_params:
+                with STARTUP.phase('s3_client'):
+                    self.transport_params['client'] = \
+                        self._create_s3_client(self._config)
+
+        return self.transport_params
 
-    def get_message_id(self, msg: Message) -> str:
+    def get_message_id(self, msg: Headers) -> str:
         """
         Get a usage message ID for a message..
 
@@ -102,46 +647,291 @@ class Handler:
         str
             A status string indicating the outcome.
         """
-        eml_path = json_path = '<unset>'
+        path = '<unset>'
+        response = await self.check_peer(session, 'DATA')
+
+        if response is not None:
+            return response
 
         try:
-            msg = message_from_bytes(envelope.content)
-            msg_id_header = msg.get('Message-ID')
-            msg_id = self.get_message_id(msg)
-            eml_path = f'{self.object_prefix}{msg_id}.eml.gz'
-            metadata = {
-                'mail_from': envelope.mail_from,
-                'mail_options': envelope.mail_options,
-                'message_id': msg_id_header,
-                'path': eml_path,
-                'rcpt_options': envelope.rcpt_options,
-                'rcpt_tos': envelope.rcpt_tos,
-                'session_ip': session.peer[0],
-                'smtp_utf8': envelope.smtp_utf8
-            }
             content = envelope.content or b''
 
-            with smart_open.open(eml_path,
-                                 'wb',
-                                 transport_params=self.transport_params
-                                 ) as stream:
-                stream.write(content)
+            with STAGE_SECONDS.time(stage='parse'):
+                msg = parse_headers(content)
 
-            json_path = f'{self.object_prefix}{msg_id}.json'
+            key = self.delivery_key(envelope, msg, content)
 
-            with smart_open.open(json_path, 'w',
-                                 transport_params=self.transport_params
-                                 ) as stream:
-                json.dump(metadata, stream, separators=(',', ':'))
+            if await self.is_duplicate(key):
+                return '250 OK'
 
+            path, metadata = self.new_message(session, envelope, msg)
+            await self.save(path, content, metadata)
+            await self.remember_delivery(key)
             self._logger.debug(metadata)
         except Exception as ex:
             response = '451 4.3.0 Temporary failure storing message.'
-            self._logger.error(f'{response} {ex} "{eml_path}/{json_path}".')
+            self._logger.error(f'{response} {ex} "{path}".')
             return response
 
         return '250 OK'
 
+    def new_message(self, session: Session, envelope: Envelope,
+                    msg: Headers) -> tuple[str, dict]:
+        """
+        Name a received message and describe it with metadata.
+
+        Parameters
+        ----------
+        session : Session
+            The session instance currently being handled.
+        envelope : Envelope
+            The envelope instance of the current SMTP transaction.
+        msg : Headers
+            The headers of the message.
+
+        Returns
+        -------
+        tuple[str, dict]
+            The S3 URL of the message objects, without any suffix, and the
+            metadata of the message.
+        """
+        msg_id = self.get_message_id(msg)
+        path = f'{self.prefix.render(key=msg_id)}{msg_id}'
+        metadata = {
+            'mail_from': envelope.mail_from,
+            'mail_options': envelope.mail_options,
+            'message_id': msg.get('Message-ID'),
+            'path': f'{path}.eml',
+            'rcpt_options': envelope.rcpt_options,
+            'rcpt_tos': envelope.rcpt_tos,
+            'session_ip': session.peer[0],
+            'smtp_utf8': envelope.smtp_utf8
+        }
+        return path, metadata
+
+    async def object_exists(self, path: str) -> bool:
+        """
+        Check if an object exists in S3 with a HEAD request.
+
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the object.
+
+        Returns
+        -------
+        bool
+            True if the object exists.
+        """
+        parse_result = urlparse(path)
+        head_object = functools.partial(
+            self.get_transport_params()['client'].head_object,
+            Bucket=parse_result.netloc,
+            Key=parse_result.path.lstrip('/')
+        )
+
+        from botocore.exceptions import ClientError
+
+        try:
+            await self.uploader.run(head_object)
+        except ClientError as ex:
+            if ex.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+
+            return False
+
+        return True
+
+    def open_stream(self, session: Session,
+                    envelope: Envelope) -> MessageStream:
+        """
+        Open a stream to upload the content of a message as it arrives.
+
+        Parameters
+        ----------
+        session : Session
+            The session instance currently being handled.
+        envelope : Envelope
+            The envelope instance of the current SMTP transaction.
+
+        Returns
+        -------
+        MessageStream
+            The stream to write the DATA lines to.
+        """
+        return MessageStream(self, session, envelope, self._part_size,
+                             self._logger)
+
+    async def save(self, path: str, content: bytes, metadata: dict) -> None:
+        """
+        Save a message to the spool or, if not spooling, directly to S3.
+
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the message objects, without any suffix.
+        content : bytes
+            The content of the message.
+        metadata : dict
+            The metadata of the message.
+        """
+        self.admission.bytes_in_flight += len(content)
+
+        try:
+            if self.spool is None:
+                await self.store(path, content, metadata)
+            else:
+                header = {
+                    'path': path,
+                    'metadata': metadata
+                }
+                await self.spool.append(header, content)
+        finally:
+            self.admission.bytes_in_flight -= len(content)
+
+    async def prewarm(self, connections: int) -> int:
+        """
+        Open connections to S3 ahead of the first messages.
+
+        A HEAD request is made on the bucket of S3_PREFIX_PATTERN for each
+        connection, all at once in the upload pool, so that each opens (and
+        leaves in the pool) a connection with its TLS handshake done.
+
+        Parameters
+        ----------
+        connections : int
+            The number of connections to open.
+
+        Returns
+        -------
+        int
+            The number of HEAD requests that failed.
+        """
+        bucket = urlparse(self.prefix.render()).netloc
+        head_bucket = functools.partial(
+            self.get_transport_params()['client'].head_bucket, Bucket=bucket
+        )
+        results = await asyncio.gather(
+            *(self.uploader.run(head_bucket) for _ in range(connections)),
+            return_exceptions=True
+        )
+        errors = [result for result in results
+                  if isinstance(result, Exception)]
+
+        if errors:
+            self._logger.warning(
+                f'{len(errors)} of {connections} S3 connections to "{bucket}" '
+                f'failed to open: {errors[0]}'
+            )
+
+        return len(errors)
+
+    async def start(self) -> None:
+        """
+        Start any background tasks, replaying the spool if enabled.
+
+        The work deferred from creating the handler is started in the
+        background (see warm_up), and is waited for if S3 connections are
+        to be prewarmed or the spool replayed, as those need the S3 client.
+        Any S3 connections to prewarm are opened first.
+        """
+        warm_up = asyncio.get_running_loop().run_in_executor(None,
+                                                             self.warm_up)
+
+        if self._prewarm_connections or self.spool is not None:
+            await warm_up
+
+        if self._prewarm_connections:
+            await self.prewarm(self._prewarm_connections)
+
+        if self.spool is not None:
+            await self.spool.start()
+
+    async def stop(self) -> None:
+        """Stop any background tasks, flushing any open batches."""
+        if self.spool is not None:
+            await self.spool.stop()
+
+        if self.batch is not None:
+            await self.batch.stop()
+
+        if self.manifest is not None:
+            await self.manifest.stop()
+
+        if self.dedup is not None:
+            self.dedup.close()
+
+        self.compressor.shutdown()
+
+    async def store(self, path: str, content: bytes, metadata: dict) -> None:
+        """
+        Compress and upload a message and its metadata to S3.
+
+        The content is written to the path with a suffix of ".eml" plus
+        that of the codec used to compress it, and the metadata to the path
+        with a suffix of ".json".  The path and codec are recorded in the
+        metadata.
+
+        If ATTACHMENT_MIN_SIZE is set, the bodies of the large MIME parts
+        are first split out of the content and stored once each (see
+        AttachmentStore).
+
+        With the batch storage layout, the message is added to the archive
+        for its partition instead and this returns once that is written.
+        With the single storage layout, the metadata is carried on the
+        message object and no metadata object is written.
+
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the message objects, without any suffix.
+        content : bytes
+            The content of the message.
+        metadata : dict
+            The metadata of the message.
+        """
+        received = content
+
+        if self.attachments is not None:
+            content = await self.attachments.split(content, metadata)
+
+        if self.batch is not None:
+            await self.batch.add(content, metadata)
+            return
+
+        with STAGE_SECONDS.time(stage='compress'):
+            codec, body = await self.compressor.compress(content)
+
+        eml_path = f'{path}.eml{SUFFIXES[codec]}'
+        json_path = f'{path}.json'
+        metadata.update(compression=codec, path=eml_path)
+
+        if self.storage_layout == 'single':
+            with STAGE_SECONDS.time(stage='put_eml'):
+                await self.uploader.run(self.write_single, eml_path,
+                                        json_path, body, metadata)
+        else:
+            with STAGE_SECONDS.time(stage='put_eml'):
+                await self.upload(eml_path, body)
+
+            with STAGE_SECONDS.time(stage='put_json'):
+                await self.uploader.run(self.write_json, json_path, metadata)
+
+        self.list_in_manifest(metadata, received)
+
+    async def store_spooled(self, header: dict, content: bytes) -> None:
+        """
+        Upload a message that has been read back from the spool.
+
+        Parameters
+        ----------
+        header : dict
+            The spool header written by the save method.
+        content : bytes
+            The content of the message.
+        """
+        await self.store(header['path'], content, header['metadata'])
+
     async def handle_MAIL(self, server: SMTP, session: Session,
                           envelope: Envelope, address: str,
                           mail_options: list[str]) -> str:
@@ -170,17 +960,24 @@ class Handler:
         str
             Response message to be sent to the client.
         """
-        envelope.mail_from = address
         peer_ip = session.peer[0]
-        self._logger.debug(f'Peer IP address is {peer_ip}')
 
-        if len(self._dnsbl_zones):
-            if await self.is_ip_on_dns_blocked_list(peer_ip):
-                response = '554 5.7.1 Service unavailable; '
-                response += 'Client host blocked by policy'
-                self._logger.error(f'{response} "{peer_ip}".')
-                return response
+        if self.access.lookup(peer_ip) == DENY:
+            return self._reject_peer(session)
+
+        response = self.admission.admit_message(peer_ip,
+                                                self._limited(peer_ip))
+
+        if response is not None:
+            self._logger.warning(f'{response} "{peer_ip}".')
+            return response
+
+        response = await self.check_peer(session, 'MAIL')
+
+        if response is not None:
+            return response
 
+        envelope.mail_from = address
         return '250 OK'
 
     async def handle_RCPT(self, server: SMTP, session: Session,
@@ -211,14 +1008,43 @@ class Handler:
         str
             Response message to be sent to the client.
         """
-        if not self._rcpt_pattern.fullmatch(address):
+        with STAGE_SECONDS.time(stage='recipient'):
+            admitted = self.recipients.admit(address)
+
+        if not admitted:
             response = '550 5.1.1 No such user'
             self._logger.error(f'{response} <{address}>.')
             return response
 
+        response = await self.check_peer(session, 'RCPT')
+
+        if response is not None:
+            return response
+
         envelope.rcpt_tos.append(address)
         return '250 OK'
 
+    async def is_duplicate(self, key: Optional[str]) -> bool:
+        """
+        Check if a delivery has already been stored, counting it if so.
+
+        Parameters
+        ----------
+        key : str
+            The key of the delivery, or None if the dedup index is disabled.
+
+        Returns
+        -------
+        bool
+            True if the delivery is to be acknowledged without storing it.
+        """
+        if key is None or not await self._call_dedup(self.dedup.seen, key):
+            return False
+
+        DEDUPLICATED.inc()
+        self._logger.info(f'Delivery {key[:16]} already stored, skipping.')
+        return True
+
     async def is_ip_on_dns_blocked_list(self, ipaddr: str) -> bool:
         """
         Check if the peer IP address is on a blocked list.
@@ -233,31 +1059,211 @@ class Handler:
         bool
             True if the IP is on a blocked list.
         """
+        with STAGE_SECONDS.time(stage='dnsbl'):
+            listed = await self.dnsbl.is_listed(ipaddr)
+
+        cache = self.dnsbl.cache
+        self._logger.debug(
+            f'DNSBL cache has {cache.hits} hits and {cache.misses} misses.'
+        )
+        return listed
+
+    def _dnsbl_listed(self, session: Session) -> asyncio.Task:
+        """Get the DNSBL check of the peer, starting it if required."""
+        if getattr(session, 'dnsbl_listed', None) is None:
+            self._start_dnsbl(session)
+
+        return session.dnsbl_listed
+
+    def _limited(self, peer_ip: str) -> bool:
+        """Check if the per-address limits apply to a peer."""
+        return self.access.lookup(peer_ip) != ALLOW
+
+    def _reject_peer(self, session: Session) -> str:
+        """Log and return the response rejecting a blocked peer."""
+        response = '554 5.7.1 Service unavailable; '
+        response += 'Client host blocked by policy'
+        self._logger.error(f'{response} "{session.peer[0]}".')
+        return response
+
+    def _start_dnsbl(self, session: Session) -> None:
+        """Start checking the peer against the DNSBL zones, if required."""
+        peer_ip = session.peer[0]
+
+        if self.dnsbl is None or self.access.lookup(peer_ip) is not None:
+            return
+
+        session.dnsbl_listed = asyncio.ensure_future(
+            self.is_ip_on_dns_blocked_list(peer_ip)
+        )
+
+    async def upload(self, path: str, body: bytes) -> None:
+        """
+        Upload bytes to S3 as they are, without compressing them.
+
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the object to be written.
+        body : bytes
+            The bytes to be written.
+        """
+        await self.uploader.run(self.write_bytes, path, body)
+
+    async def remember_delivery(self, key: Optional[str]) -> None:
+        """
+        Add a stored delivery to the dedup index.
+
+        Parameters
+        ----------
+        key : str
+            The key of the delivery, or None if the dedup index is disabled.
+        """
+        if key is not None:
+            await self._call_dedup(self.dedup.add, key)
+
+    def user_metadata(self, eml_path: str, json_path: str,
+                      metadata: dict) -> dict:
+        """
+        Get the S3 user metadata for a message object.
+
+        With the single storage layout the metadata is carried on the
+        message object.  Should it be too large for that, it is written to
+        its own object and the user metadata refers to that instead.  With
+        other layouts there is no user metadata.
+
+        This can block, so is run in the upload pool rather than on the
+        event loop.
+
+        Parameters
+        ----------
+        eml_path : str
+            The S3 URL the message content is to be written to.
+        json_path : str
+            The S3 URL to write the metadata to if it is too large to be
+            carried on the message object.
+        metadata : dict
+            The metadata of the message.
+
+        Returns
+        -------
+        dict
+            The S3 user metadata.
+        """
+        if self.storage_layout != 'single':
+            return {}
+
+        user_metadata = encode_envelope(metadata)
+
+        if user_metadata is None:
+            self._logger.debug(f'Metadata too large for "{eml_path}".')
+            self.write_json(json_path, metadata)
+            user_metadata = {ENVELOPE_PATH_KEY: json_path}
+
+        return user_metadata
+
+    def warm_up(self) -> None:
+        """
+        Do the work deferred from creating the handler.
+
+        This creates the S3 client, compiles the recipient regex and imports
+        smart_open, so that the first message does not wait for them.  It
+        blocks, so is run in a thread rather than on the event loop.  Any
+        error is logged and raised again when the work is next needed.
+        The startup profile is logged once it is done.
+        """
         try:
-            ip = ipaddress.ip_address(ipaddr)
-        except ValueError:
-            return False
+            self.get_transport_params()
+        except Exception as ex:
+            self._logger.warning(f'Unable to create the S3 client: {ex}')
 
-        if ip.version != 4:
-            return False
-        else:
-            parts = reversed(ipaddr.split('.'))
-            rip = '.'.join(parts)
+        self.recipients.regex
+        import smart_open  # noqa: F401
+        self._logger.info(STARTUP.summary('Warmed up'))
 
-        for zone in self._dnsbl_zones:
-            qname = f'{rip}.{zone}'
+    def write_bytes(self, path: str, body: bytes) -> None:
+        """
+        Write bytes to S3 as they are, without compressing them.
 
-            try:
-                await asyncio.to_thread(socket.gethostbyname(qname))
-                return True
-            except socket.gaierror:
-                continue
+        This blocks, so is run in the upload pool rather than on the event
+        loop.
 
-        return False
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the object to be written.
+        body : bytes
+            The bytes to be written.
+        """
+        import smart_open
+
+        with smart_open.open(path, 'wb', compression='disable',
+                             transport_params=self.get_transport_params()
+                             ) as stream:
+            stream.write(body)
+
+    def write_json(self, path: str, metadata: dict) -> None:
+        """
+        Write the message metadata to S3.
+
+        This blocks, so is run in the upload pool rather than on the event
+        loop.
+
+        Parameters
+        ----------
+        path : str
+            The S3 URL of the object to be written.
+        metadata : dict
+            The metadata of the message.
+        """
+        import smart_open
+
+        with smart_open.open(path, 'w',
+                             transport_params=self.get_transport_params()
+                             ) as stream:
+            json.dump(metadata, stream, separators=(',', ':'))
+
+    def write_single(self, eml_path: str, json_path: str, body: bytes,
+                     metadata: dict) -> None:
+        """
+        Write the message content to S3 with its metadata in a single PUT.
+
+        The metadata is written as S3 user metadata on the message object
+        (see the user_metadata method).
+
+        This blocks, so is run in the upload pool rather than on the event
+        loop.
+
+        Parameters
+        ----------
+        eml_path : str
+            The S3 URL to write the message content to.
+        json_path : str
+            The S3 URL to write the metadata to if it is too large to be
+            carried on the message object.
+        body : bytes
+            The content of the message, as compressed.
+        metadata : dict
+            The metadata of the message.
+        """
+        user_metadata = self.user_metadata(eml_path, json_path, metadata)
+        transport_params = dict(
+            self.get_transport_params(),
+            multipart_upload=False,
+            client_kwargs={
+                'S3.Client.put_object': {'Metadata': user_metadata}
+            }
+        )
+
+        import smart_open
+
+        with smart_open.open(eml_path, 'wb', compression='disable',
+                             transport_params=transport_params) as stream:
+            stream.write(body)
 
     def path_prefix(
             self, prefix_pattern: str,
-            timestamp: datetime.datetime = datetime.datetime.now(utc)) -> str:
+            timestamp: Optional[datetime.datetime] = None) -> str:
         """
         Construct a path from the pattern based upon the timestamp.
 
@@ -271,10 +1277,14 @@ class Handler:
                 - {dd} for the day (zero padded).
                 - {HH} for the hour (zero padded).
                 - {mm} for the minute (zero padded).
+                - {ss} for the second (zero padded).
+                - {hostname} for the host name (the pod name in Kubernetes).
+                - {pid} for the process ID.
+                - {shard} for the shard of the message (always 0 here).
 
         timestamp : datetime.datetime, optional
             The timestamp to use when constructing the path, by default
-            datetime.datetime.now().
+            the current time in UTC.
 
         Returns
         -------
@@ -287,31 +1297,4 @@ class Handler:
             If the provided pattern would not produce a valid path
             name.
         """
-        prefix = prefix_pattern.removesuffix('/')
-
-        YYYY = str(timestamp.year)
-        prefix = prefix.replace('{YYYY}', YYYY)
-
-        MM = f'{timestamp.month:02}'
-        prefix = prefix.replace('{MM}', MM)
-
-        dd = f'{timestamp.day:02}'
-        prefix = prefix.replace('{dd}', dd)
-
-        HH = f'{timestamp.hour:02}'
-        prefix = prefix.replace('{HH}', HH)
-
-        mm = f'{timestamp.minute:02}'
-        prefix = prefix.replace('{mm}', mm)
-
-        prefix += '/'
-        parse_result = urlparse(prefix)
-
-        try:
-            assert parse_result.scheme == 's3', 'URL scheme must be "s3".'
-            bucket_name = parse_result.netloc
-            assert len(bucket_name), 'Bucket name not specified.'
-        except AssertionError as ex:
-            raise ValueError(ex)
-
-        return prefix
+        return PrefixTemplate(prefix_pattern).render(timestamp)
@@ -0,0 +1,103 @@
+"""Read message headers without parsing the whole message."""
+import re
+from typing import Optional
+
+FOLD = re.compile(r'\r?\n(?=[ \t])')
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+LINE_END = re.compile(r'\r?\n')
+
+
+class Headers:
+    """
+    The headers of a message, looked up by case-insensitive name.
+
+    Only the header block is held, so this is cheap to create even for a
+    message with large attachments.  Where a feature needs the body or
+    MIME structure of a message, parse it in full with the email package
+    instead.
+
+    Parameters
+    ----------
+    fields : list[tuple[str, str]]
+        The name and unfolded value of each header field, in order.
+    """
+
+    def __init__(self, fields: list[tuple[str, str]]) -> None:
+        self._fields = {}
+
+        for name, value in fields:
+            self._fields.setdefault(name.lower(), value)
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Get the value of the first header field with a name.
+
+        Parameters
+        ----------
+        name : str
+            The field name, in any case.
+        default : str, optional
+            The value to return if there is no such field, by default None.
+
+        Returns
+        -------
+        str or None
+            The unfolded value of the field, or the default.
+        """
+        return self._fields.get(name.lower(), default)
+
+
+def header_block(content: bytes) -> bytes:
+    """
+    Get the header block of a message.
+
+    Parameters
+    ----------
+    content : bytes
+        The message content, or at least its beginning.
+
+    Returns
+    -------
+    bytes
+        The content up to the first blank line, which may use either
+        CRLF or LF line endings.
+    """
+    if content.startswith((b'\r\n', b'\n')):
+        return b''
+
+    match = HEADER_END.search(content)
+
+    if match is None:
+        return content
+
+    return content[:match.start()]
+
+
+def parse_headers(content: bytes) -> Headers:
+    """
+    Parse the headers of a message, stopping at the first blank line.
+
+    Folded fields are unfolded and any line that is not a field is
+    skipped.  As with the email package, the bytes are decoded as ASCII
+    with surrogate escapes for any others.
+
+    Parameters
+    ----------
+    content : bytes
+        The message content, or at least its beginning.
+
+    Returns
+    -------
+    Headers
+        The headers of the message.
+    """
+    block = header_block(content).decode('ascii', 'surrogateescape')
+    fields = []
+
+    for line in LINE_END.split(FOLD.sub('', block)):
+        name, colon, value = line.partition(':')
+
+        if colon and not name[:1].isspace():
+            fields.append((name.rstrip(), value.strip()))
+
+    return Headers(fields)
@@ -0,0 +1,163 @@
+"""Keep a rolling manifest of the messages stored in each partition."""
+import asyncio
+import json
+import uuid
+from logging import Logger
+from typing import Any, Callable, Coroutine
+
+from smtp2s3.codec import SUFFIXES, Compressor
+
+
+class Manifest:
+    """
+    The entries collected for one manifest object.
+
+    Attributes
+    ----------
+    count : int
+        The number of entries.
+    lines : bytearray
+        The entries as JSON Lines.
+    timer : asyncio.TimerHandle
+        The timer that flushes the manifest once it reaches its maximum age.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.lines = bytearray()
+        self.timer = None
+
+
+class ManifestWriter:
+    """
+    Collect an entry for each message stored into a manifest per partition.
+
+    An entry holds the metadata of the message along with its size and
+    SHA-256 digest (as received).  The entries of a partition are written
+    as a JSON Lines object in the partition, compressed with the codec of
+    the messages, once they reach the maximum size or age.  As S3 objects
+    cannot be appended to, each flush writes a new object, so a partition
+    holds a few manifests rather than an object per message.
+
+    Entries that fail to be written are kept for the next flush of their
+    partition.  Manifests are only an index: the messages and their
+    metadata objects are stored whether or not they are written.
+
+    Parameters
+    ----------
+    upload : Callable[[str, bytes], Coroutine]
+        A coroutine function that writes bytes to an S3 URL.
+    compressor : Compressor
+        The compressor for the manifests.
+    logger : logging.Logger
+        A logger to be used.
+    max_bytes : int
+        The size in bytes (before compression) at which a manifest is
+        flushed.
+    max_age : float
+        The number of seconds after its first entry that a manifest is
+        flushed.
+    """
+
+    def __init__(self, upload: Callable[[str, bytes], Coroutine[Any, Any, Any]],
+                 compressor: Compressor, logger: Logger, max_bytes: int,
+                 max_age: float) -> None:
+        self._compressor = compressor
+        self._flushes = set()
+        self._logger = logger
+        self._manifests = {}
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._upload = upload
+
+    def add(self, metadata: dict, size: int, sha256: str) -> None:
+        """
+        Add an entry for a stored message to the manifest of its partition.
+
+        Parameters
+        ----------
+        metadata : dict
+            The metadata of the message.  The partition is taken from the
+            path.
+        size : int
+            The size in bytes of the message, as received.
+        sha256 : str
+            The SHA-256 digest of the message, as received, in hex.
+        """
+        entry = dict(metadata, size=size, sha256=sha256)
+        line = json.dumps(entry, separators=(',', ':')).encode() + b'\n'
+        partition = metadata['path'].rsplit('/', 1)[0] + '/'
+        self._extend(partition, line)
+
+    async def stop(self) -> None:
+        """Flush every open manifest, dropping any that fail."""
+        for partition in list(self._manifests):
+            self._begin_flush(partition)
+
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+        for partition, manifest in self._manifests.items():
+            manifest.timer.cancel()
+            self._logger.error(
+                f'Dropped {manifest.count} manifest entries for "{partition}".'
+            )
+
+        self._manifests.clear()
+
+    def _begin_flush(self, partition: str) -> None:
+        """Start writing the open manifest for a partition."""
+        manifest = self._manifests.pop(partition, None)
+
+        if manifest is None:
+            return
+
+        manifest.timer.cancel()
+        task = asyncio.get_running_loop().create_task(
+            self._flush(partition, manifest)
+        )
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _extend(self, partition: str, line: bytes) -> None:
+        """Add a line to the open manifest of a partition, flushing if full."""
+        manifest = self._open(partition)
+        manifest.lines += line
+        manifest.count += 1
+
+        if len(manifest.lines) >= self._max_bytes:
+            self._begin_flush(partition)
+
+    async def _flush(self, partition: str, manifest: Manifest) -> None:
+        """Write a manifest, keeping its entries for the next on failure."""
+        path = f'{partition}manifest-{uuid.uuid4()}.jsonl'
+
+        try:
+            codec, body = await self._compressor.compress(
+                bytes(manifest.lines), always=True
+            )
+            path += SUFFIXES[codec]
+            await self._upload(path, body)
+        except Exception as ex:
+            self._logger.error(f'Unable to write "{path}" {ex}.')
+            self._requeue(partition, manifest)
+            return
+
+        self._logger.debug(f'Listed {manifest.count} messages in "{path}".')
+
+    def _open(self, partition: str) -> Manifest:
+        """Get the open manifest for a partition, starting one if required."""
+        manifest = self._manifests.get(partition)
+
+        if manifest is None:
+            manifest = self._manifests[partition] = Manifest()
+            manifest.timer = asyncio.get_running_loop().call_later(
+                self._max_age, self._begin_flush, partition
+            )
+
+        return manifest
+
+    def _requeue(self, partition: str, failed: Manifest) -> None:
+        """Put the entries of a failed manifest back, to retry at its age."""
+        manifest = self._open(partition)
+        manifest.lines[:0] = failed.lines
+        manifest.count += failed.count
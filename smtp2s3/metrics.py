@@ -0,0 +1,506 @@
+"""Collect Prometheus metrics and render them in the text format."""
+import contextlib
+import glob
+import json
+import os
+import time
+from typing import Iterator, Optional
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The samples of each metric family, by series (the name and labels).
+Samples = dict[str, dict[str, float]]
+
+
+def series(name: str, labels: dict) -> str:
+    """
+    Get the series of a sample in the text format.
+
+    Parameters
+    ----------
+    name : str
+        The sample name.
+    labels : dict
+        The label names and values.
+
+    Returns
+    -------
+    str
+        The name followed by any labels in braces.
+    """
+    if not labels:
+        return name
+
+    pairs = ','.join(
+        f'{key}="{escape(str(value))}"' for key, value in labels.items()
+    )
+    return f'{name}{{{pairs}}}'
+
+
+def add_samples(total: Samples, samples: Samples) -> None:
+    """
+    Add samples to a running total.
+
+    Parameters
+    ----------
+    total : Samples
+        The running total, updated in place.
+    samples : Samples
+        The samples to add.
+    """
+    for name, family in samples.items():
+        total_family = total.setdefault(name, {})
+
+        for key, value in family.items():
+            total_family[key] = total_family.get(key, 0) + value
+
+
+def add_label(key: str, name: str, value: str) -> str:
+    """
+    Add a label to the series of a sample.
+
+    Parameters
+    ----------
+    key : str
+        The series, as rendered by the series function.
+    name : str
+        The label name.
+    value : str
+        The label value.
+
+    Returns
+    -------
+    str
+        The series with the label last.
+    """
+    label = f'{name}="{escape(value)}"'
+
+    if key.endswith('}'):
+        return f'{key[:-1]},{label}}}'
+
+    return f'{key}{{{label}}}'
+
+
+def escape(value: str) -> str:
+    """
+    Escape a label value for the text format.
+
+    Parameters
+    ----------
+    value : str
+        The label value.
+
+    Returns
+    -------
+    str
+        The value with backslashes, double quotes and new lines escaped.
+    """
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Registry:
+    """
+    The metrics of the process, rendered for a Prometheus scrape.
+
+    Where the service runs in several worker processes, each dumps its
+    samples to a file in a shared directory, and the samples of all of the
+    workers are summed when rendered, which is the value for the whole pod
+    of a count or a gauge of things in progress.  The samples of a metric
+    that is per worker (such as a limit or a state, which mean nothing
+    summed) are instead rendered for each worker, with a "worker" label.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = []
+
+    def collect(self, directory: Optional[str] = None) -> Samples:
+        """
+        Collect the samples of the metrics.
+
+        Parameters
+        ----------
+        directory : str, optional
+            The directory of the samples dumped by each worker, to be summed,
+            by default None for just those of this process.
+
+        Returns
+        -------
+        Samples
+            The samples by metric family and series.
+        """
+        if directory is None:
+            return self.samples()
+
+        merged = {}
+
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as stream:
+                    samples = json.load(stream)
+            except (OSError, ValueError):
+                continue
+
+            worker = os.path.basename(path).removesuffix('.json')
+            add_samples(merged, self._label_worker(samples, worker))
+
+        return merged
+
+    def dump(self, path: str) -> None:
+        """
+        Dump the samples of this process to a file, replacing it atomically.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+        """
+        temp_path = f'{path}.tmp'
+
+        with open(temp_path, 'w') as stream:
+            json.dump(self.samples(), stream)
+
+        os.replace(temp_path, path)
+
+    def register(self, metric: 'Metric') -> None:
+        """
+        Register a metric to be rendered.
+
+        Parameters
+        ----------
+        metric : Metric
+            The metric.
+        """
+        self._metrics.append(metric)
+
+    def render(self, samples: Optional[Samples] = None) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+
+        Parameters
+        ----------
+        samples : Samples, optional
+            The samples to render, by default those of this process.
+
+        Returns
+        -------
+        str
+            The metrics.
+        """
+        samples = self.samples() if samples is None else samples
+        lines = []
+
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            family = samples.get(metric.name, {})
+            lines.extend(f'{key} {value:g}' for key, value in family.items())
+
+        return '\n'.join(lines) + '\n'
+
+    def samples(self) -> Samples:
+        """
+        Get the samples of the metrics of this process.
+
+        Returns
+        -------
+        Samples
+            The samples by metric family and series.
+        """
+        return {metric.name: dict(metric.samples())
+                for metric in self._metrics}
+
+    def _label_worker(self, samples: Samples, worker: str) -> Samples:
+        """Label the samples of the per worker metrics with the worker."""
+        worker = worker.removeprefix('worker-')
+
+        for metric in filter(lambda m: m.per_worker, self._metrics):
+            samples[metric.name] = {
+                add_label(key, 'worker', worker): value
+                for key, value in samples.get(metric.name, {}).items()
+            }
+
+        return samples
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    A metric family, with a value for each combination of labels.
+
+    Parameters
+    ----------
+    name : str
+        The name of the metric.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple[str], optional
+        The names of the labels, by default none.
+    registry : Registry, optional
+        The registry to render the metric in, by default REGISTRY.
+    per_worker : bool, optional
+        True to render the samples of each worker process rather than their
+        sum, by default False.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (),
+                 registry: Registry = REGISTRY,
+                 per_worker: bool = False) -> None:
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.name = name
+        self.per_worker = per_worker
+        self._values = {}
+        registry.register(self)
+
+    def get(self, **labels: str) -> float:
+        """
+        Get the value for some labels.
+
+        Parameters
+        ----------
+        **labels : str
+            The value of each label.
+
+        Returns
+        -------
+        float
+            The value, or 0 if it has not been set.
+        """
+        return self._values.get(self._key(labels), 0)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increase the value for some labels.
+
+        Parameters
+        ----------
+        amount : float, optional
+            The amount to increase by, by default 1.
+        **labels : str
+            The value of each label.
+        """
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        """
+        Get the samples of the metric.
+
+        Yields
+        ------
+        tuple[str, float]
+            The series and value of each sample.
+        """
+        for key, value in self._values.items():
+            yield series(self.name, dict(zip(self.labelnames, key))), value
+
+    def _key(self, labels: dict) -> tuple:
+        """Get the label values in the order of the label names."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """A count that only goes up, such as of messages received."""
+
+    type = 'counter'
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as of sessions open."""
+
+    type = 'gauge'
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """
+        Decrease the value for some labels.
+
+        Parameters
+        ----------
+        amount : float, optional
+            The amount to decrease by, by default 1.
+        **labels : str
+            The value of each label.
+        """
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Set the value for some labels.
+
+        Parameters
+        ----------
+        value : float
+            The new value.
+        **labels : str
+            The value of each label.
+        """
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    A distribution of observations, such as of latencies, in buckets.
+
+    Parameters
+    ----------
+    name : str
+        The name of the metric.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple[str], optional
+        The names of the labels, by default none.
+    buckets : tuple[float], optional
+        The upper bounds of the buckets, by default from 5ms to 10s.
+    registry : Registry, optional
+        The registry to render the metric in, by default REGISTRY.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def count(self, **labels: str) -> int:
+        """
+        Get the number of observations for some labels.
+
+        Parameters
+        ----------
+        **labels : str
+            The value of each label.
+
+        Returns
+        -------
+        int
+            The number of observations.
+        """
+        counts = self._values.get(self._key(labels))
+        return 0 if counts is None else counts[-1]
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Observe a value.
+
+        Parameters
+        ----------
+        value : float
+            The value, such as a number of seconds.
+        **labels : str
+            The value of each label.
+        """
+        key = self._key(labels)
+        counts = self._values.get(key)
+
+        if counts is None:
+            counts = self._values[key] = [0] * len(self.buckets) + [0, 0]
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        """
+        Get the samples of the metric.
+
+        Yields
+        ------
+        tuple[str, float]
+            The series and value of each bucket, the sum and the count.
+        """
+        for key, counts in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+
+            for bound, count in zip(self.buckets, counts):
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                yield series(f'{self.name}_bucket', dict(labels, le=le)), count
+
+            yield series(f'{self.name}_sum', labels), counts[-2]
+            yield series(f'{self.name}_count', labels), counts[-1]
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observe the number of seconds that a block takes.
+
+        Parameters
+        ----------
+        **labels : str
+            The value of each label.
+        """
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+ACTIVE_SESSIONS = Gauge(
+    'smtp2s3_active_sessions', 'The number of SMTP sessions open.'
+)
+ADMISSION_REJECTIONS = Counter(
+    'smtp2s3_admission_rejections_total',
+    'The number of sessions and messages turned away, by the reason.',
+    ('reason',)
+)
+ATTACHMENTS = Counter(
+    'smtp2s3_attachments_total',
+    'The number of large MIME parts split out of messages, by whether the '
+    'part was stored or found already stored.', ('result',)
+)
+DEDUPLICATED = Counter(
+    'smtp2s3_messages_deduplicated_total',
+    'The number of retried messages acknowledged without being stored again.'
+)
+MESSAGE_BYTES = Counter(
+    'smtp2s3_message_bytes_total',
+    'The bytes of DATA received, by the SMTP reply code.', ('code',)
+)
+MESSAGES = Counter(
+    'smtp2s3_messages_total',
+    'The number of messages received, by the SMTP reply code.', ('code',)
+)
+SPOOL_BYTES = Gauge(
+    'smtp2s3_spool_bytes',
+    'The bytes of the spool segments on disk, awaiting upload.'
+)
+SPOOL_DEAD_LETTERS = Counter(
+    'smtp2s3_spool_dead_letters_total',
+    'The number of spooled messages moved to the dead letters after failing '
+    'too many times.'
+)
+STAGE_SECONDS = Histogram(
+    'smtp2s3_stage_duration_seconds',
+    'The number of seconds taken by each stage of handling a message.',
+    ('stage',)
+)
+UPLOAD_BREAKER_STATE = Gauge(
+    'smtp2s3_upload_breaker_state',
+    'The state of the circuit breaker around S3 uploads, as 1 for the '
+    'current state.', ('state',), per_worker=True
+)
+UPLOAD_LIMIT = Gauge(
+    'smtp2s3_upload_limit',
+    'The number of S3 uploads allowed to run at once, as adapted.',
+    per_worker=True
+)
+UPLOADS_IN_FLIGHT = Gauge(
+    'smtp2s3_uploads_in_flight', 'The number of S3 uploads running.'
+)
+UPLOADS_WAITING = Gauge(
+    'smtp2s3_uploads_waiting',
+    'The number of S3 uploads waiting for a free slot.'
+)
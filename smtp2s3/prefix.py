@@ -0,0 +1,227 @@
+"""Render the S3 prefix that messages are written under."""
+import datetime
+import os
+import re
+import socket
+import time
+import zlib
+from typing import Optional
+from urllib.parse import urlparse
+
+utc = datetime.timezone.utc
+
+ESCAPED_TOKEN = re.compile(r'\{\{(\w+)\}\}')
+SHARD_TOKEN = 'shard'
+TOKEN = re.compile(r'\{(\w+)\}')
+
+# The time tokens and the number of seconds for which each holds a value.
+TIME_TOKENS = {
+    'YYYY': (lambda t: str(t.year), 86400),
+    'MM': (lambda t: f'{t.month:02}', 86400),
+    'dd': (lambda t: f'{t.day:02}', 86400),
+    'HH': (lambda t: f'{t.hour:02}', 3600),
+    'mm': (lambda t: f'{t.minute:02}', 60),
+    'ss': (lambda t: f'{t.second:02}', 1)
+}
+
+# The tokens that hold the same value for the life of the process.
+STATIC_TOKENS = {
+    'hostname': socket.gethostname,
+    'pid': lambda: str(os.getpid())
+}
+
+
+class PrefixTemplate:
+    """
+    A prefix pattern compiled for rendering once per message.
+
+    The static tokens are substituted when the pattern is compiled, leaving
+    a format string for the time tokens.  As a rendered prefix only changes
+    when the finest of its time tokens does, the last rendered prefixes are
+    kept along with the time bucket they are for, so most messages cost no
+    more than a clock read and a comparison.
+
+    If the pattern has a {shard} token, the prefix is rendered once for each
+    shard and a message is given the shard of its key (a checksum of the
+    key modulo the number of shards), so that messages written at the same
+    time are spread over that many prefixes.
+
+    Attributes
+    ----------
+    resolution : int
+        The number of seconds for which a rendered prefix holds, or 0 if the
+        pattern has no time tokens.
+    shards : int
+        The number of shards, which is 1 if the pattern has no {shard}
+        token.
+
+    Parameters
+    ----------
+    pattern : str
+        The prefix pattern.  See Handler.path_prefix for the tokens.
+    shards : int, optional
+        The number of shards for the {shard} token, by default 1.
+
+    Raises
+    ------
+    ValueError
+        If the pattern would not produce a valid path name or the number of
+        shards is less than 1.
+    """
+
+    def __init__(self, pattern: str, shards: int = 1) -> None:
+        names = set(TOKEN.findall(pattern))
+        self._fields = [name for name in TIME_TOKENS if name in names]
+        self.resolution = min(
+            [TIME_TOKENS[name][1] for name in self._fields], default=0
+        )
+        self._shard_names = shard_names(shards)
+        self.shards = shards if SHARD_TOKEN in names else 1
+        self._template = ESCAPED_TOKEN.sub(
+            self._replace, escape(pattern.removesuffix('/') + '/')
+        )
+        self._cache = (None, None)
+        validate(self.render())
+
+    def render(self, timestamp: Optional[datetime.datetime] = None,
+               key: Optional[str] = None) -> str:
+        """
+        Render the prefix for a time.
+
+        Parameters
+        ----------
+        timestamp : datetime.datetime, optional
+            The time to render the prefix for, by default the current time
+            in UTC.
+        key : str, optional
+            The key (such as the message ID) to choose the shard by, by
+            default None for the first shard.
+
+        Returns
+        -------
+        str
+            The prefix, ending with a slash.
+        """
+        shard = self.shard(key)
+
+        if timestamp is not None:
+            return self._format(timestamp, shard)
+
+        now = time.time()
+        bucket = int(now // self.resolution) if self.resolution else 0
+        cached_bucket, prefixes = self._cache
+
+        if bucket != cached_bucket:
+            timestamp = datetime.datetime.fromtimestamp(now, utc)
+            prefixes = [self._format(timestamp, n)
+                        for n in range(self.shards)]
+            self._cache = (bucket, prefixes)
+
+        return prefixes[shard]
+
+    def shard(self, key: Optional[str]) -> int:
+        """
+        Get the shard of a key.
+
+        Parameters
+        ----------
+        key : str
+            The key, or None for the first shard.
+
+        Returns
+        -------
+        int
+            The shard, from 0 up to the number of shards.
+        """
+        if key is None or self.shards == 1:
+            return 0
+
+        return zlib.crc32(key.encode('utf-8', 'surrogateescape')) % (
+            self.shards
+        )
+
+    def _format(self, timestamp: datetime.datetime, shard: int = 0) -> str:
+        """Substitute the time and shard tokens in the template."""
+        values = {name: TIME_TOKENS[name][0](timestamp)
+                  for name in self._fields}
+        values[SHARD_TOKEN] = self._shard_names[shard]
+        return self._template.format_map(values)
+
+    def _replace(self, match: re.Match) -> str:
+        """Substitute a static token, or restore a time token for format."""
+        name = match.group(1)
+
+        if name in STATIC_TOKENS:
+            return escape(STATIC_TOKENS[name]())
+        elif name in TIME_TOKENS or name == SHARD_TOKEN:
+            return f'{{{name}}}'
+
+        return match.group(0)
+
+
+def escape(text: str) -> str:
+    """
+    Escape the braces in text for use in a format string.
+
+    Parameters
+    ----------
+    text : str
+        The text to be escaped.
+
+    Returns
+    -------
+    str
+        The text with each brace doubled.
+    """
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def shard_names(shards: int) -> list[str]:
+    """
+    Get the value of the {shard} token for each shard.
+
+    Parameters
+    ----------
+    shards : int
+        The number of shards.
+
+    Returns
+    -------
+    list[str]
+        The shard numbers, zero padded to the same width so that they sort
+        in order.
+
+    Raises
+    ------
+    ValueError
+        If the number of shards is less than 1.
+    """
+    if shards < 1:
+        raise ValueError('The number of shards must be > 0.')
+
+    width = len(str(shards - 1))
+    return [f'{n:0{width}}' for n in range(shards)]
+
+
+def validate(prefix: str) -> None:
+    """
+    Check that a rendered prefix is a valid S3 URL.
+
+    Parameters
+    ----------
+    prefix : str
+        The rendered prefix.
+
+    Raises
+    ------
+    ValueError
+        If the URL scheme is not "s3" or it has no bucket name.
+    """
+    parse_result = urlparse(prefix)
+
+    try:
+        assert parse_result.scheme == 's3', 'URL scheme must be "s3".'
+        bucket_name = parse_result.netloc
+        assert len(bucket_name), 'Bucket name not specified.'
+    except AssertionError as ex:
+        raise ValueError(ex)
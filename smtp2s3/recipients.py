@@ -0,0 +1,160 @@
+"""Decide which recipient addresses to accept messages for."""
+import functools
+import re
+from typing import Iterable, Optional, Union
+
+
+class RecipientPolicy:
+    """
+    Admit recipient addresses from an index, falling back to a regex.
+
+    Addresses are first looked up in hash sets of exact addresses, exact
+    domains and wildcard domains (which match the domain and any of its
+    subdomains).  Only addresses not found there are matched against the
+    regex, and the most recent of those verdicts may be cached, as a regex
+    listing many addresses is costly to match for every recipient.
+
+    Addresses and domains are compared without regard to case.  A regex
+    given as a string is only compiled once an address is matched against
+    it (or the regex is read), as a long regex is slow to compile.
+
+    Attributes
+    ----------
+    addresses : set[str]
+        The addresses in the index.
+    domains : set[str]
+        The domains in the index.
+    indexing : bool
+        True once an entry has been added to the index.
+    regex : re.Pattern
+        The regex, compiled when first read.
+    wildcards : set[str]
+        The wildcard domains in the index, less the leading "*.".
+
+    Parameters
+    ----------
+    pattern : re.Pattern or str
+        The regex that any other address must match in full.
+    recipients : Iterable[str], optional
+        The index entries.  An entry is an address ("bob@example.com"), a
+        domain ("example.com" or "@example.com") or a wildcard domain
+        ("*.example.com").  By default, none.
+    cache_size : int, optional
+        The number of regex verdicts to cache, by default 0 for none.
+    """
+
+    def __init__(self, pattern: Union[re.Pattern, str],
+                 recipients: Iterable[str] = (),
+                 cache_size: int = 0) -> None:
+        self.addresses = set()
+        self.domains = set()
+        self.indexing = False
+        self.wildcards = set()
+        self._match = functools.lru_cache(maxsize=cache_size)(self._fullmatch)
+        self._pattern = pattern
+
+        for entry in recipients:
+            self.add(entry)
+
+    def add(self, entry: str) -> None:
+        """
+        Add an entry to the index.
+
+        Parameters
+        ----------
+        entry : str
+            An address, domain or wildcard domain.  Empty entries are
+            skipped.
+        """
+        entry = entry.strip().lower()
+
+        if not entry:
+            return
+
+        self.indexing = True
+
+        if entry.startswith('*.'):
+            self.wildcards.add(entry[2:])
+        elif entry.startswith('@') or '@' not in entry:
+            self.domains.add(entry.removeprefix('@'))
+        else:
+            self.addresses.add(entry)
+
+    def admit(self, address: str) -> bool:
+        """
+        Decide if messages are accepted for an address.
+
+        Parameters
+        ----------
+        address : str
+            The address given in the RCPT TO command.
+
+        Returns
+        -------
+        bool
+            True if the address is in the index or matches the regex.
+        """
+        if self.indexing and self.indexed(address):
+            return True
+
+        return self._match(address) is not None
+
+    def cache_info(self) -> functools._CacheInfo:
+        """
+        Get the statistics of the regex verdict cache.
+
+        Returns
+        -------
+        functools._CacheInfo
+            The hits, misses, maximum size and current size of the cache.
+        """
+        return self._match.cache_info()
+
+    def indexed(self, address: str) -> bool:
+        """
+        Check if an address is in the index.
+
+        Parameters
+        ----------
+        address : str
+            The address given in the RCPT TO command.
+
+        Returns
+        -------
+        bool
+            True if the address, its domain or any parent of its domain is
+            in the index.
+        """
+        address = address.lower()
+        domain = address.rpartition('@')[2]
+
+        if address in self.addresses or domain in self.domains:
+            return True
+
+        return bool(self.wildcards) and self._in_wildcard(domain)
+
+    @functools.cached_property
+    def regex(self) -> re.Pattern:
+        """
+        Get the regex, compiling it if required.
+
+        Returns
+        -------
+        re.Pattern
+            The compiled regex.
+        """
+        return re.compile(self._pattern)
+
+    def _fullmatch(self, address: str) -> Optional[re.Match]:
+        """Match an address against the regex in full."""
+        return self.regex.fullmatch(address)
+
+    def _in_wildcard(self, domain: str) -> bool:
+        """Check if a domain or any parent of it is a wildcard domain."""
+        while domain:
+            if domain in self.wildcards:
+                return True
+
+            domain = domain.partition('.')[2]
+
+        return False
@@ -0,0 +1,338 @@
+"""The SMTP server for smtp2s3."""
+import asyncio
+import functools
+from typing import Any, AsyncIterator, Callable, Optional
+
+from aiosmtpd.smtp import SMTP, syntax
+
+from smtp2s3 import get_logger
+from smtp2s3.metrics import ACTIVE_SESSIONS, MESSAGE_BYTES, MESSAGES
+from smtp2s3.stream import STORE_FAILURE, MessageStream
+
+LINE_TOO_LONG = '500 Line too long (see RFC5321 4.5.3.1.6)'
+SHUTTING_DOWN = '421 4.3.2 Service shutting down'
+TOO_MUCH_DATA = '552 Error: Too much mail data'
+
+logger = get_logger('smtp2s3')
+
+
+def unstuff(line: bytes) -> bytes:
+    """
+    Remove the dot-stuffing from a line of DATA.
+
+    Parameters
+    ----------
+    line : bytes
+        The line as it was received.
+
+    Returns
+    -------
+    bytes
+        The line without any leading dot added by the client.
+    """
+    return line[1:] if line.startswith(b'.') else line
+
+
+class DataState:
+    """
+    Track the DATA of a message as it is streamed.
+
+    Attributes
+    ----------
+    error : str
+        The first error found in the DATA, or None if there is none.
+    partial : bool
+        True if the last read ended part way through an overlong line.
+    size : int
+        The number of bytes of DATA received.
+
+    Parameters
+    ----------
+    limit : int
+        The maximum size in bytes of the DATA, or None for no limit.
+    """
+
+    def __init__(self, limit: Optional[int]) -> None:
+        self.error = None
+        self.partial = False
+        self.size = 0
+        self._limit = limit
+
+    def count(self, line: bytes) -> None:
+        """
+        Count a line of DATA towards the size limit.
+
+        Parameters
+        ----------
+        line : bytes
+            The line as it was read.
+        """
+        self.partial = False
+        self.size += len(line)
+
+        if self._limit and self.size > self._limit:
+            self.fail(TOO_MUCH_DATA)
+
+    def fail(self, error: str) -> None:
+        """
+        Record an error, unless one has already been found.
+
+        Parameters
+        ----------
+        error : str
+            The status to reply with once the DATA has been read.
+        """
+        if self.error is None:
+            self.error = error
+
+
+class SMTPServer(SMTP):
+    """
+    An SMTP server that can stream DATA to the handler as it arrives.
+
+    The handler is told when each connection is made and lost, so that it
+    can start work on the peer (such as DNSBL checks) before the first
+    command.  If the handler refuses the session, the refusal is sent in
+    place of the greeting and the connection closed.
+
+    If the handler has streaming enabled, each line of DATA is written to
+    a stream opened by the handler rather than the whole message being
+    collected in memory first.  Otherwise DATA is handled as by the aiosmtpd
+    SMTP class.
+
+    Once draining, any further command is answered with a 421 and the
+    connection closed, but a DATA command already under way is finished.
+
+    The sessions open and the messages and bytes of DATA received (by the
+    reply code) are counted in the metrics.
+
+    Attributes
+    ----------
+    draining : bool
+        True if the service is shutting down.
+    in_data : bool
+        True while a DATA command is being received and handled.
+    refusal : str
+        The reply refusing the session if the handler did not admit it,
+        otherwise None.
+
+    Parameters
+    ----------
+    handler : Handler
+        The handler of the SMTP events.
+    connections : set, optional
+        A set to hold the server while its connection is open, by default
+        None.
+    **kwargs
+        Passed on to aiosmtpd's SMTP.
+    """
+
+    def __init__(self, handler: object, connections: Optional[set] = None,
+                 **kwargs) -> None:
+        super().__init__(handler, **kwargs)
+        self.connections = set() if connections is None else connections
+        self.draining = False
+        self.in_data = False
+        self.refusal = None
+        self._data_size = 0
+        self._receiving = False
+        self._smtp_methods = {
+            name: self._unless_draining(method)
+            for name, method in self._smtp_methods.items()
+        }
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        """
+        Start a session for a new connection.
+
+        Parameters
+        ----------
+        transport : asyncio.BaseTransport
+            The transport of the connection.
+        """
+        super().connection_made(transport)
+        self.connections.add(self)
+        ACTIVE_SESSIONS.inc()
+        self.refusal = self.event_handler.connect(self.session)
+
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        """
+        End the session of a lost connection.
+
+        Parameters
+        ----------
+        error : Exception
+            The error the connection was lost with, or None on EOF.
+        """
+        self.connections.discard(self)
+        ACTIVE_SESSIONS.dec()
+        self.event_handler.disconnect(self.session)
+        super().connection_lost(error)
+
+    async def push(self, status: str) -> None:
+        """
+        Send a reply, counting the message if it ends DATA.
+
+        Parameters
+        ----------
+        status : str
+            The reply.
+        """
+        if self.in_data:
+            self._count_reply(status)
+
+        await super().push(status)
+
+    async def shutdown(self, status: str = SHUTTING_DOWN) -> None:
+        """
+        Reply with a 421 and close the connection.
+
+        Parameters
+        ----------
+        status : str, optional
+            The reply, by default that the service is shutting down.
+        """
+        if self.transport is None:
+            return
+
+        await self.push(status)
+        self.transport.close()
+
+    @syntax('DATA')
+    async def smtp_DATA(self, arg: str) -> None:
+        """
+        Handle the DATA command.
+
+        Parameters
+        ----------
+        arg : str
+            Any argument given with the command.
+        """
+        self.in_data = True
+        self._data_size = 0
+        self._receiving = False
+
+        try:
+            await self._receive_data(arg)
+        finally:
+            self.in_data = False
+
+    async def _call_handler_hook(self, command: str, *args) -> Any:
+        """Call a handler hook, noting the size of the DATA first."""
+        if command == 'DATA':
+            self._data_size = len(self.envelope.original_content or b'')
+
+        return await super()._call_handler_hook(command, *args)
+
+    def _count_reply(self, status: str) -> None:
+        """Count the message and its bytes by the reply that ends DATA."""
+        if status.startswith('354'):
+            self._receiving = True
+        elif self._receiving:
+            self._receiving = False
+            code = status[:3]
+            MESSAGES.inc(code=code)
+            MESSAGE_BYTES.inc(self._data_size, code=code)
+
+    async def _handle_client(self) -> None:
+        """Serve the session, or send the refusal if it was not admitted."""
+        if self.refusal is None:
+            return await super()._handle_client()
+
+        await self.shutdown(self.refusal)
+
+    async def _receive_data(self, arg: str) -> None:
+        """Receive DATA, streaming it to the handler if enabled."""
+        if not self.event_handler.streaming:
+            return await super().smtp_DATA(arg)
+        elif not await self._data_allowed(arg):
+            return
+
+        await self.push('354 End data with <CR><LF>.<CR><LF>')
+        stream = self.event_handler.open_stream(self.session, self.envelope)
+        status = await self._stream_data(stream)
+        self._set_post_data_state()
+        await self.push(status)
+
+    async def _data_allowed(self, arg: str) -> bool:
+        """Check that DATA may be sent, replying with an error if not."""
+        if await self.check_helo_needed():
+            return False
+        elif await self.check_auth_needed('DATA'):
+            return False
+        elif not self.envelope.rcpt_tos:
+            await self.push('503 Error: need RCPT command')
+            return False
+        elif arg:
+            await self.push('501 Syntax: DATA')
+            return False
+
+        return True
+
+    async def _data_lines(self, state: DataState) -> AsyncIterator[bytes]:
+        """Read lines of DATA up to the lone dot, removing dot-stuffing."""
+        while self.transport is not None:
+            line = await self._read_line(state)
+
+            if line is None:
+                continue
+            elif line == b'.\r\n' and not state.partial:
+                return
+
+            state.count(line)
+            yield unstuff(line)
+
+    async def _read_line(self, state: DataState) -> Optional[bytes]:
+        """Read a line of DATA, or None if it was too long to buffer."""
+        try:
+            return await self._reader.readuntil(b'\r\n')
+        except asyncio.LimitOverrunError as ex:
+            await self._reader.read(ex.consumed)
+            state.fail(LINE_TOO_LONG)
+            state.partial = True
+            return None
+
+    async def _stream_data(self, stream: MessageStream) -> str:
+        """Stream DATA to the handler, returning the status to reply with."""
+        state = DataState(self.data_size_limit)
+
+        try:
+            async for line in self._data_lines(state):
+                await self._write_line(stream, state, line)
+        except BaseException:
+            await asyncio.shield(stream.abort())
+            raise
+
+        self._data_size = state.size
+        error = state.error or await self.event_handler.check_peer(
+            self.session, 'DATA'
+        )
+
+        if error is not None:
+            await stream.abort()
+            return error
+
+        return await stream.close()
+
+    def _unless_draining(self, method: Callable) -> Callable:
+        """Wrap a command to reply with a 421 instead once draining."""
+        @functools.wraps(method)
+        async def command(arg: Optional[str]) -> None:
+            if self.draining:
+                return await self.shutdown()
+
+            await method(arg)
+
+        return command
+
+    async def _write_line(self, stream: MessageStream, state: DataState,
+                          line: bytes) -> None:
+        """Write a line to the stream unless the DATA has already failed."""
+        if state.error is not None:
+            return
+
+        try:
+            await stream.write(line)
+        except Exception as ex:
+            logger.error(f'Unable to stream DATA {ex}.')
+            state.fail(STORE_FAILURE)
@@ -0,0 +1,263 @@
+"""Serve SMTP on the running event loop, draining connections to stop."""
+import asyncio
+import contextlib
+import os
+from logging import Logger
+from typing import Callable, Optional
+
+from smtp2s3.metrics import CONTENT_TYPE, REGISTRY
+from smtp2s3.server import SMTPServer
+from smtp2s3.startup import STARTUP
+
+HTTP_STATUSES = {
+    200: 'OK',
+    404: 'Not Found',
+    503: 'Service Unavailable'
+}
+METRICS_INTERVAL = 1
+
+
+class SMTPService:
+    """
+    An SMTP service that drains its connections before stopping.
+
+    Stopping the service first reports it as not ready, so that Kubernetes
+    stops routing connections to it, then (after the drain delay) stops
+    accepting connections.  Any further command on an open connection is
+    answered with a 421, while DATA commands already under way are given
+    until the drain timeout to finish.  Any connections still open are
+    then closed.
+
+    If an HTTP port is given, "/ready" answers 200 while the service is
+    accepting connections (and 503 otherwise), "/live" always answers 200
+    and "/metrics" answers with the metrics in the Prometheus text format.
+    Where there are several worker processes, each dumps its metrics to a
+    file in a shared directory every second, so that a scrape of any
+    worker gets the sum of all of them (or, for the metrics that are per
+    worker, the value of each).
+
+    Attributes
+    ----------
+    connections : set[SMTPServer]
+        The servers of the open connections.
+    ready : bool
+        True while the service is accepting connections.
+
+    Parameters
+    ----------
+    handler : Handler
+        The handler of the SMTP events.
+    logger : logging.Logger
+        A logger to be used.
+    hostname : str
+        The hostname to listen on.
+    port : int
+        The port number to listen on for SMTP.
+    data_size_limit : int, optional
+        The maximum size in bytes for a message, by default None for no limit.
+    reuse_port : bool, optional
+        True to bind with SO_REUSEPORT, by default False.
+    drain_delay : float, optional
+        The number of seconds between reporting not ready and no longer
+        accepting connections, by default 0.
+    drain_timeout : float, optional
+        The number of seconds to wait for DATA commands to finish, by
+        default 20.
+    http_port : int, optional
+        The port number to answer probes and metrics scrapes on, by default
+        None for none.
+    metrics_path : str, optional
+        The file to dump the metrics of this worker process to, in the
+        directory shared by the workers, by default None for a single
+        process.
+    """
+
+    def __init__(self, handler: object, logger: Logger, hostname: str,
+                 port: int, data_size_limit: Optional[int] = None,
+                 reuse_port: bool = False, drain_delay: float = 0,
+                 drain_timeout: float = 20,
+                 http_port: Optional[int] = None,
+                 metrics_path: Optional[str] = None) -> None:
+        self.connections = set()
+        self.handler = handler
+        self.ready = False
+        self._data_size_limit = data_size_limit
+        self._drain_delay = drain_delay
+        self._drain_timeout = drain_timeout
+        self._hostname = hostname
+        self._http_port = http_port
+        self._logger = logger
+        self._metrics_path = metrics_path
+        self._metrics_task = None
+        self._port = port
+        self._reuse_port = reuse_port or None
+        self._servers = []
+
+    def factory(self) -> SMTPServer:
+        """
+        Create the SMTP server for a connection.
+
+        Returns
+        -------
+        SMTPServer
+            The server to handle the connection.
+        """
+        return SMTPServer(self.handler, connections=self.connections,
+                          data_size_limit=self._data_size_limit)
+
+    async def start(self) -> None:
+        """
+        Start the handler and listen for connections.
+
+        Probes are answered while the handler starts (which may replay the
+        spool or open S3 connections), with "/ready" answering 503 until
+        the service is accepting connections.
+        """
+        if self._http_port is not None:
+            self._servers.append(
+                await asyncio.start_server(self._probe, self._hostname,
+                                           self._http_port,
+                                           reuse_port=self._reuse_port)
+            )
+
+        await self.handler.start()
+        loop = asyncio.get_running_loop()
+
+        with STARTUP.phase('bind'):
+            self._servers.insert(
+                0,
+                await loop.create_server(self.factory, self._hostname,
+                                         self._port,
+                                         reuse_port=self._reuse_port)
+            )
+
+        if self._metrics_path is not None:
+            self._metrics_task = asyncio.create_task(self._dump_metrics())
+
+        self.ready = True
+
+    async def stop(self) -> None:
+        """Drain the connections, then stop the handler."""
+        self.ready = False
+        await asyncio.sleep(self._drain_delay)
+        smtp_server = self._servers[0]
+        smtp_server.close()
+
+        for server in self.connections:
+            server.draining = True
+
+        if not await self._wait_for_data():
+            self._logger.warning('Drain timed out with DATA in progress.')
+
+        for server in list(self.connections):
+            await server.shutdown()
+
+        for server in self._servers:
+            server.close()
+
+        await self._stop_dumping_metrics()
+        await self.handler.stop()
+
+    def metrics(self) -> bytes:
+        """
+        Render the metrics for a scrape.
+
+        Returns
+        -------
+        bytes
+            The metrics of this process, or the sum of those of all of the
+            worker processes, in the Prometheus text format.
+        """
+        if self._metrics_path is None:
+            return REGISTRY.render().encode()
+
+        REGISTRY.dump(self._metrics_path)
+        samples = REGISTRY.collect(os.path.dirname(self._metrics_path))
+        return REGISTRY.render(samples).encode()
+
+    async def _dump_metrics(self) -> None:
+        """Dump the metrics of this worker to its file periodically."""
+        while True:
+            REGISTRY.dump(self._metrics_path)
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def _probe(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Answer an HTTP probe or metrics scrape."""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+            path = request.split(b' ', 2)[1].decode('ascii', 'replace')
+            status = self._probe_status(path)
+            body = self.metrics() if path == '/metrics' else b''
+            writer.write(
+                f'HTTP/1.1 {status} {HTTP_STATUSES[status]}\r\n'
+                f'Content-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                'Connection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                IndexError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def _probe_status(self, path: str) -> int:
+        """Get the HTTP status for a probe of a path."""
+        if path in ('/live', '/metrics'):
+            return 200
+        elif path == '/ready':
+            return 200 if self.ready else 503
+
+        return 404
+
+    async def _stop_dumping_metrics(self) -> None:
+        """Cancel the periodic dump of the metrics, if there is one."""
+        if self._metrics_task is None:
+            return
+
+        self._metrics_task.cancel()
+
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._metrics_task
+
+    async def _wait_for_data(self) -> bool:
+        """Wait for any DATA commands to finish, or False on the timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._drain_timeout
+
+        while any(server.in_data for server in self.connections):
+            if loop.time() >= deadline:
+                return False
+
+            await asyncio.sleep(0.05)
+
+        return True
+
+
+def loop_factory(name: str, logger: Logger) -> Optional[Callable]:
+    """
+    Get the factory of the event loop to run the service on.
+
+    Parameters
+    ----------
+    name : str
+        Either "asyncio" or "uvloop".
+    logger : logging.Logger
+        A logger to warn with if uvloop is not installed.
+
+    Returns
+    -------
+    Callable or None
+        The uvloop event loop factory, or None for the asyncio default.
+    """
+    if name != 'uvloop':
+        return None
+
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning('uvloop is not installed, using the asyncio loop.')
+        return None
+
+    return uvloop.new_event_loop
@@ -0,0 +1,642 @@
+"""A durable local spool of received messages awaiting upload to S3."""
+import asyncio
+import glob
+import json
+import math
+import os
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Any, BinaryIO, Callable, Coroutine, Optional
+
+from smtp2s3.metrics import SPOOL_BYTES, SPOOL_DEAD_LETTERS
+
+DEAD_LETTERS = 'dead-letters.dlq'
+RECORD_HEADER = struct.Struct('>IQI')
+RETRY_MAX_DELAY = 60.0
+RETRY_MIN_DELAY = 1.0
+SEGMENT_SUFFIX = '.wal'
+WORKER_DIRECTORY = re.compile(r'worker-(\d+)')
+
+
+def list_segments(directory: str) -> list[str]:
+    """
+    List the segments of a spool, oldest first.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the spool.
+
+    Returns
+    -------
+    list[str]
+        The paths of the segments.
+    """
+    pattern = os.path.join(directory, f'*{SEGMENT_SUFFIX}')
+    return sorted(glob.glob(pattern))
+
+
+def next_segment_path(directory: str) -> str:
+    """
+    Get the path of the segment to follow the newest one in a spool.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the spool.
+
+    Returns
+    -------
+    str
+        The path of the next segment.
+    """
+    segments = list_segments(directory)
+    sequence = 0
+
+    if segments:
+        name = os.path.basename(segments[-1])
+        sequence = int(name.removesuffix(SEGMENT_SUFFIX)) + 1
+
+    return os.path.join(directory, f'{sequence:016}{SEGMENT_SUFFIX}')
+
+
+def worker_spools(directory: str) -> dict[int, str]:
+    """
+    Find the spools of the workers in a spool directory.
+
+    Parameters
+    ----------
+    directory : str
+        The spool directory (SPOOL_DIRECTORY).
+
+    Returns
+    -------
+    dict[int, str]
+        The directory of the spool of each worker, by the worker index.
+    """
+    spools = {}
+
+    for name in os.listdir(directory):
+        match = WORKER_DIRECTORY.fullmatch(name)
+
+        if match:
+            spools[int(match[1])] = os.path.join(directory, name)
+
+    return dict(sorted(spools.items()))
+
+
+def orphaned_spools(directory: str, workers: int) -> list[str]:
+    """
+    List the spools in a spool directory that no worker appends to.
+
+    A single process spools to the spool directory itself, so the spool of
+    every worker is an orphan.  With more workers, each spools to its own
+    worker-N subdirectory, so the spool directory itself and the spools of
+    workers that no longer run are orphans.
+
+    Parameters
+    ----------
+    directory : str
+        The spool directory (SPOOL_DIRECTORY).
+    workers : int
+        The number of worker processes (SMTP_WORKERS).
+
+    Returns
+    -------
+    list[str]
+        The directories of the orphaned spools.
+    """
+    spools = worker_spools(directory)
+
+    if workers < 2:
+        return list(spools.values())
+
+    return [directory] + [path for index, path in spools.items()
+                          if index >= workers]
+
+
+def adopt_orphans(directory: str, workers: int, logger: Logger) -> None:
+    """
+    Move the segments of orphaned spools into the spool of the first worker.
+
+    Segments are left without a spool to replay them when the number of
+    workers is lowered, or when a single process is changed to run workers
+    (or back).  Moving them to the spool of the first worker (or of the
+    single process) has them replayed when that spool starts.  This must be
+    called before that spool is started.
+
+    Parameters
+    ----------
+    directory : str
+        The spool directory (SPOOL_DIRECTORY).
+    workers : int
+        The number of worker processes (SMTP_WORKERS).
+    logger : logging.Logger
+        A logger to be used.
+    """
+    if not os.path.isdir(directory):
+        return
+
+    target = directory if workers < 2 else os.path.join(directory, 'worker-0')
+    os.makedirs(target, exist_ok=True)
+
+    for orphan in orphaned_spools(directory, workers):
+        adopt_spool(orphan, target, logger)
+
+
+def adopt_spool(orphan: str, target: str, logger: Logger) -> None:
+    """
+    Move the segments of a spool, with their checkpoints, into another.
+
+    The segments follow those already in the target, keeping their order.
+
+    Parameters
+    ----------
+    orphan : str
+        The directory of the spool to move the segments from.
+    target : str
+        The directory of the spool to move the segments to.
+    logger : logging.Logger
+        A logger to be used.
+    """
+    segments = list_segments(orphan)
+
+    for path in segments:
+        adopted = next_segment_path(target)
+        os.rename(path, adopted)
+
+        if os.path.exists(f'{path}.ckpt'):
+            os.rename(f'{path}.ckpt', f'{adopted}.ckpt')
+
+    if segments:
+        logger.warning(f'Adopted {len(segments)} spool segments from '
+                       f'"{orphan}" into "{target}".')
+
+
+def encode_record(header: dict, content: bytes) -> bytes:
+    """
+    Encode a message as a record of a spool segment.
+
+    Parameters
+    ----------
+    header : dict
+        Details of where and how the message is to be stored.
+    content : bytes
+        The content of the message.
+
+    Returns
+    -------
+    bytes
+        The record.
+    """
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    checksum = zlib.crc32(content, zlib.crc32(header_bytes))
+    prefix = RECORD_HEADER.pack(len(header_bytes), len(content), checksum)
+    return prefix + header_bytes + content
+
+
+def read_records(path: str, offset: int, end: Optional[int],
+                 limit: int) -> list[tuple[dict, bytes, int]]:
+    """
+    Read complete records from a spool segment.
+
+    Reading stops at the end of the segment, at the end offset, once the
+    limit is reached or at the first torn or corrupt record.
+
+    Parameters
+    ----------
+    path : str
+        The path of the segment file.
+    offset : int
+        The offset in the file to read from.
+    end : int, optional
+        The offset to stop reading at.  None to read to the end of file.
+    limit : int
+        The maximum number of records to read.
+
+    Returns
+    -------
+    list[tuple[dict, bytes, int]]
+        The header, content and end offset of each record read.
+    """
+    records = []
+
+    with open(path, 'rb') as stream:
+        stream.seek(offset)
+
+        while len(records) < limit and (end is None or stream.tell() < end):
+            record = read_record(stream)
+
+            if record is None:
+                break
+
+            records.append(record)
+
+    return records
+
+
+def read_record(stream: BinaryIO) -> Optional[tuple[dict, bytes, int]]:
+    """
+    Read a single record from a spool segment.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        The segment file positioned at the start of a record.
+
+    Returns
+    -------
+    tuple[dict, bytes, int] or None
+        The header, content and end offset of the record or None if the
+        record is incomplete or fails its checksum.
+    """
+    prefix = stream.read(RECORD_HEADER.size)
+
+    if len(prefix) < RECORD_HEADER.size:
+        return None
+
+    header_size, content_size, checksum = RECORD_HEADER.unpack(prefix)
+    body = stream.read(header_size + content_size)
+
+    if len(body) < header_size + content_size or zlib.crc32(body) != checksum:
+        return None
+
+    header = json.loads(body[:header_size])
+    return header, body[header_size:], stream.tell()
+
+
+class SpoolFull(Exception):
+    """The message was refused as the spool holds its maximum bytes."""
+
+
+class Spool:
+    """
+    A write-ahead spool of messages on local disk.
+
+    Messages are appended to segment files and acknowledged once they
+    have been flushed to disk.  Flushes are batched so that one fsync
+    commits every message appended during the commit interval.  A
+    background drainer uploads spooled messages and removes segments once
+    every message in them has been stored.  Segments left over from a
+    previous run are replayed when the spool starts.
+
+    A message that fails to upload is retried from the spool, without
+    limit while S3 is unavailable.  Other failures (such as S3 refusing the
+    request) are counted, and once a message has failed max_attempts times
+    it is moved to the dead letters file in the spool directory, in the
+    same format as the segments, so that the rest of the spool drains.
+
+    Attributes
+    ----------
+    directory : str
+        The directory the spool segments are kept in.
+    size : int
+        The bytes of the spool segments on disk.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to keep the spool segments in.
+    store : Callable[[dict, bytes], Coroutine]
+        A coroutine function that uploads a spooled message given its
+        header and content.
+    logger : logging.Logger
+        A logger to be used.
+    commit_interval : float, optional
+        The number of seconds to collect appends for before flushing them
+        to disk, by default 0.01.
+    segment_size : int, optional
+        The size in bytes after which a new segment is started, by
+        default 64MB.
+    batch_size : int, optional
+        The number of messages to upload at once when draining, by
+        default 10.
+    max_attempts : int, optional
+        The number of times a message may fail to upload (other than while
+        S3 is unavailable) before it is moved to the dead letters, by
+        default 5.  If 0, it is retried without limit.
+    max_bytes : int, optional
+        The bytes of segments on disk at which further messages are refused
+        with SpoolFull, by default 0 for no limit.
+    is_outage : Callable[[BaseException], bool], optional
+        A function to check if an upload failed as S3 was unavailable, by
+        default None to count every failure.
+    """
+
+    def __init__(self, directory: str,
+                 store: Callable[[dict, bytes], Coroutine[Any, Any, Any]],
+                 logger: Logger, commit_interval: float = 0.01,
+                 segment_size: int = 64 * 1024 * 1024,
+                 batch_size: int = 10, max_attempts: int = 5,
+                 max_bytes: int = 0,
+                 is_outage: Optional[Callable[[BaseException], bool]] = None
+                 ) -> None:
+        self.directory = directory
+        self.size = 0
+        self._active_path = None
+        self._attempts = {}
+        self._batch_size = batch_size
+        self._commit_handle = None
+        self._commit_interval = commit_interval
+        self._commit_tasks = set()
+        self._committed = (None, 0)
+        self._drainer = None
+        self._draining = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='smtp2s3-spool'
+        )
+        self._is_outage = is_outage or (lambda ex: False)
+        self._logger = logger
+        self._max_attempts = max_attempts or math.inf
+        self._max_bytes = max_bytes or math.inf
+        self._pending = []
+        self._segment_size = segment_size
+        self._store = store
+        self._stream = None
+        self._wakeup = asyncio.Event()
+
+    async def append(self, header: dict, content: bytes) -> None:
+        """
+        Append a message to the spool.
+
+        Returns once the message has been committed to disk.
+
+        Parameters
+        ----------
+        header : dict
+            Details of where and how the message is to be stored.
+        content : bytes
+            The content of the message.
+
+        Raises
+        ------
+        SpoolFull
+            If the spool already holds its maximum bytes.
+        """
+        if self.size >= self._max_bytes:
+            raise SpoolFull(f'The spool holds {self.size} bytes.')
+
+        loop = asyncio.get_running_loop()
+        record = encode_record(header, content)
+        await loop.run_in_executor(self._executor, self._write, record)
+        self._resize(len(record))
+        committed = loop.create_future()
+        self._pending.append(committed)
+
+        if self._commit_handle is None:
+            self._commit_handle = loop.call_later(self._commit_interval,
+                                                  self._begin_commit)
+
+        await committed
+
+    async def drain(self) -> None:
+        """Upload every committed message in the spool."""
+        loop = asyncio.get_running_loop()
+
+        async with self._draining:
+            segments = await loop.run_in_executor(None, self._segments)
+
+            for path in segments:
+                await self._drain_segment(path)
+
+    async def start(self) -> None:
+        """Open a new segment and start draining the spool."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open_segment)
+        self._resize(await loop.run_in_executor(None, self._measure))
+        self._drainer = loop.create_task(self._drain_forever())
+
+    async def stop(self) -> None:
+        """Commit outstanding appends and stop draining the spool."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._begin_commit()
+
+        await asyncio.gather(*self._commit_tasks)
+
+        if self._drainer is not None:
+            self._drainer.cancel()
+            await asyncio.gather(self._drainer, return_exceptions=True)
+
+        if self._stream is not None:
+            self._executor.submit(self._stream.close)
+
+        self._executor.shutdown(wait=True)
+        self._resize(-self.size)
+
+    def _begin_commit(self) -> None:
+        """Start committing the appends made since the last commit."""
+        self._commit_handle = None
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._commit(batch))
+        self._commit_tasks.add(task)
+        task.add_done_callback(self._commit_tasks.discard)
+
+    async def _commit(self, batch: list[asyncio.Future]) -> None:
+        """Flush the spool to disk and acknowledge a batch of appends."""
+        loop = asyncio.get_running_loop()
+
+        try:
+            self._committed = await loop.run_in_executor(self._executor,
+                                                         self._sync)
+        except Exception as ex:
+            self._logger.error(f'Unable to commit the spool {ex}.')
+            self._resolve(batch, ex)
+            return
+
+        self._resolve(batch)
+        self._wakeup.set()
+
+    def _committed_end(self, path: str) -> int:
+        """Get the offset up to which a segment has been committed."""
+        committed_path, offset = self._committed
+
+        if path == committed_path:
+            return offset
+
+        return 0
+
+    async def _dead_letter(self, key: tuple[str, int], header: dict,
+                           body: bytes, error: BaseException) -> bool:
+        """Count a failure, returning True once the message is moved."""
+        if self._is_outage(error):
+            return False
+
+        attempts = self._attempts[key] = self._attempts.get(key, 0) + 1
+
+        if attempts < self._max_attempts:
+            return False
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_dead_letter,
+                                   encode_record(header, body))
+        del self._attempts[key]
+        SPOOL_DEAD_LETTERS.inc()
+        self._logger.error(f'Moved spooled message "{header.get("path")}" '
+                           f'to the dead letters after {attempts} failures '
+                           f'{error}.')
+        return True
+
+    async def _drain_forever(self) -> None:
+        """Drain the spool whenever messages are committed."""
+        delay = RETRY_MIN_DELAY
+
+        while True:
+            self._wakeup.clear()
+
+            try:
+                await self.drain()
+                delay = RETRY_MIN_DELAY
+                await self._wakeup.wait()
+            except Exception as ex:
+                self._logger.error(f'Draining the spool failed {ex}.')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    async def _drain_records(self, path: str, offset: int,
+                             records: list[tuple[dict, bytes, int]]) -> int:
+        """
+        Upload a batch of records, checkpointing up to the first failure.
+
+        Records that have failed too often are moved to the dead letters
+        and passed over.  Any other failure is raised once the records
+        before it are checkpointed, to be retried.
+        """
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[self._store(header, body) for header, body, _ in records],
+            return_exceptions=True
+        )
+        error = None
+
+        for (header, body, end), result in zip(records, results):
+            if not await self._settle((path, end), header, body, result):
+                error = result
+                break
+
+            offset = end
+
+        await loop.run_in_executor(None, self._write_checkpoint, path, offset)
+
+        if error is not None:
+            raise error
+
+        return offset
+
+    async def _drain_segment(self, path: str) -> None:
+        """Upload the messages in a segment and remove it once sealed."""
+        loop = asyncio.get_running_loop()
+        active = path == self._active_path
+        end = self._committed_end(path) if active else None
+        offset = await loop.run_in_executor(None, self._read_checkpoint, path)
+
+        while records := await loop.run_in_executor(
+                None, read_records, path, offset, end, self._batch_size):
+            offset = await self._drain_records(path, offset, records)
+
+        if not active:
+            size = await loop.run_in_executor(None, self._remove_segment,
+                                              path)
+            self._resize(-size)
+
+    def _measure(self) -> int:
+        """Get the bytes of the spool segments on disk."""
+        return sum(os.path.getsize(path) for path in self._segments())
+
+    def _open_segment(self) -> None:
+        """Open a new segment for appending to."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = next_segment_path(self.directory)
+        self._stream = open(path, 'ab')
+        self._sync_directory()
+        self._active_path = path
+
+    def _read_checkpoint(self, path: str) -> int:
+        """Read the offset up to which a segment has been uploaded."""
+        try:
+            with open(f'{path}.ckpt', 'r') as stream:
+                return int(stream.read())
+        except FileNotFoundError:
+            return 0
+
+    def _remove_segment(self, path: str) -> int:
+        """Remove a segment and its checkpoint, returning the segment size."""
+        size = os.path.getsize(path)
+
+        for name in (f'{path}.ckpt', path):
+            if os.path.exists(name):
+                os.remove(name)
+
+        self._logger.debug(f'Spool segment "{path}" drained.')
+        return size
+
+    def _resize(self, change: int) -> None:
+        """Change the bytes of the spool segments on disk."""
+        self.size += change
+        SPOOL_BYTES.inc(change)
+
+    def _resolve(self, batch: list[asyncio.Future],
+                 ex: Optional[Exception] = None) -> None:
+        """Acknowledge or fail a batch of appends."""
+        for committed in filter(lambda f: not f.done(), batch):
+            if ex is None:
+                committed.set_result(None)
+            else:
+                committed.set_exception(ex)
+
+    def _segments(self) -> list[str]:
+        """List the spool segments, oldest first."""
+        return list_segments(self.directory)
+
+    async def _settle(self, key: tuple[str, int], header: dict, body: bytes,
+                      result: Any) -> bool:
+        """Check if a record is done with: stored or moved to dead letters."""
+        if isinstance(result, BaseException):
+            return await self._dead_letter(key, header, body, result)
+
+        self._attempts.pop(key, None)
+        return True
+
+    def _sync(self) -> tuple[str, int]:
+        """Flush the active segment to disk."""
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        return self._active_path, self._stream.tell()
+
+    def _sync_directory(self) -> None:
+        """Flush the spool directory entries to disk."""
+        fd = os.open(self.directory, os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write(self, record: bytes) -> None:
+        """Write a record to the active segment."""
+        self._stream.write(record)
+
+        if self._stream.tell() >= self._segment_size:
+            self._sync()
+            self._stream.close()
+            self._open_segment()
+
+    def _write_checkpoint(self, path: str, offset: int) -> None:
+        """Record the offset up to which a segment has been uploaded."""
+        checkpoint = f'{path}.ckpt'
+
+        with open(f'{checkpoint}.tmp', 'w') as stream:
+            stream.write(str(offset))
+
+        os.replace(f'{checkpoint}.tmp', checkpoint)
+
+    def _write_dead_letter(self, record: bytes) -> None:
+        """Append a record to the dead letters and flush it to disk."""
+        with open(os.path.join(self.directory, DEAD_LETTERS), 'ab') as stream:
+            stream.write(record)
+            stream.flush()
+            os.fsync(stream.fileno())
@@ -0,0 +1,82 @@
+"""Time the phases of starting the service, to log where the time goes."""
+import contextlib
+import time
+from typing import Callable, Iterator
+
+
+class StartupProfile:
+    """
+    The seconds spent in each phase of starting the service.
+
+    The phases timed are "imports" (of the modules needed to serve SMTP),
+    "config", "handler", "bind" (listening on the SMTP port) and
+    "s3_client" (importing boto3 and creating the client, which is usually
+    finished in the background once the port is bound).
+
+    Attributes
+    ----------
+    phases : dict[str, float]
+        The seconds spent in each phase, in the order they were first timed.
+
+    Parameters
+    ----------
+    clock : Callable[[], float], optional
+        The clock to time the phases by, by default time.perf_counter.
+    """
+
+    def __init__(self,
+                 clock: Callable[[], float] = time.perf_counter) -> None:
+        self.phases = {}
+        self._clock = clock
+        self._started = clock()
+
+    def elapsed(self) -> float:
+        """
+        Get the seconds since the profile was created.
+
+        Returns
+        -------
+        float
+            The seconds since the profile was created.
+        """
+        return self._clock() - self._started
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Add the seconds that a block takes to a phase.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+        """
+        start = self._clock()
+
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - start
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def summary(self, event: str) -> str:
+        """
+        Describe the time taken to reach a point in starting.
+
+        Parameters
+        ----------
+        event : str
+            What has been reached, such as "Listening".
+
+        Returns
+        -------
+        str
+            The event and the seconds since the profile was created,
+            followed by the seconds spent in each phase so far.
+        """
+        phases = ', '.join(f'{name} {seconds:.3f}s'
+                           for name, seconds in self.phases.items())
+        return f'{event} after {self.elapsed():.3f}s ({phases}).'
+
+
+STARTUP = StartupProfile()
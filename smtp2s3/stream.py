@@ -0,0 +1,222 @@
+"""Upload message content to S3 as it arrives."""
+import asyncio
+import hashlib
+from logging import Logger
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import urlparse
+
+from aiosmtpd.smtp import Envelope, Session
+
+from smtp2s3.codec import SUFFIXES, compressobj
+from smtp2s3.headers import parse_headers
+
+if TYPE_CHECKING:  # pragma: no cover
+    from smtp2s3.handler import Handler
+
+CHUNK_SIZE = 1024 * 1024
+STORE_FAILURE = '451 4.3.0 Temporary failure storing message.'
+
+
+class MessageStream:
+    """
+    Compress and upload the content of a message as it arrives.
+
+    DATA lines are collected into chunks, each of which is compressed and
+    added to the current part.  Once a part is full, a multipart upload
+    is started (if it has not been already) and the part is uploaded, so
+    no more than a chunk and a part of any message is held in memory at
+    once.  A message that ends before filling its first part is written
+    with a single PUT instead.
+
+    The message is named and described from its headers, which are taken
+    from the first chunk.
+
+    Parameters
+    ----------
+    handler : Handler
+        The handler that the message was received by.
+    session : Session
+        The session instance currently being handled.
+    envelope : Envelope
+        The envelope instance of the current SMTP transaction.
+    part_size : int
+        The size in bytes of the parts to upload.  Must be at least the
+        5MB that S3 requires of every part but the last.
+    logger : logging.Logger
+        A logger to be used.
+    """
+
+    def __init__(self, handler: 'Handler', session: Session,
+                 envelope: Envelope, part_size: int, logger: Logger) -> None:
+        self._bucket = None
+        self._chunk = bytearray()
+        self._compressobj = None
+        self._digest = None
+
+        if handler.manifest is not None:
+            self._digest = hashlib.sha256()
+
+        self._envelope = envelope
+        self._extra_args = {}
+        self._handler = handler
+        self._json_path = None
+        self._key = None
+        self._logger = logger
+        self._metadata = None
+        self._part = bytearray()
+        self._part_size = part_size
+        self._parts = []
+        self._session = session
+        self._size = 0
+        self._upload_id = None
+
+    async def abort(self) -> None:
+        """Abandon the message, aborting any multipart upload."""
+        if self._upload_id is None:
+            return
+
+        upload_id, self._upload_id = self._upload_id, None
+        await self._run('abort_multipart_upload', UploadId=upload_id)
+
+    async def close(self) -> str:
+        """
+        Complete the upload of the message and write its metadata.
+
+        Returns
+        -------
+        str
+            A status string indicating the outcome.
+        """
+        try:
+            await self._flush_chunk(final=True)
+            await self._complete()
+        except Exception as ex:
+            self._logger.error(f'{STORE_FAILURE} {ex} "{self._key}".')
+            await asyncio.shield(self.abort())
+            return STORE_FAILURE
+
+        self._logger.debug(self._metadata)
+        return '250 OK'
+
+    async def write(self, line: bytes) -> None:
+        """
+        Write a line of the message content.
+
+        Parameters
+        ----------
+        line : bytes
+            A line of DATA, with any dot-stuffing removed.
+        """
+        self._chunk += line
+
+        if len(self._chunk) >= CHUNK_SIZE:
+            await self._flush_chunk(final=False)
+
+    def _begin(self, final: bool) -> None:
+        """Name the message and choose its codec from the first chunk."""
+        handler = self._handler
+        msg = parse_headers(bytes(self._chunk))
+        path, self._metadata = handler.new_message(self._session,
+                                                   self._envelope, msg)
+        codec = handler.compressor.codec
+
+        if final and len(self._chunk) < handler.compressor.min_size:
+            codec = 'none'
+
+        self._compressobj = compressobj(codec, handler.compressor.level)
+        eml_path = f'{path}.eml{SUFFIXES[codec]}'
+        self._json_path = f'{path}.json'
+        self._metadata.update(compression=codec, path=eml_path)
+        parse_result = urlparse(eml_path)
+        self._bucket = parse_result.netloc
+        self._key = parse_result.path.lstrip('/')
+
+    async def _complete(self) -> None:
+        """Finish writing the message content and then its metadata."""
+        handler = self._handler
+
+        if self._upload_id is None:
+            await self._set_user_metadata()
+            await self._run('put_object', Body=bytes(self._part),
+                            **self._extra_args)
+        else:
+            if self._part:
+                await self._upload_part()
+
+            await self._run(
+                'complete_multipart_upload',
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts}
+            )
+
+        self._upload_id = None
+
+        if handler.storage_layout != 'single':
+            await handler.uploader.run(handler.write_json, self._json_path,
+                                       self._metadata)
+
+        if self._digest is not None:
+            handler.list_in_manifest(self._metadata, size=self._size,
+                                     sha256=self._digest.hexdigest())
+
+    def _compress(self, chunk: bytes, final: bool) -> bytes:
+        """Compress a chunk, flushing the compressor after the last."""
+        self._size += len(chunk)
+
+        if self._digest is not None:
+            self._digest.update(chunk)
+
+        data = self._compressobj.compress(chunk)
+
+        if final:
+            data += self._compressobj.flush()
+
+        return data
+
+    async def _flush_chunk(self, final: bool) -> None:
+        """Compress the current chunk into the part, uploading when full."""
+        if self._metadata is None:
+            self._begin(final)
+
+        chunk, self._chunk = bytes(self._chunk), bytearray()
+        loop = asyncio.get_running_loop()
+        self._part += await loop.run_in_executor(None, self._compress, chunk,
+                                                 final)
+
+        if len(self._part) >= self._part_size:
+            await self._upload_part()
+
+    async def _run(self, method: str, **kwargs) -> Optional[dict]:
+        """Call an S3 client method for the message in the upload pool."""
+        handler = self._handler
+        client = handler.get_transport_params()['client']
+
+        def call() -> dict:
+            return getattr(client, method)(Bucket=self._bucket, Key=self._key,
+                                           **kwargs)
+
+        return await handler.uploader.run(call)
+
+    async def _set_user_metadata(self) -> None:
+        """Set the S3 user metadata to write the message object with."""
+        handler = self._handler
+        eml_path = self._metadata['path']
+        user_metadata = await handler.uploader.run(
+            handler.user_metadata, eml_path, self._json_path, self._metadata
+        )
+        self._extra_args = {'Metadata': user_metadata}
+
+    async def _upload_part(self) -> None:
+        """Upload the current part, starting the multipart upload first."""
+        if self._upload_id is None:
+            await self._set_user_metadata()
+            response = await self._run('create_multipart_upload',
+                                       **self._extra_args)
+            self._upload_id = response['UploadId']
+
+        part_number = len(self._parts) + 1
+        part, self._part = bytes(self._part), bytearray()
+        response = await self._run('upload_part', UploadId=self._upload_id,
+                                   PartNumber=part_number, Body=part)
+        self._parts.append({'ETag': response['ETag'],
+                            'PartNumber': part_number})
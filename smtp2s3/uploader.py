@@ -0,0 +1,446 @@
+"""Run blocking S3 writes away from the event loop."""
+import asyncio
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from smtp2s3.metrics import (UPLOAD_BREAKER_STATE, UPLOAD_LIMIT,
+                             UPLOADS_IN_FLIGHT, UPLOADS_WAITING)
+
+# The seconds after a decrease of the limit before it may decrease again,
+# so that the uploads already in flight when S3 slowed down count once.
+BACKOFF_INTERVAL = 1
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# The S3 error codes that ask for requests to slow down.
+THROTTLE_CODES = ('503', 'RequestLimitExceeded', 'RequestTimeout',
+                  'ServiceUnavailable', 'SlowDown', 'Throttling',
+                  'ThrottlingException', 'TooManyRequestsException')
+
+
+def is_fault(ex: BaseException) -> bool:
+    """
+    Check if an upload failed because of S3 rather than the request.
+
+    Parameters
+    ----------
+    ex : BaseException
+        The exception raised by the upload.
+
+    Returns
+    -------
+    bool
+        True for throttling, server errors, timeouts and connection
+        errors.  False for the other errors of a request, such as a 404.
+    """
+    from botocore.exceptions import ClientError
+
+    if not isinstance(ex, ClientError):
+        return True
+
+    error = ex.response.get('Error', {})
+    status = ex.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return error.get('Code') in THROTTLE_CODES or status in (429, 500, 503)
+
+
+class StorageUnavailable(Exception):
+    """The upload was refused as the circuit breaker around S3 is open."""
+
+
+def is_outage(ex: BaseException) -> bool:
+    """
+    Check if an upload failed as S3 was unavailable, so may succeed later.
+
+    Parameters
+    ----------
+    ex : BaseException
+        The exception raised by the upload.
+
+    Returns
+    -------
+    bool
+        True if the upload was refused by the circuit breaker, was
+        throttled, met a server error or could not reach S3.  False for
+        errors of the request or of the message itself.
+    """
+    from botocore.exceptions import (ClientError, ConnectionError,
+                                     HTTPClientError)
+
+    if isinstance(ex, ClientError):
+        return is_fault(ex)
+
+    return isinstance(ex, (StorageUnavailable, ConnectionError,
+                           HTTPClientError, OSError))
+
+
+class AdaptiveLimit:
+    """
+    A limit on the uploads run at once, adapted as S3 responds.
+
+    The limit is adapted by additive increase and multiplicative decrease
+    (AIMD), as in TCP congestion control.  Each healthy upload adds 1 / limit
+    (so about 1 for each limit's worth of uploads), while a throttled or
+    failed upload, or one slower than the latency target, multiplies it by
+    the backoff factor.  The limit starts at its maximum.
+
+    Attributes
+    ----------
+    value : float
+        The limit, of which the whole part is the number of uploads allowed.
+
+    Parameters
+    ----------
+    minimum : int
+        The lowest the limit may fall to.
+    maximum : int
+        The highest the limit may grow to.
+    latency_target : float, optional
+        The seconds an upload may take before the limit is decreased, by
+        default 0 for no target.
+    backoff : float, optional
+        The factor to multiply the limit by to decrease it, by default 0.5.
+    clock : Callable[[], float], optional
+        The clock to space the decreases by, by default time.monotonic.
+    """
+
+    def __init__(self, minimum: int, maximum: int, latency_target: float = 0,
+                 backoff: float = 0.5,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.value = float(maximum)
+        self._backoff = backoff
+        self._clock = clock
+        self._decreased = -BACKOFF_INTERVAL
+        self._latency_target = latency_target or float('inf')
+        self._maximum = maximum
+        self._minimum = minimum
+        UPLOAD_LIMIT.set(int(self.value))
+
+    def record(self, seconds: float, congested: bool) -> None:
+        """
+        Adapt the limit to the outcome of an upload.
+
+        Parameters
+        ----------
+        seconds : float
+            The time the upload took.
+        congested : bool
+            True if the upload was throttled or failed because of S3.
+        """
+        if congested or seconds > self._latency_target:
+            self._decrease()
+        else:
+            self.value = min(self._maximum, self.value + 1 / self.value)
+
+        UPLOAD_LIMIT.set(int(self.value))
+
+    def _decrease(self) -> None:
+        """Back off, unless the limit has just been decreased."""
+        now = self._clock()
+
+        if now - self._decreased >= BACKOFF_INTERVAL:
+            self._decreased = now
+            self.value = max(self._minimum, self.value * self._backoff)
+
+
+class UploadBreaker:
+    """
+    Refuse uploads while S3 is failing, as a circuit breaker.
+
+    The outcomes of the most recent uploads are kept.  Once the window is
+    full and the share of them that failed reaches the threshold, the
+    breaker opens and uploads are refused at once until a cool down has
+    passed.  The next upload is then let through as a trial: a success
+    closes the breaker again and a failure opens it for another cool down.
+
+    Attributes
+    ----------
+    state : str
+        One of CLOSED, OPEN or HALF_OPEN (while a trial is running).
+
+    Parameters
+    ----------
+    threshold : float
+        The share of failed uploads, from 0 to 1, at which to open.
+    window : int
+        The number of recent uploads to take the share of.
+    cooldown : float
+        The number of seconds to refuse uploads for.
+    clock : Callable[[], float], optional
+        The clock to time the cool down by, by default time.monotonic.
+    """
+
+    def __init__(self, threshold: float, window: int, cooldown: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.state = CLOSED
+        self._clock = clock
+        self._cooldown = cooldown
+        self._open_until = 0
+        self._outcomes = collections.deque(maxlen=window)
+        self._threshold = threshold
+        self._set_state(CLOSED)
+
+    def allow(self) -> bool:
+        """
+        Check if an upload may run, letting a trial through if it is time.
+
+        Returns
+        -------
+        bool
+            False if the upload is to be refused.
+        """
+        if self.state == CLOSED:
+            return True
+        elif self.state == HALF_OPEN or self._clock() < self._open_until:
+            return False
+
+        self._set_state(HALF_OPEN)
+        return True
+
+    def available(self) -> bool:
+        """
+        Check if uploads may run, without letting a trial through.
+
+        Returns
+        -------
+        bool
+            False if the breaker is open and its cool down has not passed.
+        """
+        return self.state == CLOSED or (
+            self.state == OPEN and self._clock() >= self._open_until
+        )
+
+    def record(self, ok: bool, trial: bool = False) -> None:
+        """
+        Record the outcome of an upload.
+
+        Parameters
+        ----------
+        ok : bool
+            False if the upload failed because of S3.
+        trial : bool, optional
+            True if the upload was the trial let through, by default False.
+        """
+        if trial:
+            self._end_trial(ok)
+        elif self.state == CLOSED:
+            self._outcomes.append(ok)
+            self._check()
+
+    def _check(self) -> None:
+        """Open the breaker if the failed share of a full window is high."""
+        if len(self._outcomes) < self._outcomes.maxlen:
+            return
+
+        failed = self._outcomes.count(False) / len(self._outcomes)
+
+        if failed >= self._threshold:
+            self._open()
+
+    def _end_trial(self, ok: bool) -> None:
+        """Close the breaker after a successful trial, or open it again."""
+        if ok:
+            self._outcomes.clear()
+            self._set_state(CLOSED)
+        else:
+            self._open()
+
+    def _open(self) -> None:
+        """Refuse uploads for a cool down."""
+        self._open_until = self._clock() + self._cooldown
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        """Change the state, exposing it in the metrics."""
+        self.state = state
+
+        for name in (CLOSED, HALF_OPEN, OPEN):
+            UPLOAD_BREAKER_STATE.set(int(name == state), state=name)
+
+
+class Uploader:
+    """
+    Run blocking upload calls in a dedicated thread pool.
+
+    The number of uploads in flight is bounded.  Once the limit is
+    reached, callers wait for a free slot before their upload is
+    submitted, which applies backpressure to the SMTP sessions waiting
+    on DATA while leaving the event loop free to serve other commands.
+
+    The limit adapts between the minimum and maximum as S3 responds (see
+    AdaptiveLimit).  If a breaker is given, uploads are refused with
+    StorageUnavailable while it is open, rather than each waiting for the
+    retries of the S3 client to run out.
+
+    Attributes
+    ----------
+    breaker : UploadBreaker
+        The circuit breaker, or None for none.
+    in_flight : int
+        The number of uploads currently running.
+    limit : AdaptiveLimit
+        The limit on the uploads run at once.
+    max_uploads : int
+        The maximum number of uploads that may run at once.
+    waiting : int
+        The number of uploads waiting for a free slot.
+
+    Parameters
+    ----------
+    max_uploads : int
+        The maximum number of uploads that may run at once.
+    min_uploads : int, optional
+        The number of uploads run at once that the limit may fall to, by
+        default 1.
+    latency_target : float, optional
+        The seconds an upload may take before the limit is decreased, by
+        default 0 for no target.
+    breaker : UploadBreaker, optional
+        The circuit breaker, by default None for none.
+
+    Raises
+    ------
+    ValueError
+        If the maximum or minimum number of uploads is less than 1.
+    """
+
+    def __init__(self, max_uploads: int, min_uploads: int = 1,
+                 latency_target: float = 0,
+                 breaker: Optional[UploadBreaker] = None) -> None:
+        if min(max_uploads, min_uploads) < 1:
+            raise ValueError('The number of uploads must be > 0.')
+
+        self.breaker = breaker
+        self.in_flight = 0
+        self.limit = AdaptiveLimit(min(min_uploads, max_uploads),
+                                   max_uploads, latency_target)
+        self.max_uploads = max_uploads
+        self.waiting = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_uploads,
+            thread_name_prefix='smtp2s3-upload'
+        )
+        self._slot_freed = asyncio.Condition()
+
+    def available(self) -> bool:
+        """
+        Check if uploads may run, or are refused by an open breaker.
+
+        Returns
+        -------
+        bool
+            False if uploads are being refused.
+        """
+        return self.breaker is None or self.breaker.available()
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a blocking call in the upload pool once a slot is free.
+
+        Parameters
+        ----------
+        func : Callable[..., Any]
+            The blocking callable to run.
+        *args : Any
+            The positional arguments to pass to the callable.
+
+        Returns
+        -------
+        Any
+            The value returned by the callable.
+
+        Raises
+        ------
+        StorageUnavailable
+            If the breaker is open.
+        """
+        acquired = False
+        error = None
+        started = None
+        trial = False
+
+        try:
+            trial = self._admit()
+            await self._acquire()
+            acquired = True
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        except BaseException as ex:
+            error = ex
+            raise
+        finally:
+            self._settle(trial, started, error)
+
+            if acquired:
+                await self._release()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down the upload pool.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            Wait for running uploads to complete, by default True.
+        """
+        self._executor.shutdown(wait=wait)
+
+    async def _acquire(self) -> None:
+        """Wait until fewer uploads than the limit are running."""
+        self.waiting += 1
+        UPLOADS_WAITING.inc()
+
+        try:
+            async with self._slot_freed:
+                await self._slot_freed.wait_for(
+                    lambda: self.in_flight < int(self.limit.value)
+                )
+                self.in_flight += 1
+                UPLOADS_IN_FLIGHT.inc()
+        finally:
+            self.waiting -= 1
+            UPLOADS_WAITING.dec()
+
+    def _admit(self) -> bool:
+        """Check the breaker, returning True if the upload is its trial."""
+        if self.breaker is None:
+            return False
+        elif not self.breaker.allow():
+            raise StorageUnavailable('Uploads to S3 are suspended.')
+
+        return self.breaker.state == HALF_OPEN
+
+    def _record(self, fault: bool, trial: bool) -> None:
+        """Record the outcome of an upload with the breaker."""
+        if self.breaker is not None:
+            self.breaker.record(not fault, trial)
+
+    def _settle(self, trial: bool, started: Optional[float],
+                error: Optional[BaseException]) -> None:
+        """
+        Record the outcome of an upload with the limit and the breaker.
+
+        An upload that was cancelled (as when the client disconnects) says
+        nothing of S3, so is not recorded, but a cancelled trial opens the
+        breaker again, so that another trial is let through after the cool
+        down rather than the breaker waiting for this one forever.
+        """
+        cancelled = isinstance(error, asyncio.CancelledError)
+
+        if started is not None and not cancelled:
+            fault = error is not None and is_fault(error)
+            self.limit.record(time.monotonic() - started, fault)
+            self._record(fault, trial)
+        elif trial:
+            self._record(True, trial)
+
+    async def _release(self) -> None:
+        """Free the slot of an upload, waking the uploads that now fit."""
+        async with self._slot_freed:
+            self.in_flight -= 1
+            UPLOADS_IN_FLIGHT.dec()
+            self._slot_freed.notify(int(self.limit.value) - self.in_flight)
@@ -0,0 +1,238 @@
+"""Run the service in worker processes that share the SMTP port."""
+import collections
+import math
+import multiprocessing
+import os
+import signal
+import time
+from logging import Logger
+from typing import Callable
+
+CPU_MAX_PATH = '/sys/fs/cgroup/cpu.max'
+RESTART_DELAY = 1
+RESTART_DELAY_MAX = 60
+RESTART_LIMIT = 10
+RESTART_WINDOW = 300
+
+
+def available_cpus(cpu_max_path: str = CPU_MAX_PATH) -> int:
+    """
+    Get the number of CPUs that the process may use.
+
+    Parameters
+    ----------
+    cpu_max_path : str, optional
+        The cgroup v2 file holding the CPU quota and period, by default the
+        one for the container that the process is in.
+
+    Returns
+    -------
+    int
+        The CPU quota of the container rounded up, if it has one, otherwise
+        the number of CPUs that the process has affinity with.
+    """
+    try:
+        with open(cpu_max_path) as stream:
+            quota, period = stream.read().split()
+
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+class Supervisor:
+    """
+    Run worker processes, restarting any that die and passing on signals.
+
+    Each worker is forked before any event loop, handler or S3 client has
+    been created, so that every worker creates its own.  A SIGHUP is passed
+    on to the workers and a SIGINT or SIGTERM stops them.
+
+    A worker that dies is restarted at once the first time, then after a
+    delay that doubles each time it dies again, up to a minute.  The delay
+    is reset once the worker has run for the restart window.  Should more
+    workers be restarted within the window than the restart limit allows,
+    the supervisor stops them all and exits with a code of 1.
+
+    Attributes
+    ----------
+    exitcode : int
+        The code for the supervisor to exit with: 1 if it stopped as the
+        workers kept dying, otherwise 0.
+    processes : dict[int, multiprocessing.Process]
+        The process of each worker, by index.
+    restarts : int
+        The number of workers restarted after dying.
+
+    Parameters
+    ----------
+    workers : int
+        The number of worker processes.
+    target : Callable[[int], None]
+        The function to run in each worker, given the index of the worker.
+        A restarted worker keeps its index.
+    logger : logging.Logger
+        A logger to be used.
+    interval : float, optional
+        The number of seconds between checks of the workers, by default 1.
+    restart_delay : float, optional
+        The number of seconds to wait before restarting a worker that died
+        again, doubled each further time, by default 1.
+    restart_limit : int, optional
+        The number of restarts allowed within the restart window, by
+        default 10.
+    restart_window : float, optional
+        The number of seconds over which restarts are counted, by default
+        300.
+    """
+
+    def __init__(self, workers: int, target: Callable[[int], None],
+                 logger: Logger, interval: float = 1,
+                 restart_delay: float = RESTART_DELAY,
+                 restart_limit: int = RESTART_LIMIT,
+                 restart_window: float = RESTART_WINDOW) -> None:
+        self.exitcode = 0
+        self.processes = {}
+        self.restarts = 0
+        self._context = multiprocessing.get_context('fork')
+        self._due = {}
+        self._failures = {}
+        self._interval = interval
+        self._logger = logger
+        self._restart_delay = restart_delay
+        self._restart_limit = restart_limit
+        self._restart_times = collections.deque()
+        self._restart_window = restart_window
+        self._running = False
+        self._started = {}
+        self._target = target
+        self._workers = workers
+
+    def run(self) -> int:
+        """
+        Start the workers and supervise them until signalled to stop.
+
+        Returns
+        -------
+        int
+            The code for the supervisor to exit with.
+        """
+        signal.signal(signal.SIGHUP, lambda sig, frame: self.signal(sig))
+        signal.signal(signal.SIGINT, self._stop_handler)
+        signal.signal(signal.SIGTERM, self._stop_handler)
+        self._running = True
+
+        for index in range(self._workers):
+            self.start_worker(index)
+
+        while True:
+            time.sleep(self._interval)
+
+            if not self._running:
+                break
+
+            self.restart_dead_workers()
+
+        self.stop()
+        return self.exitcode
+
+    def restart_dead_workers(self) -> None:
+        """Restart any workers that have exited once their delay is up."""
+        now = time.monotonic()
+
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if index not in self._due:
+                self._schedule_restart(index, process, now)
+
+            if now >= self._due[index]:
+                self._restart_worker(index, now)
+
+    def signal(self, signum: int) -> None:
+        """
+        Send a signal to every live worker.
+
+        Parameters
+        ----------
+        signum : int
+            The signal number.
+        """
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def start_worker(self, index: int) -> None:
+        """
+        Start a worker process.
+
+        Parameters
+        ----------
+        index : int
+            The index of the worker.
+        """
+        process = self._context.Process(
+            target=self._target, args=(index,), name=f'smtp2s3-worker-{index}'
+        )
+        process.start()
+        self.processes[index] = process
+        self._started[index] = time.monotonic()
+        self._logger.info(f'Worker {index} started with PID {process.pid}.')
+
+    def stop(self) -> None:
+        """Stop the workers, waiting for each to finish."""
+        self._running = False
+        self.signal(signal.SIGTERM)
+
+        for process in self.processes.values():
+            process.join()
+
+    def _restart_worker(self, index: int, now: float) -> None:
+        """Restart a worker, unless the workers have died too often."""
+        if self.exitcode:
+            return
+
+        del self._due[index]
+        self._restart_times.append(now)
+
+        while now - self._restart_times[0] > self._restart_window:
+            self._restart_times.popleft()
+
+        if len(self._restart_times) > self._restart_limit:
+            self._logger.error(
+                f'More than {self._restart_limit} workers restarted within '
+                f'{self._restart_window:g} seconds, stopping.'
+            )
+            self.exitcode = 1
+            self._running = False
+            return
+
+        self.restarts += 1
+        self.start_worker(index)
+
+    def _schedule_restart(self, index: int,
+                          process: multiprocessing.Process,
+                          now: float) -> None:
+        """Set when to restart a dead worker, backing off if it keeps dying."""
+        if now - self._started[index] >= self._restart_window:
+            self._failures[index] = 0
+
+        failures = self._failures.get(index, 0)
+        delay = min(self._restart_delay * 2 ** (failures - 1),
+                    RESTART_DELAY_MAX) if failures else 0
+        self._failures[index] = failures + 1
+        self._due[index] = now + delay
+        self._logger.error(
+            f'Worker {index} (PID {process.pid}) exited with code '
+            f'{process.exitcode}, restarting it in {delay:g} seconds.'
+        )
+
+    def _stop_handler(self, sig, frame) -> None:
+        """Handle signals so that we know when to stop."""
+        self._running = False
@@ -0,0 +1,46 @@
+Feature: Admission Control
+
+    Scenario Outline: Limit Sessions
+        Given admission control allowing <total> sessions and <per_ip> per address
+        When 2 sessions are open from 192.0.2.1
+        And a session is opened from <peer>
+        Then the session is <outcome>
+
+        Examples:
+            | total | per_ip | peer      | outcome  |
+            | 0     | 0      | 192.0.2.1 | admitted |
+            | 2     | 0      | 192.0.2.2 | refused  |
+            | 3     | 2      | 192.0.2.1 | refused  |
+            | 3     | 2      | 192.0.2.2 | admitted |
+
+    Scenario: Limit The Message Rate
+        Given a rate of 1 message per second in bursts of 2
+        When 3 messages are started from 192.0.2.1
+        Then 2 of the messages are admitted
+        And a message from 192.0.2.2 is admitted
+        And a message from 192.0.2.1 is admitted after 1 second
+
+    Scenario: Forget The Least Recently Used Buckets
+        Given a rate of 1 message per second in bursts of 1 for 2 addresses
+        When messages are started from 192.0.2.1,192.0.2.2,192.0.2.1,192.0.2.3
+        Then a message from 192.0.2.1 is refused
+        And a message from 192.0.2.2 is admitted
+
+    Scenario Outline: Shed Load
+        Given admission control shedding load at <limit> <resource>
+        When there are <count> <resource>
+        Then a new session is answered with <session_reply>
+        And a new message is answered with <message_reply>
+
+        Examples:
+            | limit | resource       | count | session_reply | message_reply |
+            | 2     | uploads        | 1     | None          | None          |
+            | 2     | uploads        | 2     | 421           | 451           |
+            | 1024  | bytes          | 512   | None          | None          |
+            | 1024  | bytes          | 1024  | 421           | 451           |
+
+    Scenario: Refuse Messages While Storage Is Down
+        Given admission control shedding load at 2 uploads
+        When the breaker around S3 is open
+        Then a new session is answered with None
+        And a new message is answered with 451
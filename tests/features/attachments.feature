@@ -0,0 +1,27 @@
+Feature: Attachment Store
+
+    Scenario Outline: Restore A Message Byte For Byte
+        Given a message with a <size> byte attachment and <line_ending> endings
+        When the message is stored with an attachment minimum size of 1000
+        Then <count> attachments are split out
+        And the message is restored byte for byte
+
+        Examples:
+            | size | line_ending | count |
+            | 5000 | CRLF        | 1     |
+            | 5000 | LF          | 1     |
+            | 500  | CRLF        | 0     |
+
+    Scenario: Store A Repeated Attachment Once
+        Given a message with a 5000 byte attachment and CRLF endings
+        When the message is stored with an attachment minimum size of 1000
+        And the message is stored again
+        Then 2 messages are stored
+        And 1 attachment object is written
+        And 1 attachment object is looked up
+
+    Scenario: Find An Attachment Already Stored
+        Given a message with a 5000 byte attachment and CRLF endings
+        When the message is stored by two handlers sharing a bucket
+        Then 1 attachment object is written
+        And 2 attachment objects are looked up
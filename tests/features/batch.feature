@@ -0,0 +1,13 @@
+Feature: Batch Writer
+
+    Scenario Outline: Messages Are Archived
+        Given a batch writer that flushes at <max_bytes> bytes
+        When <message_count> messages are added to <partition_count> partitions
+        Then <archive_count> archives are written
+        And every message can be read from its archive with a ranged GET
+
+        Examples:
+            | max_bytes | message_count | partition_count | archive_count |
+            | 1048576   | 10            | 1               | 1             |
+            | 1048576   | 10            | 2               | 2             |
+            | 1         | 3             | 1               | 3             |
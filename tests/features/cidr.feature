@@ -0,0 +1,29 @@
+Feature: CIDR Index
+
+    Scenario Outline: Look Up Peers
+        Given CIDR ranges 10.0.0.0/8,2001:db8::/32,192.0.2.1 are allowed
+        And CIDR ranges 10.1.0.0/16,0.0.0.0/0,2001:db8:bad::/48 are denied
+        When <ip> is looked up
+        Then the verdict is <verdict>
+
+        Examples:
+            | ip                | verdict |
+            | 10.2.3.4          | allow   |
+            | 10.1.2.3          | deny    |
+            | 192.0.2.1         | allow   |
+            | 192.0.2.2         | deny    |
+            | ::ffff:10.2.3.4   | allow   |
+            | 2001:db8::1       | allow   |
+            | 2001:db8:bad::1   | deny    |
+            | 2001:db9::1       | None    |
+            | not-an-ip         | None    |
+
+    Scenario: Read Ranges From A File
+        Given a file of 10000 CIDR ranges with comments
+        When the ranges are read from the file
+        Then 10000 ranges are indexed
+        And every range is allowed
+
+    Scenario: Invalid Range
+        Given CIDR ranges 10.0.0.0/33 are allowed
+        Then a Value Error Exception is Raised by the index
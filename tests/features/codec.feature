@@ -0,0 +1,19 @@
+Feature: Compression Codec
+
+    Scenario Outline: Compress Content
+        Given a <codec> compressor with a minimum size of <min_size> bytes and <workers> workers
+        When <size> bytes of content are compressed
+        Then the codec used is <codec_used>
+        And the content decompresses to the original
+
+        Examples:
+            | codec | min_size | workers | size  | codec_used |
+            | gzip  | 0        | 0       | 10    | gzip       |
+            | gzip  | 1024     | 0       | 10    | none       |
+            | gzip  | 1024     | 1       | 10000 | gzip       |
+            | zstd  | 1024     | 0       | 10000 | zstd       |
+            | none  | 0        | 0       | 10000 | none       |
+
+    Scenario: Invalid Codec
+        Given a lzma compressor with a minimum size of 0 bytes and 0 workers
+        Then a Value Error Exception is Raised by the compressor
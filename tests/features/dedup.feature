@@ -0,0 +1,29 @@
+Feature: Duplicate Delivery Suppression
+
+    Scenario Outline: Key Deliveries
+        Given a delivery from anne@example.com to bob@example.com,carol@example.com
+        When the delivery is retried with <change>
+        Then the retry is <outcome>
+
+        Examples:
+            | change                      | outcome   |
+            | nothing changed             | duplicate |
+            | the recipients reordered    | duplicate |
+            | another Message-ID          | new       |
+            | another sender              | new       |
+            | another recipient           | new       |
+            | different content           | new       |
+
+    Scenario: Forget The Least Recently Used
+        Given a dedup index of 2 deliveries
+        When deliveries a,b are stored
+        And delivery a is seen again
+        And delivery c is stored
+        Then deliveries a,c are duplicates
+        And delivery b is new
+
+    Scenario: Share The Index In A Database
+        Given two dedup indexes sharing a database
+        When delivery a is stored by the first index
+        Then delivery a is a duplicate for the second index
+        And delivery b is new for the second index
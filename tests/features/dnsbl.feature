@@ -0,0 +1,55 @@
+Feature: DNS Blocklist
+
+    Scenario Outline: Cache Answers
+        Given a DNSBL cache of 2 entries for the zones dnsbl.example.com
+        When <ip> is checked <count> times over <seconds> seconds
+        Then the listing is <listed>
+        And the resolver was queried <query_count> times
+        And the cache had <hit_count> hits
+
+        Examples:
+            | ip          | count | seconds | listed | query_count | hit_count |
+            | 127.0.0.2   | 10    | 9       | True   | 1           | 9         |
+            | 127.0.0.2   | 10    | 20      | True   | 2           | 8         |
+            | 192.0.2.1   | 10    | 9       | False  | 1           | 9         |
+            | 192.0.2.1   | 10    | 90      | False  | 2           | 8         |
+            | 192.0.2.99  | 10    | 9       | False  | 2           | 0         |
+            | 2001:db8::1 | 10    | 9       | False  | 1           | 9         |
+
+    Scenario: Evict The Least Recently Used
+        Given a DNSBL cache of 2 entries for the zones dnsbl.example.com
+        When 127.0.0.2 is checked 1 times over 0 seconds
+        And 192.0.2.1 is checked 1 times over 0 seconds
+        And 127.0.0.2 is checked 1 times over 0 seconds
+        And 192.0.2.2 is checked 1 times over 0 seconds
+        Then the cache holds 127.0.0.2 and 192.0.2.2
+
+    Scenario Outline: Query Zones At Once
+        Given a DNSBL cache of 10 entries for the zones <zones>
+        When 127.0.0.2 is checked 3 times over 0 seconds
+        Then the listing is <listed>
+        And the check took less than 1 second
+        And the resolver was queried <query_count> times
+
+        Examples:
+            | zones                                 | listed | query_count |
+            | slow.example.com,dnsbl.example.com    | True   | 2           |
+            | dead.example.com,dnsbl.example.com    | True   | 2           |
+            | dead.example.com,slow.example.com     | False  | 3           |
+
+    Scenario Outline: Let One Trial Through A Failing Zone
+        Given a DNSBL cache of 10 entries for the zones <zones>
+        When 192.0.2.1 is checked 2 times over 0 seconds
+        And 127.0.0.2,192.0.2.2,192.0.2.3 are checked at once after 60 seconds
+        And 192.0.2.4,192.0.2.5 are checked at once after 60 seconds
+        Then the zone dead.example.com was queried <query_count> times
+
+        Examples:
+            | zones                              | query_count |
+            | dead.example.com                   | 3           |
+            | dnsbl.example.com,dead.example.com | 4           |
+
+    Scenario: Query IPv6 Addresses
+        Given a DNSBL cache of 10 entries for the zones dnsbl.example.com
+        When 2001:db8::1 is checked 1 times over 0 seconds
+        Then the resolver was queried for 1.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0.8.b.d.0.1.0.0.2.dnsbl.example.com
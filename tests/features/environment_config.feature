@@ -6,14 +6,83 @@ Feature: Environment Config
         Then Environment Config attribute <attribute> is <value>
 
         Examples:
-            | attribute             | value     |
-            | aws_access_key_id     | None      |
-            | aws_secret_access_key | None      |
-            | log_level             | 30        |
-            | s3_endpoint_url       | None      |
-            | s3_prefix_pattern     | None      |
-            | smtp_hostname         | 127.0.0.1 |
-            | smtp_port             | 8025      |
+            | attribute                 | value     |
+            | attachment_cache_size     | 10000     |
+            | attachment_min_size       | 0         |
+            | attachment_prefix         | None      |
+            | aws_access_key_id         | None      |
+            | aws_secret_access_key     | None      |
+            | cidr_allow_file           | None      |
+            | cidr_deny_file            | None      |
+            | compression_codec         | gzip      |
+            | compression_level         | None      |
+            | compression_min_size      | 0         |
+            | dedup_cache_size          | 0         |
+            | dedup_database            | None      |
+            | dnsbl_breaker_cooldown    | 60.0      |
+            | dnsbl_breaker_threshold   | 5         |
+            | dnsbl_cache_size          | 10000     |
+            | dnsbl_cache_ttl           | 300       |
+            | dnsbl_deadline            | 5.0       |
+            | dnsbl_negative_ttl        | 60        |
+            | dnsbl_stage               | MAIL      |
+            | dnsbl_timeout             | 2.0       |
+            | event_loop                | asyncio   |
+            | http_port                 | None      |
+            | log_level                 | 30        |
+            | manifest_enabled          | False     |
+            | manifest_max_age          | 60.0      |
+            | manifest_max_bytes        | 8388608   |
+            | s3_breaker_cooldown       | 30.0      |
+            | s3_breaker_threshold      | 0.5       |
+            | s3_breaker_window         | 20        |
+            | s3_connect_timeout        | 60.0      |
+            | s3_endpoint_url           | None      |
+            | s3_latency_target         | 5.0       |
+            | s3_max_attempts           | 3         |
+            | s3_max_pool_connections   | 10        |
+            | s3_max_uploads            | 10        |
+            | s3_min_uploads            | 1         |
+            | s3_prefix_pattern         | None      |
+            | s3_prewarm_connections    | 0         |
+            | s3_read_timeout           | 60.0      |
+            | s3_retry_mode             | adaptive  |
+            | s3_shard_count            | 16        |
+            | s3_tcp_keepalive          | True      |
+            | smtp_drain_delay          | 5.0       |
+            | smtp_drain_timeout        | 20.0      |
+            | smtp_hostname             | 127.0.0.1 |
+            | smtp_max_bytes_in_flight  | 0         |
+            | smtp_max_sessions         | 0         |
+            | smtp_max_sessions_per_ip  | 0         |
+            | smtp_max_upload_backlog   | 0         |
+            | smtp_port                 | 8025      |
+            | smtp_rate_burst           | 10        |
+            | smtp_rate_limit           | 0.0       |
+            | smtp_recipient_cache_size | 0         |
+            | smtp_streaming            | False     |
+            | smtp_streaming_part_size  | 8388608   |
+            | spool_directory           | None      |
+            | spool_max_attempts        | 5         |
+            | spool_max_bytes           | 0         |
+            | spool_segment_size        | 67108864  |
+            | storage_layout            | pair      |
+
+    Scenario Outline: Compression Workers Share The CPUs
+        Given the Environment Config
+        When the Environment Variable SMTP_WORKERS is set to <smtp_workers>
+        Then the compression workers are the CPUs per SMTP worker less one
+
+        Examples:
+            | smtp_workers |
+            | 1            |
+            | 1024         |
+
+    Scenario: Require The zstandard Package For zstd
+        Given the Environment Config
+        When the Environment Variable COMPRESSION_CODEC is set to zstd
+        And the zstandard package is not installed
+        Then a Value Error Exception naming the zstandard package is Raised
 
     Scenario: Invalid Values
         Given the Environment Config
@@ -21,5 +90,10 @@ Feature: Environment Config
         Then a Value Error Exception is Raised
 
         Examples:
-            | variable  | value   |
-            | LOG_LEVEL | VERBOSE |
+            | variable          | value   |
+            | COMPRESSION_CODEC | brotli  |
+            | DNSBL_STAGE       | HELO    |
+            | EVENT_LOOP        | trio    |
+            | LOG_LEVEL         | VERBOSE |
+            | S3_RETRY_MODE     | fast    |
+            | STORAGE_LAYOUT    | archive |
@@ -11,6 +11,7 @@ Feature: SMTPD Handler
         | s3://mybucket/emails/year={YYYY}/month={MM}/day={dd}/hour={HH}/minute={mm}  | 2025-08-09T01:01 | s3://mybucket/emails/year=2025/month=08/day=09/hour=01/minute=01/ |
         | s3://mybucket/                                                              | 2025-08-09T01:01 | s3://mybucket/                                                    |
         | s3://mybucket                                                               | 2025-08-09T01:01 | s3://mybucket/                                                    |
+        | s3://mybucket/{YYYY}{MM}{dd}/{HH}{mm}{ss}/{unknown}                         | 2025-08-09T01:01 | s3://mybucket/20250809/010100/{unknown}/                          |
 
     Scenario Outline: Invalid Path Prefix
         Given the prefix pattern is <prefix_pattern>
@@ -37,3 +38,24 @@ Feature: SMTPD Handler
             | foo@example.com | tiny         | 205           | 2               |
             | foo@acme.com    | tiny         | 550           | 2               |
             | foo@example.com | larger       | 552           | 2               |
+
+    Scenario Outline: Single Object Layout
+        Given the storage layout is single
+        When a message with <rcpt_count> recipients is stored
+        Then <put_count> objects are put
+        And the message object carries the envelope <envelope_location>
+
+        Examples:
+            | rcpt_count | put_count | envelope_location |
+            | 1          | 1         | inline            |
+            | 100        | 2         | by reference      |
+
+    Scenario Outline: Reload CIDR Ranges
+        Given a handler allowing the CIDR ranges in a file of 10.0.0.0/8
+        When the file is changed to <ranges> and the ranges are reloaded
+        Then the verdicts for 10.1.2.3 are <verdicts> while and after reloading
+
+        Examples:
+            | ranges       | verdicts    |
+            | 192.0.2.0/24 | allow,None  |
+            | 10.0.0.0/33  | allow,allow |
@@ -0,0 +1,19 @@
+Feature: Message Headers
+
+    # [CR], [LF] and [TAB] stand for a carriage return, line feed and tab.
+
+    Scenario Outline: Read A Header
+        Given a message with the header block <header_block>
+        When the headers are parsed
+        Then the <name> header is <value>
+
+        Examples:
+            | header_block                                                           | name       | value           |
+            | Message-ID: <1@example.com>[CR][LF][CR][LF]                            | Message-ID | <1@example.com> |
+            | Message-ID: <1@example.com>[LF][LF]                                    | message-id | <1@example.com> |
+            | Subject: Hi[CR][LF]Message-ID:[CR][LF] <1@example.com>[CR][LF][CR][LF] | Message-ID | <1@example.com> |
+            | Subject: Hi[CR][LF][TAB]there[CR][LF][CR][LF]                          | Subject    | Hi[TAB]there    |
+            | Subject: Hi[CR][LF]Subject: Again[CR][LF][CR][LF]                      | Subject    | Hi              |
+            | Subject: Hi[CR][LF][CR][LF]Message-ID: <1@example.com>[CR][LF]         | Message-ID | None            |
+            | [CR][LF]Message-ID: <1@example.com>[CR][LF]                            | Message-ID | None            |
+            | Subject: Hi[CR][LF]                                                    | Subject    | Hi              |
@@ -0,0 +1,31 @@
+Feature: Manifest Writer
+
+    Scenario Outline: Messages Are Listed
+        Given a manifest writer that flushes at <max_bytes> bytes
+        When <message_count> messages are listed in <partition_count> partitions
+        Then <manifest_count> manifests are written
+        And every message is listed once with its size and digest
+
+        Examples:
+            | max_bytes | message_count | partition_count | manifest_count |
+            | 1048576   | 10            | 1               | 1              |
+            | 1048576   | 10            | 2               | 2              |
+            | 1         | 3             | 1               | 3              |
+
+    Scenario Outline: Retry A Failed Manifest
+        Given a manifest writer that flushes at 1048576 bytes
+        And the first <stage> of a manifest fails
+        When 3 messages are listed in 1 partitions
+        Then 1 manifests are written
+        And every message is listed once with its size and digest
+
+        Examples:
+            | stage       |
+            | compression |
+            | upload      |
+
+    Scenario: List The Messages Stored By The Handler
+        Given a handler with manifests enabled
+        When 3 messages are stored by the handler
+        Then 1 manifests are written
+        And every message is listed once with its size and digest
@@ -0,0 +1,30 @@
+Feature: Metrics
+
+    Scenario Outline: Bucket Observations
+        Given a histogram with buckets 0.01,0.1,1
+        When 0.003,0.02,3 seconds are observed
+        Then the <series> sample is <value>
+
+        Examples:
+            | series                                 | value |
+            | latency_seconds_bucket{le="0.01"}      | 1     |
+            | latency_seconds_bucket{le="0.1"}       | 2     |
+            | latency_seconds_bucket{le="1"}         | 2     |
+            | latency_seconds_bucket{le="+Inf"}      | 3     |
+            | latency_seconds_count                  | 3     |
+            | latency_seconds_sum                    | 3.023 |
+
+    Scenario: Sum The Metrics Of Workers
+        Given a counter of messages by reply code
+        When one worker counts 2 messages with the code 250
+        And another worker counts 3 messages with the code 250
+        And each worker dumps its metrics
+        Then the workers count 5 messages with the code 250
+
+    Scenario: Report Per Worker Metrics For Each Worker
+        Given a per worker gauge of the upload limit
+        When one worker sets the limit to 4
+        And another worker sets the limit to 8
+        And each worker dumps its metrics
+        Then the limit of worker 0 is 4
+        And the limit of worker 1 is 8
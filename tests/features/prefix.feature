@@ -0,0 +1,47 @@
+Feature: Prefix Template
+
+    Scenario Outline: Time Bucket Resolution
+        Given the prefix template <prefix_pattern>
+        Then the rendered prefix holds for <resolution> seconds
+
+        Examples:
+            | prefix_pattern                  | resolution |
+            | s3://mybucket                   | 0          |
+            | s3://mybucket/{YYYY}/{MM}/{dd}  | 86400      |
+            | s3://mybucket/{YYYY}/{HH}       | 3600       |
+            | s3://mybucket/{HH}/{mm}         | 60         |
+            | s3://mybucket/{mm}/{ss}         | 1          |
+
+    Scenario: Render At Receive Time
+        Given the prefix template s3://mybucket/{HH}{mm}
+        When the prefix is rendered at 2025-08-09T01:01:30
+        And the prefix is rendered at 2025-08-09T01:01:59
+        And the prefix is rendered at 2025-08-09T01:02:00
+        Then the rendered prefixes are s3://mybucket/0101/,s3://mybucket/0101/,s3://mybucket/0102/
+
+    Scenario: Static Tokens
+        Given the prefix template s3://mybucket/{hostname}/{pid}
+        When the prefix is rendered at 2025-08-09T01:01:30
+        Then the rendered prefixes are s3://mybucket/<hostname>/<pid>/
+
+    Scenario Outline: Spread Messages Over Shards
+        Given the prefix template <prefix_pattern> with <shards> shards
+        When the prefix is rendered for 1000 message IDs
+        Then <count> different prefixes are rendered
+        And each message ID is given the same prefix every time
+
+        Examples:
+            | prefix_pattern             | shards | count |
+            | s3://mybucket/{shard}/{HH} | 16     | 16    |
+            | s3://mybucket/{HH}/{shard} | 100    | 100   |
+            | s3://mybucket/{HH}         | 16     | 1     |
+            | s3://mybucket/{shard}      | 1      | 1     |
+
+    Scenario: Pad The Shard
+        Given the prefix template s3://mybucket/{shard}/{HH} with 100 shards
+        When the prefix is rendered at 2025-08-09T01:01:30 for message-1,message-2
+        Then the rendered prefixes are s3://mybucket/06/01/,s3://mybucket/48/01/
+
+    Scenario: Reject No Shards
+        When the prefix template s3://mybucket/{shard} is given 0 shards
+        Then the prefix template is rejected
@@ -0,0 +1,33 @@
+Feature: Recipient Policy
+
+    Scenario Outline: Admit Recipients
+        Given recipients bob@example.com,@example.net,*.example.org, Example.biz are indexed
+        And the recipient regex is .*@example\.info
+        When <address> is admitted
+        Then the recipient is <outcome>
+
+        Examples:
+            | address                  | outcome  |
+            | bob@example.com          | accepted |
+            | Bob@Example.COM          | accepted |
+            | carol@example.com        | rejected |
+            | carol@example.net        | accepted |
+            | carol@mail.example.net   | rejected |
+            | carol@example.org        | accepted |
+            | carol@a.mail.example.org | accepted |
+            | carol@badexample.org     | rejected |
+            | carol@example.info       | accepted |
+            | carol@example.invalid    | rejected |
+            | carol@example.biz        | accepted |
+
+    Scenario Outline: Cache Regex Verdicts
+        Given the recipient regex is .*@example\.com
+        And a recipient cache of <size> verdicts
+        When a@example.com,b@example.com,a@example.com,c@example.com,b@example.com are admitted
+        Then the recipient cache has <hits> hits and <misses> misses
+        And the recipient cache holds <size> verdicts
+
+        Examples:
+            | size | hits | misses |
+            | 2    | 1    | 4      |
+            | 0    | 0    | 5      |
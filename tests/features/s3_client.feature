@@ -0,0 +1,22 @@
+Feature: S3 Client
+
+    Scenario Outline: Configure The S3 Client
+        Given the environment variable <variable> is set to <value>
+        When the handler creates its S3 client
+        Then the S3 client <setting> is <expected>
+
+        Examples:
+            | variable                | value    | setting                  | expected |
+            | S3_MAX_UPLOADS          | 25       | max_pool_connections     | 25       |
+            | S3_MAX_POOL_CONNECTIONS | 50       | max_pool_connections     | 50       |
+            | S3_CONNECT_TIMEOUT      | 5        | connect_timeout          | 5.0      |
+            | S3_READ_TIMEOUT         | 30       | read_timeout             | 30.0     |
+            | S3_RETRY_MODE           | standard | retry mode               | standard |
+            | S3_MAX_ATTEMPTS         | 5        | retry total_max_attempts | 5        |
+            | S3_TCP_KEEPALIVE        | false    | tcp_keepalive            | False    |
+
+    Scenario: Prewarm S3 Connections
+        Given the environment variable S3_PREWARM_CONNECTIONS is set to 3
+        When the handler is started with a fake S3 client
+        Then 3 head_bucket requests have been made
+
@@ -0,0 +1,68 @@
+Feature: SMTP Server
+
+    Scenario Outline: Reject Listed Peers
+        Given an SMTP server rejecting DNSBL listed peers at <stage> with streaming <streaming>
+        When a message is sent from a listed peer
+        Then the <stage> command is rejected with 554
+        And the peer was looked up once when the client connected
+
+        Examples:
+            | stage | streaming |
+            | MAIL  | false     |
+            | RCPT  | false     |
+            | DATA  | false     |
+            | DATA  | true      |
+
+    Scenario Outline: Allow And Deny Peers By CIDR Range
+        Given an SMTP server with <allow> allowed and <deny> denied
+        When a message is sent from a listed peer
+        Then the replies are <replies>
+        And the peer was not looked up
+
+        Examples:
+            | allow        | deny        | replies     |
+            | 127.0.0.1    | 0.0.0.0/0   | 250,250,250 |
+            | 10.0.0.0/8   | 127.0.0.0/8 | 554,503     |
+
+    Scenario Outline: Stream Messages
+        Given an SMTP server streaming to the <layout> storage layout
+        When a message of <size> bytes is sent
+        Then the reply code is 250
+        And the stored message matches the message sent
+        And the message was uploaded in <part_count> parts
+
+        Examples:
+            | layout | size     | part_count |
+            | pair   | 1000     | 0          |
+            | single | 1000     | 0          |
+            | pair   | 11000000 | 3          |
+
+    Scenario: List A Streamed Message In A Manifest
+        Given an SMTP server streaming to manifests
+        When a message of 1000 bytes is sent
+        Then the reply code is 250
+        And a manifest lists the message with its size and digest
+
+    Scenario: Stream An Oversized Message
+        Given an SMTP server streaming to the pair storage layout
+        When a message of 13000000 bytes is sent
+        Then the reply code is 552
+        And no message is stored
+
+    Scenario Outline: Rely On The Internals Of aiosmtpd
+        When an SMTP server is made outside a service
+        Then aiosmtpd still has the <member> <kind>
+
+        Examples:
+            | member               | kind      |
+            | _call_handler_hook   | method    |
+            | _cb_client_connected | method    |
+            | _handle_client       | method    |
+            | _set_post_data_state | method    |
+            | _smtp_methods        | attribute |
+
+    Scenario: Share The Port Between Workers
+        Given 2 SMTP servers sharing a port
+        When a message of 1000 bytes is sent
+        Then the reply code is 250
+        And one of the servers stored the message
@@ -0,0 +1,68 @@
+Feature: SMTP Service
+
+    Scenario Outline: Answer Probes
+        Given an SMTP service with a drain delay of 0.5 seconds
+        When <path> is probed <when> the service is stopped
+        Then the probe is answered with <status>
+
+        Examples:
+            | path     | when   | status |
+            | /ready   | before | 200    |
+            | /ready   | after  | 503    |
+            | /live    | after  | 200    |
+            | /metrics | before | 200    |
+            | /unknown | before | 404    |
+
+    Scenario Outline: Acknowledge A Retried Message Once
+        Given an SMTP service remembering deliveries in <store>
+        When a message is sent to the service
+        And a message is sent to the service
+        Then the metrics count 1 more message with the reply 250
+        And the metrics count 1 more deduplicated message
+        And the message is stored
+
+        Examples:
+            | store    |
+            | memory   |
+            | database |
+
+    Scenario: Drain A Message In Progress
+        Given an SMTP service draining for up to 5 seconds
+        When a client is part way through sending a message
+        And another client has said HELO
+        And the service is stopped
+        Then the other client is answered with 421
+        And the message is finished with the reply 250
+        And the service has stopped
+        And the message is stored
+
+    Scenario: Refuse Sessions Over The Limit
+        Given an SMTP service allowing 1 session
+        When a client is part way through sending a message
+        And another client connects
+        Then the other client is refused with 421
+        And the message is finished with the reply 250
+
+    Scenario: Scrape The Metrics
+        Given an SMTP service with a drain delay of 0 seconds
+        When a message is sent to the service
+        Then the metrics count 1 more message with the reply 250
+        And the metrics count 1 more observation of the put_eml stage
+
+    Scenario: Time Out The Drain
+        Given an SMTP service draining for up to 0.5 seconds
+        When a client is part way through sending a message
+        And the service is stopped
+        Then the service has stopped
+        And the message is finished with the reply 421
+        And the client has been disconnected
+        And no message is stored
+
+    Scenario Outline: Choose The Event Loop
+        When the <name> event loop is chosen
+        Then the event loop is from the <module> module
+
+        Examples:
+            | name    | module  |
+            | asyncio | asyncio |
+            | uvloop  | uvloop  |
@@ -0,0 +1,55 @@
+Feature: Spool
+
+    Scenario Outline: Spooled Messages Are Uploaded
+        Given a spool directory
+        When <message_count> messages are spooled
+        Then <message_count> messages are stored from the spool
+        And the spool holds 1 segment
+
+        Examples:
+            | message_count |
+            | 1             |
+            | 25            |
+
+    Scenario: Spool Is Replayed On Startup
+        Given a spool directory
+        When 3 messages are spooled while S3 is unavailable
+        And the spool is restarted
+        Then 3 messages are stored from the spool
+        And the spool holds 1 segment
+
+    Scenario: Torn Record Is Ignored
+        Given a spool directory
+        When 2 messages are spooled while S3 is unavailable
+        And the last spooled record is torn
+        And the spool is restarted
+        Then 1 messages are stored from the spool
+
+    Scenario Outline: Orphaned Spools Are Replayed
+        Given a spool directory
+        When 2 messages are spooled to <orphan> while S3 is unavailable
+        And the spool of <target> is restarted with <workers> workers
+        Then 2 messages are stored from the spool
+        And no segments are left in <orphan>
+
+        Examples:
+            | orphan   | target   | workers |
+            | .        | worker-0 | 2       |
+            | worker-3 | worker-0 | 2       |
+            | worker-1 | .        | 1       |
+
+    Scenario Outline: Move Failing Messages To The Dead Letters
+        Given a spool directory
+        When 3 messages are spooled and drained 5 times with message 1 failing with <error>
+        Then the messages stored from the spool are <stored>
+        And <count> messages are in the dead letters
+
+        Examples:
+            | error           | stored | count |
+            | ValueError      | 0,2    | 1     |
+            | ConnectionError | 0,2    | 0     |
+
+    Scenario: Refuse Messages Once The Spool Is Full
+        Given a spool directory
+        When 2 messages are spooled to a spool of at most 1 byte
+        Then the last message is refused as the spool is full
@@ -0,0 +1,14 @@
+Feature: Startup
+
+    Scenario: Time The Startup Phases
+        Given a startup profile
+        When the imports phase takes 2 seconds
+        And the config phase takes 1 second
+        And the imports phase takes 0.5 seconds
+        Then the startup summary is "Listening after 3.500s (imports 2.500s, config 1.000s)."
+
+    Scenario: Defer The Work Of Starting
+        Given a handler
+        Then the S3 client and recipient regex are not created
+        When the handler is warmed up
+        Then the S3 client and recipient regex are created
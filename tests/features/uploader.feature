@@ -0,0 +1,57 @@
+Feature: Uploader
+
+    Scenario Outline: Bounded Uploads
+        Given an uploader with a maximum of <max_uploads> uploads
+        When <upload_count> blocking uploads are run
+        Then no more than <max_uploads> uploads ran at once
+        And all <upload_count> uploads completed
+
+        Examples:
+            | max_uploads | upload_count |
+            | 1           | 3            |
+            | 2           | 8            |
+            | 4           | 4            |
+
+    Scenario: Invalid Maximum Uploads
+        Given an uploader with a maximum of 0 uploads
+        Then a Value Error Exception is Raised by the uploader
+
+    Scenario Outline: Adapt The Upload Limit
+        Given an uploader with a maximum of 8 uploads and a latency target
+        When an upload <outcome>
+        Then the upload limit is <limit>
+        And the upload limit is 8 after 30 healthy uploads
+
+        Examples:
+            | outcome         | limit |
+            | succeeds        | 8     |
+            | is not found    | 8     |
+            | is slow         | 4     |
+            | is throttled    | 4     |
+            | cannot connect  | 4     |
+
+    Scenario Outline: Break The Circuit
+        Given an uploader with a breaker opening at 0.5 of 4 uploads
+        When 2 uploads succeed and 2 uploads are throttled
+        Then the breaker is open
+        And an upload is refused as storage is unavailable
+        When the cool down has passed and a trial upload <outcome>
+        Then the breaker is <state>
+
+        Examples:
+            | outcome      | state  |
+            | succeeds     | closed |
+            | is throttled | open   |
+
+    Scenario Outline: Cancel A Trial Upload
+        Given an uploader with a breaker opening at 0.5 of 4 uploads
+        When 2 uploads succeed and 2 uploads are throttled
+        And a trial upload is cancelled while <stage> after the cool down
+        Then the breaker is open
+        When the cool down has passed and a trial upload succeeds
+        Then the breaker is closed
+
+        Examples:
+            | stage       |
+            | running     |
+            | waiting     |
@@ -0,0 +1,49 @@
+Feature: Worker Processes
+
+    Scenario: Restart A Crashed Worker
+        Given a supervisor of 2 workers
+        When worker 0 is killed
+        And the supervisor checks its workers
+        Then worker 0 has been restarted
+        And 1 worker has been restarted
+
+    Scenario: Back Off Restarting A Crashing Worker
+        Given a supervisor of 1 worker restarting after 60 seconds
+        When worker 0 is killed
+        And the supervisor checks its workers
+        And worker 0 is killed
+        And the supervisor checks its workers
+        Then worker 0 is waiting to be restarted
+        And 1 worker has been restarted
+
+    Scenario: Stop When Workers Keep Crashing
+        Given a supervisor of 1 worker allowing 1 restart
+        When worker 0 is killed
+        And the supervisor checks its workers
+        And worker 0 is killed
+        And the supervisor checks its workers
+        Then worker 0 is waiting to be restarted
+        And 1 worker has been restarted
+        And the supervisor exits with the code 1
+
+    Scenario: Pass Signals On To Workers
+        Given a supervisor of 2 workers
+        When the supervisor passes on a SIGHUP
+        Then every worker receives the SIGHUP
+
+    Scenario: Stop Workers
+        Given a supervisor of 2 workers
+        When the supervisor stops
+        Then no worker is alive
+
+    Scenario Outline: Count The Available CPUs
+        Given the CPU quota is <cpu_max>
+        When the available CPUs are counted
+        Then there are <count> available CPUs
+
+        Examples:
+            | cpu_max       | count    |
+            | 200000 100000 | 2        |
+            | 150000 100000 | 2        |
+            | 50000 100000  | 1        |
+            | max 100000    | affinity |
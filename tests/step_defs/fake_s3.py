@@ -0,0 +1,119 @@
+"""An in-memory stand in for the S3 client used in the tests."""
+import io
+import re
+import threading
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Client:
+    """
+    Record the objects written to S3 and serve them back.
+
+    Attributes
+    ----------
+    objects : dict
+        The Body, Metadata and number of Parts of each object, keyed by S3
+        URL.  Parts is 0 for an object written with a single PUT.
+    put_count : int
+        The number of objects that have been completely written.
+    requests : dict
+        The number of calls to each method.
+    """
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.put_count = 0
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._uploads = {}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str,
+                               UploadId: str) -> dict:
+        """Abort a multipart upload."""
+        self._count('abort_multipart_upload')
+        self._uploads.pop(UploadId)
+        return {}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str,
+                                  MultipartUpload: dict) -> dict:
+        """Complete a multipart upload."""
+        self._count('complete_multipart_upload')
+        upload = self._uploads.pop(UploadId)
+        parts = [upload['Parts'][p['ETag']]
+                 for p in MultipartUpload['Parts']]
+        self._store(Bucket, Key, b''.join(parts), upload['Metadata'],
+                    len(parts))
+        return {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str,
+                                Metadata: dict = {}) -> dict:
+        """Start a multipart upload."""
+        self._count('create_multipart_upload')
+        upload_id = f'{Bucket}/{Key}/{len(self._uploads)}'
+        self._uploads[upload_id] = {'Metadata': Metadata, 'Parts': {}}
+        return {'UploadId': upload_id}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None) -> dict:
+        """Get an object, or part of it."""
+        self._count('get_object')
+        body = self.objects[f's3://{Bucket}/{Key}']['Body']
+
+        if Range is not None:
+            start, end = map(int, re.findall(r'\d+', Range))
+            body = body[start:end + 1]
+
+        return {'Body': io.BytesIO(body)}
+
+    def head_bucket(self, Bucket: str) -> dict:
+        """Check that a bucket exists."""
+        self._count('head_bucket')
+        return {}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        """Get the metadata of an object, if it exists."""
+        self._count('head_object')
+        stored = self.objects.get(f's3://{Bucket}/{Key}')
+
+        if stored is None:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+
+        return {'Metadata': stored['Metadata']}
+
+    def put_object(self, Bucket: str, Key: str, Body,
+                   Metadata: dict = {}) -> dict:
+        """Put an object."""
+        self._count('put_object')
+        self._store(Bucket, Key, self._read(Body), Metadata)
+        return {}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, Body,
+                    PartNumber: int, **kwargs) -> dict:
+        """Upload part of a multipart upload."""
+        self._count('upload_part')
+        etag = f'{UploadId}/{PartNumber}'
+        self._uploads[UploadId]['Parts'][etag] = self._read(Body)
+        return {'ETag': etag}
+
+    def _count(self, method: str) -> None:
+        """Count a call to a method."""
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def _read(self, body) -> bytes:
+        """Read a request body."""
+        if isinstance(body, io.IOBase):
+            return body.read()
+
+        return bytes(body)
+
+    def _store(self, bucket: str, key: str, body: bytes, metadata: dict,
+               parts: int = 0) -> None:
+        """Store a completely written object."""
+        with self._lock:
+            self.objects[f's3://{bucket}/{key}'] = {
+                'Body': body,
+                'Metadata': metadata,
+                'Parts': parts
+            }
+            self.put_count += 1
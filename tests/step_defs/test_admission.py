@@ -0,0 +1,190 @@
+"""Admission Control feature tests."""
+from types import SimpleNamespace
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.admission import AdmissionControl
+
+
+@scenario('../features/admission.feature',
+          'Forget The Least Recently Used Buckets')
+def test_forget_the_least_recently_used_buckets():
+    """Forget The Least Recently Used Buckets."""
+
+
+@scenario('../features/admission.feature', 'Limit Sessions')
+def test_limit_sessions():
+    """Limit Sessions."""
+
+
+@scenario('../features/admission.feature', 'Limit The Message Rate')
+def test_limit_the_message_rate():
+    """Limit The Message Rate."""
+
+
+@scenario('../features/admission.feature',
+          'Refuse Messages While Storage Is Down')
+def test_refuse_messages_while_storage_is_down():
+    """Refuse Messages While Storage Is Down."""
+
+
+@scenario('../features/admission.feature', 'Shed Load')
+def test_shed_load():
+    """Shed Load."""
+
+
+def code_of(reply: str) -> str:
+    """Get the code of a reply, or "None" if there is no reply."""
+    return str(reply)[:3] if reply else 'None'
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    """The clock of the token buckets."""
+    return Clock()
+
+
+@pytest.fixture
+def uploader() -> SimpleNamespace:
+    """An uploader with a backlog and breaker to be set."""
+    uploader = SimpleNamespace(healthy=True, waiting=0)
+    uploader.available = lambda: uploader.healthy
+    return uploader
+
+
+@given(parsers.parse('admission control allowing {total:d} sessions and '
+                     '{per_ip:d} per address'), target_fixture='admission')
+def _(total: int, per_ip: int):
+    """admission control allowing <total> sessions and <per_ip> per address."""
+    return AdmissionControl(max_sessions=total, max_sessions_per_ip=per_ip)
+
+
+@given(parsers.parse('a rate of {rate:g} message per second in bursts of '
+                     '{burst:d}'), target_fixture='admission')
+def _(rate: float, burst: int, clock: Clock):
+    """a rate of <rate> message per second in bursts of <burst>."""
+    return AdmissionControl(rate=rate, burst=burst, clock=clock)
+
+
+@given(parsers.parse('a rate of {rate:g} message per second in bursts of '
+                     '{burst:d} for {count:d} addresses'),
+       target_fixture='admission')
+def _(rate: float, burst: int, count: int, clock: Clock):
+    """a rate of <rate> message per second in bursts of <burst> for <count>."""
+    return AdmissionControl(rate=rate, burst=burst, max_buckets=count,
+                            clock=clock)
+
+
+@given(parsers.parse('admission control shedding load at {limit:d} '
+                     '{resource}'), target_fixture='admission')
+def _(limit: int, resource: str, uploader: SimpleNamespace):
+    """admission control shedding load at <limit> <resource>."""
+    if resource == 'uploads':
+        return AdmissionControl(max_upload_backlog=limit, uploader=uploader)
+
+    return AdmissionControl(max_bytes_in_flight=limit, uploader=uploader)
+
+
+@when(parsers.parse('{count:d} sessions are open from {peer_ip}'))
+def _(count: int, peer_ip: str, admission: AdmissionControl):
+    """<count> sessions are open from <peer_ip>."""
+    for _ in range(count):
+        assert admission.open(peer_ip) is None
+
+
+@when(parsers.parse('a session is opened from {peer_ip}'),
+      target_fixture='reply')
+def _(peer_ip: str, admission: AdmissionControl):
+    """a session is opened from <peer_ip>."""
+    return admission.open(peer_ip)
+
+
+@when(parsers.parse('{count:d} messages are started from {peer_ip}'),
+      target_fixture='replies')
+def _(count: int, peer_ip: str, admission: AdmissionControl):
+    """<count> messages are started from <peer_ip>."""
+    return [admission.admit_message(peer_ip) for _ in range(count)]
+
+
+@when(parsers.parse('messages are started from {peer_ips}'))
+def _(peer_ips: str, admission: AdmissionControl):
+    """messages are started from <peer_ips>."""
+    for peer_ip in peer_ips.split(','):
+        admission.admit_message(peer_ip)
+
+
+@when(parsers.parse('there are {count:d} {resource}'))
+def _(count: int, resource: str, admission: AdmissionControl,
+      uploader: SimpleNamespace):
+    """there are <count> <resource>."""
+    if resource == 'uploads':
+        uploader.waiting = count
+    else:
+        admission.bytes_in_flight = count
+
+
+@when('the breaker around S3 is open')
+def _(uploader: SimpleNamespace):
+    """the breaker around S3 is open."""
+    uploader.healthy = False
+
+
+@then(parsers.parse('the session is {outcome}'))
+def _(outcome: str, reply: str):
+    """the session is <outcome>."""
+    if outcome == 'admitted':
+        assert reply is None
+    else:
+        assert reply.startswith('421 ')
+
+
+@then(parsers.parse('{count:d} of the messages are admitted'))
+def _(count: int, replies: list):
+    """<count> of the messages are admitted."""
+    assert replies[:count] == [None] * count
+    assert all(reply.startswith('451 ') for reply in replies[count:])
+
+
+@then(parsers.parse('a message from {peer_ip} is admitted'))
+def _(peer_ip: str, admission: AdmissionControl):
+    """a message from <peer_ip> is admitted."""
+    assert admission.admit_message(peer_ip) is None
+
+
+@then(parsers.parse('a message from {peer_ip} is refused'))
+def _(peer_ip: str, admission: AdmissionControl):
+    """a message from <peer_ip> is refused."""
+    assert admission.admit_message(peer_ip).startswith('451 ')
+
+
+@then(parsers.parse('a message from {peer_ip} is admitted after {seconds:g} '
+                    'second'))
+def _(peer_ip: str, seconds: float, admission: AdmissionControl,
+      clock: Clock):
+    """a message from <peer_ip> is admitted after <seconds> second."""
+    clock.now += seconds
+    assert admission.admit_message(peer_ip) is None
+
+
+@then(parsers.parse('a new session is answered with {code}'))
+def _(code: str, admission: AdmissionControl):
+    """a new session is answered with <code>."""
+    assert code_of(admission.open('192.0.2.1')) == code
+
+
+@then(parsers.parse('a new message is answered with {code}'))
+def _(code: str, admission: AdmissionControl):
+    """a new message is answered with <code>."""
+    assert code_of(admission.admit_message('192.0.2.1')) == code
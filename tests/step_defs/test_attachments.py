@@ -0,0 +1,153 @@
+"""Attachment Store feature tests."""
+import asyncio
+import uuid
+from email import policy
+from email.message import EmailMessage
+
+import pytest
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.attachments import read_attachments
+from smtp2s3.codec import decompress
+from smtp2s3.handler import Handler
+
+logger = get_logger('Testing')
+
+ATTACHMENT_PREFIX = 's3://mybucket/attachments/'
+POLICIES = {
+    'CRLF': policy.SMTP,
+    'LF': policy.default
+}
+
+
+@scenario('../features/attachments.feature',
+          'Find An Attachment Already Stored')
+def test_find_an_attachment_already_stored():
+    """Find An Attachment Already Stored."""
+
+
+@scenario('../features/attachments.feature',
+          'Restore A Message Byte For Byte')
+def test_restore_a_message_byte_for_byte():
+    """Restore A Message Byte For Byte."""
+
+
+@scenario('../features/attachments.feature',
+          'Store A Repeated Attachment Once')
+def test_store_a_repeated_attachment_once():
+    """Store A Repeated Attachment Once."""
+
+
+@pytest.fixture
+def client() -> FakeS3Client:
+    """The fake S3 client shared by the handlers."""
+    return FakeS3Client()
+
+
+@pytest.fixture
+def stored() -> list:
+    """The metadata of each message stored."""
+    return []
+
+
+def create_handler(client: FakeS3Client, min_size: int = 1000) -> Handler:
+    """Create a handler that splits out attachments to a fake S3."""
+    handler = Handler(EnvironmentConfig({
+        'ATTACHMENT_MIN_SIZE': str(min_size),
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket/messages/'
+    }), logger)
+    handler.transport_params['client'] = client
+    return handler
+
+
+def store(handler: Handler, content: bytes) -> dict:
+    """Store a message, returning its metadata."""
+    metadata = {}
+    path = f'{handler.prefix.render()}{uuid.uuid4()}'
+    asyncio.run(handler.store(path, content, metadata))
+    return metadata
+
+
+def attachment_paths(client: FakeS3Client) -> list[str]:
+    """Get the paths of the attachment objects written."""
+    return [path for path in client.objects
+            if path.startswith(ATTACHMENT_PREFIX)]
+
+
+@given(parsers.parse('a message with a {size:d} byte attachment and '
+                     '{line_ending} endings'),
+       target_fixture='message')
+def _(size: int, line_ending: str):
+    """a message with a <size> byte attachment and <line_ending> endings."""
+    msg = EmailMessage()
+    msg['Subject'] = 'Newsletter'
+    msg['Message-ID'] = '<1@example.com>'
+    msg.set_content('Hello')
+    msg.add_alternative('<p>Hello</p>', subtype='html')
+    msg.add_attachment(bytes(range(256)) * (size // 256 + 1),
+                       maintype='application', subtype='pdf',
+                       filename='newsletter.pdf')
+    return msg.as_bytes(policy=POLICIES[line_ending])
+
+
+@when(parsers.parse('the message is stored with an attachment minimum size '
+                    'of {min_size:d}'),
+      target_fixture='handler')
+def _(min_size: int, message: bytes, client: FakeS3Client, stored: list):
+    """the message is stored with an attachment minimum size of <min_size>."""
+    handler = create_handler(client, min_size)
+    stored.append(store(handler, message))
+    return handler
+
+
+@when('the message is stored again')
+def _(handler: Handler, message: bytes, stored: list):
+    """the message is stored again."""
+    stored.append(store(handler, message))
+
+
+@when('the message is stored by two handlers sharing a bucket')
+def _(message: bytes, client: FakeS3Client, stored: list):
+    """the message is stored by two handlers sharing a bucket."""
+    for handler in [create_handler(client), create_handler(client)]:
+        stored.append(store(handler, message))
+
+
+@then(parsers.parse('{count:d} attachments are split out'))
+def _(count: int, stored: list):
+    """<count> attachments are split out."""
+    assert len(stored[0].get('attachments', [])) == count
+
+
+@then('the message is restored byte for byte')
+def _(message: bytes, client: FakeS3Client, stored: list):
+    """the message is restored byte for byte."""
+    metadata = stored[0]
+    body = client.objects[metadata['path']]['Body']
+    skeleton = decompress(metadata['compression'], body)
+    restored = read_attachments(client, skeleton,
+                                metadata.get('attachments', []))
+    assert restored == message
+
+
+@then(parsers.parse('{count:d} messages are stored'))
+def _(count: int, client: FakeS3Client):
+    """<count> messages are stored."""
+    assert len([path for path in client.objects if '.eml' in path]) == count
+
+
+@then(parsers.parse('{count:d} attachment object is written'))
+def _(count: int, client: FakeS3Client, stored: list):
+    """<count> attachment object is written."""
+    assert len(attachment_paths(client)) == count
+    assert client.put_count == 2 * len(stored) + count
+
+
+@then(parsers.parse('{count:d} attachment object is looked up'))
+@then(parsers.parse('{count:d} attachment objects are looked up'))
+def _(count: int, client: FakeS3Client):
+    """<count> attachment objects are looked up."""
+    assert client.requests.get('head_object', 0) == count
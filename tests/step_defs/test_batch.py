@@ -0,0 +1,82 @@
+"""Batch Writer feature tests."""
+import asyncio
+import gzip
+import json
+
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import get_logger
+from smtp2s3.batch import BatchWriter, read_message
+from smtp2s3.codec import Compressor
+
+logger = get_logger('Testing')
+logger.setLevel('DEBUG')
+
+
+@scenario('../features/batch.feature', 'Messages Are Archived')
+def test_messages_are_archived():
+    """Messages Are Archived."""
+
+
+@given(parsers.parse('a batch writer that flushes at {max_bytes:d} bytes'),
+       target_fixture='max_bytes')
+def _(max_bytes: int):
+    """a batch writer that flushes at <max_bytes> bytes."""
+    return max_bytes
+
+
+@when(parsers.parse(
+    '{message_count:d} messages are added to {partition_count:d} partitions'),
+    target_fixture='client')
+def _(message_count: int, partition_count: int, max_bytes: int):
+    """<message_count> messages are added to <partition_count> partitions."""
+    client = FakeS3Client()
+
+    async def upload(path: str, body: bytes) -> None:
+        bucket, key = path.removeprefix('s3://').split('/', 1)
+        client.put_object(Bucket=bucket, Key=key, Body=body)
+
+    async def add_messages() -> None:
+        writer = BatchWriter(upload, Compressor('gzip'), logger, max_bytes,
+                             max_age=0.05)
+        additions = []
+
+        for n in range(message_count):
+            content = f'Subject: {n}\r\n\r\nMessage {n}'.encode()
+            path = f's3://mybucket/{n % partition_count}/{n}.eml.gz'
+            additions.append(writer.add(content, {'path': path}))
+
+        await asyncio.gather(*additions)
+
+    asyncio.run(add_messages())
+    return client
+
+
+def paths_ending(client: FakeS3Client, suffix: str) -> list[str]:
+    """Get the paths of the objects with a suffix."""
+    return list(filter(lambda path: path.endswith(suffix), client.objects))
+
+
+@then(parsers.parse('{archive_count:d} archives are written'))
+def _(archive_count: int, client: FakeS3Client):
+    """<archive_count> archives are written."""
+    assert len(paths_ending(client, '.eml.gz')) == archive_count
+    assert len(paths_ending(client, '.idx.json')) == archive_count
+
+
+@then('every message can be read from its archive with a ranged GET')
+def _(client: FakeS3Client):
+    """every message can be read from its archive with a ranged GET."""
+    for path in paths_ending(client, '.idx.json'):
+        index = json.loads(client.objects[path]['Body'])
+        contents = []
+
+        for entry in index['messages']:
+            content = read_message(client, index['archive'], entry['offset'],
+                                   entry['length'], entry['compression'])
+            assert content.startswith(b'Subject: ')
+            contents.append(content)
+
+        archive = client.objects[index['archive']]['Body']
+        assert gzip.decompress(archive) == b''.join(contents)
@@ -0,0 +1,87 @@
+"""CIDR Index feature tests."""
+import ipaddress
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.cidr import ALLOW, CIDRIndex, read_cidrs
+
+
+@scenario('../features/cidr.feature', 'Invalid Range')
+def test_invalid_range():
+    """Invalid Range."""
+
+
+@scenario('../features/cidr.feature', 'Look Up Peers')
+def test_look_up_peers():
+    """Look Up Peers."""
+
+
+@scenario('../features/cidr.feature', 'Read Ranges From A File')
+def test_read_ranges_from_a_file():
+    """Read Ranges From A File."""
+
+
+@pytest.fixture
+def ranges() -> dict:
+    """The CIDR ranges to allow and deny."""
+    return {'allow': [], 'deny': []}
+
+
+@given(parsers.parse('CIDR ranges {cidrs} are {verdict}'))
+def _(cidrs: str, verdict: str, ranges: dict):
+    """CIDR ranges <cidrs> are <verdict>."""
+    key = 'allow' if verdict == 'allowed' else 'deny'
+    ranges[key].extend(cidrs.split(','))
+
+
+@given(parsers.parse('a file of {count:d} CIDR ranges with comments'),
+       target_fixture='networks')
+def _(count: int, ranges: dict, tmp_path):
+    """a file of <count> CIDR ranges with comments."""
+    networks = list(ipaddress.ip_network('10.0.0.0/8').subnets(new_prefix=23))
+    networks = networks[:count]
+    path = tmp_path / 'allow.txt'
+    lines = ['# Internal relays.', '']
+    lines += [f'{network}  # Relay {n}' for n, network in enumerate(networks)]
+    path.write_text('\n'.join(lines))
+    ranges['path'] = str(path)
+    return networks
+
+
+@when('the ranges are read from the file', target_fixture='index')
+def _(ranges: dict):
+    """the ranges are read from the file."""
+    return CIDRIndex(allow=read_cidrs([''], ranges['path']))
+
+
+@when(parsers.parse('{ip} is looked up'), target_fixture='verdict')
+def _(ip: str, ranges: dict):
+    """<ip> is looked up."""
+    return CIDRIndex(ranges['allow'], ranges['deny']).lookup(ip)
+
+
+@then(parsers.parse('the verdict is {expected}'))
+def _(expected: str, verdict: str):
+    """the verdict is <verdict>."""
+    assert str(verdict) == expected
+
+
+@then(parsers.parse('{count:d} ranges are indexed'))
+def _(count: int, index: CIDRIndex):
+    """<count> ranges are indexed."""
+    assert len(index) == count
+
+
+@then('every range is allowed')
+def _(index: CIDRIndex, networks: list):
+    """every range is allowed."""
+    for network in networks:
+        assert index.lookup(str(network[1])) == ALLOW
+
+
+@then('a Value Error Exception is Raised by the index')
+def _(ranges: dict):
+    """a Value Error Exception is Raised by the index."""
+    with pytest.raises(ValueError):
+        CIDRIndex(ranges['allow'], ranges['deny'])
@@ -0,0 +1,56 @@
+"""Compression Codec feature tests."""
+import asyncio
+
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.codec import Compressor, decompress
+
+
+@scenario('../features/codec.feature', 'Compress Content')
+def test_compress_content():
+    """Compress Content."""
+
+
+@scenario('../features/codec.feature', 'Invalid Codec')
+def test_invalid_codec():
+    """Invalid Codec."""
+
+
+@given(parsers.parse(
+    'a {codec} compressor with a minimum size of {min_size:d} bytes and '
+    '{workers:d} workers'), target_fixture='compressor')
+def _(codec: str, min_size: int, workers: int):
+    """a <codec> compressor with a minimum size of <min_size> bytes."""
+    try:
+        return Compressor(codec, min_size=min_size, workers=workers)
+    except ValueError as ex:
+        return ex
+
+
+@when(parsers.parse('{size:d} bytes of content are compressed'),
+      target_fixture='compressed')
+def _(size: int, compressor: Compressor):
+    """<size> bytes of content are compressed."""
+    content = (b'Hello, world!\r\n' * size)[:size]
+    codec, data = asyncio.run(compressor.compress(content))
+    compressor.shutdown()
+    return {'codec': codec, 'content': content, 'data': data}
+
+
+@then(parsers.parse('the codec used is {codec_used}'))
+def _(codec_used: str, compressed: dict):
+    """the codec used is <codec_used>."""
+    assert compressed['codec'] == codec_used
+
+
+@then('the content decompresses to the original')
+def _(compressed: dict):
+    """the content decompresses to the original."""
+    content = decompress(compressed['codec'], compressed['data'])
+    assert content == compressed['content']
+
+
+@then('a Value Error Exception is Raised by the compressor')
+def _(compressor):
+    """a Value Error Exception is Raised by the compressor."""
+    assert isinstance(compressor, ValueError)
@@ -0,0 +1,127 @@
+"""Duplicate Delivery Suppression feature tests."""
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.dedup import DedupIndex, message_key
+
+
+@scenario('../features/dedup.feature', 'Forget The Least Recently Used')
+def test_forget_the_least_recently_used():
+    """Forget The Least Recently Used."""
+
+
+@scenario('../features/dedup.feature', 'Key Deliveries')
+def test_key_deliveries():
+    """Key Deliveries."""
+
+
+@scenario('../features/dedup.feature', 'Share The Index In A Database')
+def test_share_the_index_in_a_database():
+    """Share The Index In A Database."""
+
+
+CHANGES = {
+    'nothing changed': {},
+    'the recipients reordered': {
+        'rcpt_tos': ['carol@example.com', 'bob@example.com']
+    },
+    'another Message-ID': {'message_id': '<2@example.com>'},
+    'another sender': {'mail_from': 'dave@example.com'},
+    'another recipient': {'rcpt_tos': ['bob@example.com']},
+    'different content': {'content': b'Subject: Retry\r\n\r\nHello\r\n'}
+}
+
+
+@pytest.fixture
+def indexes(tmp_path) -> list:
+    """The dedup indexes of the scenario, closed after it."""
+    indexes = []
+    yield indexes
+
+    for index in indexes:
+        index.close()
+
+
+@given(parsers.parse('a delivery from {mail_from} to {rcpt_tos}'),
+       target_fixture='delivery')
+def _(mail_from: str, rcpt_tos: str):
+    """a delivery from <mail_from> to <rcpt_tos>."""
+    return {
+        'message_id': '<1@example.com>',
+        'mail_from': mail_from,
+        'rcpt_tos': rcpt_tos.split(','),
+        'content': b'Subject: Test\r\n\r\nHello\r\n'
+    }
+
+
+@given(parsers.parse('a dedup index of {capacity:d} deliveries'),
+       target_fixture='index')
+def _(capacity: int, indexes: list):
+    """a dedup index of <capacity> deliveries."""
+    indexes.append(DedupIndex(capacity))
+    return indexes[0]
+
+
+@given('two dedup indexes sharing a database')
+def _(indexes: list, tmp_path):
+    """two dedup indexes sharing a database."""
+    path = str(tmp_path / 'dedup.sqlite')
+    indexes.extend([DedupIndex(10, path), DedupIndex(10, path)])
+
+
+@when(parsers.parse('the delivery is retried with {change}'),
+      target_fixture='retry')
+def _(change: str, delivery: dict):
+    """the delivery is retried with <change>."""
+    return dict(delivery, **CHANGES[change])
+
+
+@when(parsers.parse('deliveries {keys} are stored'))
+@when(parsers.parse('delivery {keys} is stored'))
+def _(keys: str, index: DedupIndex):
+    """deliveries <keys> are stored."""
+    for key in keys.split(','):
+        index.add(key)
+
+
+@when(parsers.parse('delivery {key} is seen again'))
+def _(key: str, index: DedupIndex):
+    """delivery <key> is seen again."""
+    assert index.seen(key)
+
+
+@when(parsers.parse('delivery {key} is stored by the first index'))
+def _(key: str, indexes: list):
+    """delivery <key> is stored by the first index."""
+    indexes[0].add(key)
+
+
+@then(parsers.parse('the retry is {outcome}'))
+def _(outcome: str, delivery: dict, retry: dict):
+    """the retry is <outcome>."""
+    duplicate = message_key(**delivery) == message_key(**retry)
+    assert duplicate == (outcome == 'duplicate')
+
+
+@then(parsers.parse('deliveries {keys} are duplicates'))
+def _(keys: str, index: DedupIndex):
+    """deliveries <keys> are duplicates."""
+    assert all(index.seen(key) for key in keys.split(','))
+
+
+@then(parsers.parse('delivery {key} is new'))
+def _(key: str, index: DedupIndex):
+    """delivery <key> is new."""
+    assert not index.seen(key)
+
+
+@then(parsers.parse('delivery {key} is a duplicate for the second index'))
+def _(key: str, indexes: list):
+    """delivery <key> is a duplicate for the second index."""
+    assert indexes[1].seen(key)
+
+
+@then(parsers.parse('delivery {key} is new for the second index'))
+def _(key: str, indexes: list):
+    """delivery <key> is new for the second index."""
+    assert not indexes[1].seen(key)
@@ -0,0 +1,177 @@
+"""DNS Blocklist feature tests."""
+import asyncio
+import time
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.dnsbl import DNSBL, DNSBLCache, ZoneBreaker
+
+
+@scenario('../features/dnsbl.feature', 'Cache Answers')
+def test_cache_answers():
+    """Cache Answers."""
+
+
+@scenario('../features/dnsbl.feature', 'Evict The Least Recently Used')
+def test_evict_the_least_recently_used():
+    """Evict The Least Recently Used."""
+
+
+@scenario('../features/dnsbl.feature',
+          'Let One Trial Through A Failing Zone')
+def test_let_one_trial_through_a_failing_zone():
+    """Let One Trial Through A Failing Zone."""
+
+
+@scenario('../features/dnsbl.feature', 'Query IPv6 Addresses')
+def test_query_ipv6_addresses():
+    """Query IPv6 Addresses."""
+
+
+@scenario('../features/dnsbl.feature', 'Query Zones At Once')
+def test_query_zones_at_once():
+    """Query Zones At Once."""
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+class FakeResolver:
+    """
+    Resolve DNSBL names without DNS.
+
+    127.0.0.2 is listed with a TTL of 10 seconds, 192.0.2.99 fails to
+    resolve and every other address is not listed.  The zone
+    slow.example.com takes 50ms to answer and dead.example.com never
+    answers.
+    """
+
+    def __init__(self) -> None:
+        self.qnames = []
+
+    async def resolve(self, qname: str) -> tuple:
+        """Resolve a DNSBL name."""
+        self.qnames.append(qname)
+
+        if qname.endswith('.dead.example.com'):
+            await asyncio.sleep(60)
+        elif qname.endswith('.slow.example.com'):
+            await asyncio.sleep(0.05)
+            return False, None
+        elif qname.startswith('2.0.0.127.'):
+            return True, 10
+        elif qname.startswith('99.2.0.192.'):
+            return None, None
+
+        return False, None
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    """The clock for the DNSBL cache."""
+    return FakeClock()
+
+
+@pytest.fixture
+def resolver() -> FakeResolver:
+    """The resolver for the DNSBL."""
+    return FakeResolver()
+
+
+@pytest.fixture
+def elapsed() -> list:
+    """The number of seconds taken by each check."""
+    return []
+
+
+@given(parsers.parse('a DNSBL cache of {size:d} entries for the zones '
+                     '{zones}'), target_fixture='dnsbl')
+def _(size: int, zones: str, clock: FakeClock, resolver: FakeResolver):
+    """a DNSBL cache of <size> entries for the zones <zones>."""
+    cache = DNSBLCache(size, clock=clock)
+    breaker = ZoneBreaker(2, 60, clock=clock)
+    return DNSBL(zones.split(','), cache, ttl=300, negative_ttl=60,
+                 timeout=0.1, deadline=0.5, breaker=breaker,
+                 resolver=resolver)
+
+
+@when(parsers.parse('{ip} is checked {count:d} times over {seconds:d} '
+                    'seconds'), target_fixture='listed')
+def _(ip: str, count: int, seconds: int, dnsbl: DNSBL, clock: FakeClock,
+      elapsed: list):
+    """<ip> is checked <count> times over <seconds> seconds."""
+    answers = set()
+
+    for n in range(count):
+        clock.now = n * seconds / max(count - 1, 1)
+        start = time.monotonic()
+        answers.add(asyncio.run(dnsbl.is_listed(ip)))
+        elapsed.append(time.monotonic() - start)
+
+    assert len(answers) == 1
+    return answers.pop()
+
+
+@when(parsers.parse('{ips} are checked at once after {seconds:d} seconds'))
+def _(ips: str, seconds: int, dnsbl: DNSBL, clock: FakeClock):
+    """<ips> are checked at once after <seconds> seconds."""
+    async def check_all() -> list:
+        return await asyncio.gather(
+            *(dnsbl.is_listed(ip) for ip in ips.split(','))
+        )
+
+    clock.now = seconds
+    asyncio.run(check_all())
+
+
+@then(parsers.parse('the listing is {expected}'))
+def _(expected: str, listed: bool):
+    """the listing is <listed>."""
+    assert str(listed) == expected
+
+
+@then(parsers.parse('the resolver was queried {query_count:d} times'))
+def _(query_count: int, resolver: FakeResolver):
+    """the resolver was queried <query_count> times."""
+    assert len(resolver.qnames) == query_count
+
+
+@then(parsers.parse('the cache had {hit_count:d} hits'))
+def _(hit_count: int, dnsbl: DNSBL):
+    """the cache had <hit_count> hits."""
+    assert dnsbl.cache.hits == hit_count
+
+
+@then(parsers.parse('the cache holds {first} and {second}'))
+def _(first: str, second: str, dnsbl: DNSBL):
+    """the cache holds <first> and <second>."""
+    assert len(dnsbl.cache) == 2
+    assert dnsbl.cache.get(first, 'dnsbl.example.com') is not None
+    assert dnsbl.cache.get(second, 'dnsbl.example.com') is not None
+
+
+@then('the check took less than 1 second')
+def _(elapsed: list):
+    """the check took less than 1 second."""
+    assert max(elapsed) < 1
+
+
+@then(parsers.parse('the zone {zone} was queried {count:d} times'))
+def _(zone: str, count: int, resolver: FakeResolver):
+    """the zone <zone> was queried <count> times."""
+    assert sum(q.endswith(f'.{zone}') for q in resolver.qnames) == count
+
+
+@then(parsers.parse('the resolver was queried for {qname}'))
+def _(qname: str, resolver: FakeResolver):
+    """the resolver was queried for <qname>."""
+    assert resolver.qnames == [qname]
@@ -1,9 +1,18 @@
 """Environment Config feature tests."""
 import os
+import sys
 
+import pytest
 from pytest_bdd import given, parsers, scenario, then, when
 
 from smtp2s3 import EnvironmentConfig
+from smtp2s3.workers import available_cpus
+
+
+@scenario('../features/environment_config.feature',
+          'Compression Workers Share The CPUs')
+def test_compression_workers_share_the_cpus():
+    """Compression Workers Share The CPUs."""
 
 
 @scenario('../features/environment_config.feature', 'Default Values')
@@ -16,6 +25,12 @@ def test_invalid_values():
     """Invalid Values."""
 
 
+@scenario('../features/environment_config.feature',
+          'Require The zstandard Package For zstd')
+def test_require_the_zstandard_package_for_zstd():
+    """Require The zstandard Package For zstd."""
+
+
 @given('the Environment Config', target_fixture='environment_config')
 def _():
     """the Environment Config."""
@@ -40,6 +55,12 @@ def _(key: str, value: str):
     os.environ[key] = value
 
 
+@when('the zstandard package is not installed')
+def _(monkeypatch):
+    """the zstandard package is not installed."""
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+
+
 @then(
         parsers.parse(
             'Environment Config attribute {attribute} is {expected_value}'
@@ -53,6 +74,14 @@ def _(attribute: str, expected_value: str,
     assert actual_value == expected_value
 
 
+@then('the compression workers are the CPUs per SMTP worker less one')
+def _(environment_config: dict):
+    """the compression workers are the CPUs per SMTP worker less one."""
+    config = EnvironmentConfig(environment_config)
+    cpus = available_cpus() // config.smtp_workers
+    assert config.compression_workers == max(cpus - 1, 0)
+
+
 @then('a Value Error Exception is Raised')
 def _(environment_config: dict):
     """a Value Error Exception is Raised."""
@@ -64,3 +93,10 @@ def _(environment_config: dict):
         exception_raised = True
 
     assert exception_raised
+
+
+@then('a Value Error Exception naming the zstandard package is Raised')
+def _(environment_config: dict):
+    """a Value Error Exception naming the zstandard package is Raised."""
+    with pytest.raises(ValueError, match='requires the zstandard package'):
+        EnvironmentConfig(environment_config)
@@ -1,13 +1,16 @@
 """SMTPD Handler feature tests."""
+import asyncio
 import datetime
 import os
 from smtplib import SMTP as Client
 from smtplib import SMTPRecipientsRefused, SMTPSenderRefused
 
 import boto3
+from fake_s3 import FakeS3Client
 from pytest_bdd import given, parsers, scenario, then, when
 
 from smtp2s3 import get_logger
+from smtp2s3.envelope import ENVELOPE_PATH_KEY, decode_envelope
 from smtp2s3.handler import EnvironmentConfig, Handler
 
 logger = get_logger('Testing')
@@ -27,6 +30,16 @@ def test_invalid_path_prefix():
     os.environ['S3_PREFIX_PATTERN'] = 's3://mybucket'
 
 
+@scenario('../features/handler.feature', 'Reload CIDR Ranges')
+def test_reload_cidr_ranges():
+    """Reload CIDR Ranges."""
+
+
+@scenario('../features/handler.feature', 'Single Object Layout')
+def test_single_object_layout():
+    """Single Object Layout."""
+
+
 @scenario('../features/handler.feature', 'Valid Path Prefix')
 def test_valid_path_prefix():
     """Valid Path Prefix."""
@@ -52,6 +65,62 @@ def _(prefix_pattern: str):
     return prefix_pattern
 
 
+@given(parsers.parse('a handler allowing the CIDR ranges in a file of '
+                     '{cidrs}'), target_fixture='handler')
+def _(cidrs: str, tmp_path):
+    """a handler allowing the CIDR ranges in a file of <cidrs>."""
+    path = tmp_path / 'allow.txt'
+    path.write_text(cidrs)
+    config = EnvironmentConfig({
+        'CIDR_ALLOW_FILE': str(path),
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket'
+    })
+    return Handler(config, logger)
+
+
+@given('the storage layout is single', target_fixture='handler')
+def _():
+    """the storage layout is single."""
+    config = EnvironmentConfig({
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket',
+        'STORAGE_LAYOUT': 'single'
+    })
+    handler = Handler(config, logger)
+    handler.transport_params['client'] = FakeS3Client()
+    return handler
+
+
+@when(parsers.parse('the file is changed to {ranges} and the ranges are '
+                    'reloaded'), target_fixture='verdicts')
+def _(ranges: str, handler: Handler):
+    """the file is changed to <ranges> and the ranges are reloaded."""
+    config = handler._config
+
+    async def reload() -> list:
+        with open(config.cidr_allow_file, 'w') as stream:
+            stream.write(ranges)
+
+        reloading = handler.reload_access(config)
+        verdicts = [handler.access.lookup('10.1.2.3')]
+        await asyncio.wait([reloading])
+        return verdicts + [handler.access.lookup('10.1.2.3')]
+
+    return asyncio.run(reload())
+
+
+@when(parsers.parse('a message with {rcpt_count:d} recipients is stored'))
+def _(rcpt_count: int, handler: Handler):
+    """a message with <rcpt_count> recipients is stored."""
+    metadata = {
+        'mail_from': 'anne@example.com',
+        'path': 's3://mybucket/1.eml.gz',
+        'rcpt_tos': [f'rcpt{n}@example.com' for n in range(rcpt_count)]
+    }
+    asyncio.run(handler.store('s3://mybucket/1', b'Hello', metadata))
+
+
 @when('from address is anne@example.com', target_fixture='from_address')
 def _():
     """from address is anne@example.com."""
@@ -161,3 +230,30 @@ def _(expected_path_prefix: str, prefix_pattern: str,
     handler = Handler(EnvironmentConfig(), logger)
     actual_path_prefix = handler.path_prefix(prefix_pattern, timestamp)
     assert actual_path_prefix == expected_path_prefix
+
+
+@then(parsers.parse('{put_count:d} objects are put'))
+def _(put_count: int, handler: Handler):
+    """<put_count> objects are put."""
+    assert handler.transport_params['client'].put_count == put_count
+
+
+@then(parsers.parse(
+    'the message object carries the envelope {envelope_location}'))
+def _(envelope_location: str, handler: Handler):
+    """the message object carries the envelope <envelope_location>."""
+    eml = handler.transport_params['client'].objects['s3://mybucket/1.eml.gz']
+    envelope = decode_envelope(eml['Metadata'])
+
+    if envelope_location == 'inline':
+        assert envelope['mail_from'] == 'anne@example.com'
+    else:
+        assert envelope is None
+        assert eml['Metadata'][ENVELOPE_PATH_KEY] == 's3://mybucket/1.json'
+
+
+@then(parsers.parse('the verdicts for 10.1.2.3 are {expected} while and '
+                    'after reloading'))
+def _(expected: str, verdicts: list):
+    """the verdicts for 10.1.2.3 are <verdicts> while and after reloading."""
+    assert ','.join(map(str, verdicts)) == expected
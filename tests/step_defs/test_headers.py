@@ -0,0 +1,39 @@
+"""Message Headers feature tests."""
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.headers import parse_headers
+
+
+@scenario('../features/headers.feature', 'Read A Header')
+def test_read_a_header():
+    """Read A Header."""
+
+
+def unescape(text: str) -> str:
+    """Replace the placeholders for control characters."""
+    for placeholder, char in (('[CR]', '\r'), ('[LF]', '\n'),
+                              ('[TAB]', '\t')):
+        text = text.replace(placeholder, char)
+
+    return text
+
+
+@given(parsers.parse('a message with the header block {header_block}'),
+       target_fixture='content')
+def _(header_block: str):
+    """a message with the header block <header_block>."""
+    header_block = unescape(header_block)
+    return header_block.encode() + b'Hello, world!\r\n' * 1000
+
+
+@when('the headers are parsed', target_fixture='headers')
+def _(content: bytes):
+    """the headers are parsed."""
+    return parse_headers(content)
+
+
+@then(parsers.parse('the {name} header is {value}'))
+def _(name: str, value: str, headers, content: bytes):
+    """the <name> header is <value>."""
+    value = unescape(value)
+    assert headers.get(name, 'None') == value
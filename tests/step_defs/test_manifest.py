@@ -0,0 +1,189 @@
+"""Manifest Writer feature tests."""
+import asyncio
+import gzip
+import hashlib
+import json
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.codec import Compressor
+from smtp2s3.handler import Handler
+from smtp2s3.manifest import ManifestWriter
+
+logger = get_logger('Testing')
+logger.setLevel('DEBUG')
+
+
+@scenario('../features/manifest.feature',
+          'List The Messages Stored By The Handler')
+def test_list_the_messages_stored_by_the_handler():
+    """List The Messages Stored By The Handler."""
+
+
+@scenario('../features/manifest.feature', 'Messages Are Listed')
+def test_messages_are_listed():
+    """Messages Are Listed."""
+
+
+@scenario('../features/manifest.feature', 'Retry A Failed Manifest')
+def test_retry_a_failed_manifest():
+    """Retry A Failed Manifest."""
+
+
+@pytest.fixture
+def client() -> FakeS3Client:
+    """The fake S3 client that manifests are written to."""
+    return FakeS3Client()
+
+
+class FailingCompressor(Compressor):
+    """A gzip compressor that fails while told to."""
+
+    def __init__(self, failures: dict) -> None:
+        super().__init__('gzip')
+        self._failures = failures
+
+    async def compress(self, content: bytes,
+                       always: bool = False) -> tuple[str, bytes]:
+        """Compress content, unless a failure is due."""
+        if self._failures['compression']:
+            self._failures['compression'] -= 1
+            raise BrokenProcessPool('The compression pool is broken.')
+
+        return await super().compress(content, always)
+
+
+@pytest.fixture
+def failures() -> dict:
+    """The number of compressions and uploads still to fail."""
+    return {'compression': 0, 'upload': 0}
+
+
+@pytest.fixture
+def contents() -> dict:
+    """The content of each message listed, by path."""
+    return {}
+
+
+def message(n: int) -> bytes:
+    """Get the content of a message."""
+    return f'Subject: {n}\r\n\r\nMessage {n}'.encode()
+
+
+@given(parsers.parse('a manifest writer that flushes at {max_bytes:d} bytes'),
+       target_fixture='max_bytes')
+def _(max_bytes: int):
+    """a manifest writer that flushes at <max_bytes> bytes."""
+    return max_bytes
+
+
+@given(parsers.parse('the first {stage} of a manifest fails'))
+def _(stage: str, failures: dict):
+    """the first <stage> of a manifest fails."""
+    failures[stage] = 1
+
+
+@given('a handler with manifests enabled', target_fixture='handler')
+def _(client: FakeS3Client):
+    """a handler with manifests enabled."""
+    handler = Handler(EnvironmentConfig({
+        'COMPRESSION_WORKERS': '0',
+        'MANIFEST_ENABLED': 'true',
+        'S3_PREFIX_PATTERN': 's3://mybucket/emails/'
+    }), logger)
+    handler.transport_params['client'] = client
+    return handler
+
+
+@when(parsers.parse(
+    '{message_count:d} messages are listed in {partition_count:d} '
+    'partitions'))
+def _(message_count: int, partition_count: int, max_bytes: int,
+      client: FakeS3Client, failures: dict, contents: dict):
+    """<message_count> messages are listed in <partition_count> partitions."""
+    async def upload(path: str, body: bytes) -> None:
+        if failures['upload']:
+            failures['upload'] -= 1
+            raise OSError('S3 is unavailable.')
+
+        bucket, key = path.removeprefix('s3://').split('/', 1)
+        client.put_object(Bucket=bucket, Key=key, Body=body)
+
+    async def list_messages() -> None:
+        writer = ManifestWriter(upload, FailingCompressor(failures), logger,
+                                max_bytes, max_age=0.05)
+
+        for n in range(message_count):
+            content = message(n)
+            path = f's3://mybucket/{n % partition_count}/{n}.eml.gz'
+            contents[path] = content
+            writer.add({'path': path}, len(content),
+                       hashlib.sha256(content).hexdigest())
+
+        await asyncio.sleep(0.2)
+        await writer.stop()
+
+    asyncio.run(list_messages())
+
+
+@when(parsers.parse('{message_count:d} messages are stored by the handler'))
+def _(message_count: int, handler: Handler, contents: dict):
+    """<message_count> messages are stored by the handler."""
+    async def store_messages() -> None:
+        for n in range(message_count):
+            metadata = {}
+            content = message(n)
+            await handler.store(f'{handler.prefix.render()}{n}', content,
+                                metadata)
+            contents[metadata['path']] = content
+
+        await handler.stop()
+
+    asyncio.run(store_messages())
+
+
+def manifests(client: FakeS3Client) -> list[str]:
+    """Get the paths of the manifests written."""
+    return [path for path in client.objects
+            if path.rsplit('/', 1)[1].startswith('manifest-')]
+
+
+@then(parsers.parse('{manifest_count:d} manifests are written'))
+def _(manifest_count: int, client: FakeS3Client):
+    """<manifest_count> manifests are written."""
+    assert len(manifests(client)) == manifest_count
+
+    for path in manifests(client):
+        assert path.endswith('.jsonl.gz')
+
+
+def check_entry(entry: dict, partition: str, contents: dict) -> None:
+    """Check a manifest entry against the message it lists."""
+    content = contents[entry['path']]
+    assert entry['path'].rsplit('/', 1)[0] == partition
+    assert entry['size'] == len(content)
+    assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+
+
+def read_manifest(client: FakeS3Client, path: str,
+                  contents: dict) -> list[str]:
+    """Read and check the entries of a manifest, returning their paths."""
+    lines = gzip.decompress(client.objects[path]['Body']).splitlines()
+    entries = [json.loads(line) for line in lines]
+
+    for entry in entries:
+        check_entry(entry, path.rsplit('/', 1)[0], contents)
+
+    return [entry['path'] for entry in entries]
+
+
+@then('every message is listed once with its size and digest')
+def _(client: FakeS3Client, contents: dict):
+    """every message is listed once with its size and digest."""
+    listed = sum((read_manifest(client, path, contents)
+                  for path in manifests(client)), [])
+    assert sorted(listed) == sorted(contents)
@@ -0,0 +1,135 @@
+"""Metrics feature tests."""
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.metrics import Counter, Gauge, Histogram, Registry
+
+
+@scenario('../features/metrics.feature', 'Bucket Observations')
+def test_bucket_observations():
+    """Bucket Observations."""
+
+
+@scenario('../features/metrics.feature',
+          'Report Per Worker Metrics For Each Worker')
+def test_report_per_worker_metrics_for_each_worker():
+    """Report Per Worker Metrics For Each Worker."""
+
+
+@scenario('../features/metrics.feature', 'Sum The Metrics Of Workers')
+def test_sum_the_metrics_of_workers():
+    """Sum The Metrics Of Workers."""
+
+
+def parse_samples(text: str) -> dict:
+    """Parse the samples of metrics in the text format by series."""
+    samples = {}
+
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            key, value = line.rsplit(' ', 1)
+            samples[key] = float(value)
+
+    return samples
+
+
+@pytest.fixture
+def workers() -> list:
+    """The registry and counter of each worker."""
+    return []
+
+
+@given(parsers.parse('a histogram with buckets {buckets}'),
+       target_fixture='registry')
+def _(buckets: str):
+    """a histogram with buckets <buckets>."""
+    registry = Registry()
+    Histogram('latency_seconds', 'The latency.',
+              buckets=[float(bound) for bound in buckets.split(',')],
+              registry=registry)
+    return registry
+
+
+@given('a counter of messages by reply code')
+def _(workers: list):
+    """a counter of messages by reply code."""
+    for _ in range(2):
+        registry = Registry()
+        counter = Counter('messages_total', 'The messages.', ('code',),
+                          registry=registry)
+        workers.append((registry, counter))
+
+
+@given('a per worker gauge of the upload limit')
+def _(workers: list):
+    """a per worker gauge of the upload limit."""
+    for _ in range(2):
+        registry = Registry()
+        gauge = Gauge('upload_limit', 'The limit.', registry=registry,
+                      per_worker=True)
+        workers.append((registry, gauge))
+
+
+@when(parsers.parse('{values} seconds are observed'))
+def _(values: str, registry: Registry):
+    """<values> seconds are observed."""
+    histogram = registry._metrics[0]
+
+    for value in values.split(','):
+        histogram.observe(float(value))
+
+
+@when(parsers.parse('one worker counts {count:d} messages with the code '
+                    '{code}'))
+def _(count: int, code: str, workers: list):
+    """one worker counts <count> messages with the code <code>."""
+    workers[0][1].inc(count, code=code)
+
+
+@when(parsers.parse('another worker counts {count:d} messages with the '
+                    'code {code}'))
+def _(count: int, code: str, workers: list):
+    """another worker counts <count> messages with the code <code>."""
+    workers[1][1].inc(count, code=code)
+
+
+@when(parsers.parse('one worker sets the limit to {limit:d}'))
+def _(limit: int, workers: list):
+    """one worker sets the limit to <limit>."""
+    workers[0][1].set(limit)
+
+
+@when(parsers.parse('another worker sets the limit to {limit:d}'))
+def _(limit: int, workers: list):
+    """another worker sets the limit to <limit>."""
+    workers[1][1].set(limit)
+
+
+@when('each worker dumps its metrics')
+def _(workers: list, tmp_path):
+    """each worker dumps its metrics."""
+    for index, (registry, _) in enumerate(workers):
+        registry.dump(str(tmp_path / f'worker-{index}.json'))
+
+
+@then(parsers.parse('the {series} sample is {value:g}'))
+def _(series: str, value: float, registry: Registry):
+    """the <series> sample is <value>."""
+    assert parse_samples(registry.render())[series] == pytest.approx(value)
+
+
+@then(parsers.parse('the workers count {count:d} messages with the code '
+                    '{code}'))
+def _(count: int, code: str, workers: list, tmp_path):
+    """the workers count <count> messages with the code <code>."""
+    registry = workers[0][0]
+    samples = parse_samples(registry.render(registry.collect(str(tmp_path))))
+    assert samples[f'messages_total{{code="{code}"}}'] == count
+
+
+@then(parsers.parse('the limit of worker {worker:d} is {limit:d}'))
+def _(worker: int, limit: int, workers: list, tmp_path):
+    """the limit of worker <worker> is <limit>."""
+    registry = workers[0][0]
+    samples = parse_samples(registry.render(registry.collect(str(tmp_path))))
+    assert samples[f'upload_limit{{worker="{worker}"}}'] == limit
@@ -0,0 +1,138 @@
+"""Prefix Template feature tests."""
+import datetime
+import os
+import socket
+import uuid
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import prefix
+from smtp2s3.prefix import PrefixTemplate
+
+
+@scenario('../features/prefix.feature', 'Pad The Shard')
+def test_pad_the_shard():
+    """Pad The Shard."""
+
+
+@scenario('../features/prefix.feature', 'Reject No Shards')
+def test_reject_no_shards():
+    """Reject No Shards."""
+
+
+@scenario('../features/prefix.feature', 'Render At Receive Time')
+def test_render_at_receive_time():
+    """Render At Receive Time."""
+
+
+@scenario('../features/prefix.feature', 'Spread Messages Over Shards')
+def test_spread_messages_over_shards():
+    """Spread Messages Over Shards."""
+
+
+@scenario('../features/prefix.feature', 'Static Tokens')
+def test_static_tokens():
+    """Static Tokens."""
+
+
+@scenario('../features/prefix.feature', 'Time Bucket Resolution')
+def test_time_bucket_resolution():
+    """Time Bucket Resolution."""
+
+
+@pytest.fixture
+def rendered() -> list:
+    """The prefixes rendered in the scenario."""
+    return []
+
+
+@given(parsers.parse('the prefix template {prefix_pattern}'),
+       target_fixture='template')
+def _(prefix_pattern: str):
+    """the prefix template <prefix_pattern>."""
+    return PrefixTemplate(prefix_pattern)
+
+
+@given(parsers.parse('the prefix template {prefix_pattern} with {shards:d} '
+                     'shards'),
+       target_fixture='template')
+def _(prefix_pattern: str, shards: int):
+    """the prefix template <prefix_pattern> with <shards> shards."""
+    return PrefixTemplate(prefix_pattern, shards)
+
+
+def freeze_time(timestamp: str, monkeypatch) -> None:
+    """Fix the time that prefixes are rendered at."""
+    now = datetime.datetime.fromisoformat(timestamp).replace(
+        tzinfo=datetime.timezone.utc
+    ).timestamp()
+    monkeypatch.setattr(prefix.time, 'time', lambda: now)
+
+
+@when(parsers.parse('the prefix is rendered at {timestamp} for {keys}'))
+def _(timestamp: str, keys: str, template: PrefixTemplate, rendered: list,
+      monkeypatch):
+    """the prefix is rendered at <timestamp> for <keys>."""
+    freeze_time(timestamp, monkeypatch)
+    rendered.extend(template.render(key=key) for key in keys.split(','))
+
+
+@when(parsers.parse('the prefix is rendered at {timestamp}'))
+def _(timestamp: str, template: PrefixTemplate, rendered: list,
+      monkeypatch):
+    """the prefix is rendered at <timestamp>."""
+    freeze_time(timestamp, monkeypatch)
+    rendered.append(template.render())
+
+
+@when(parsers.parse('the prefix is rendered for {count:d} message IDs'),
+      target_fixture='keys')
+def _(count: int, template: PrefixTemplate, rendered: list):
+    """the prefix is rendered for <count> message IDs."""
+    keys = [uuid.uuid4().hex for _ in range(count)]
+    rendered.extend(template.render(key=key) for key in keys)
+    return keys
+
+
+@when(parsers.parse('the prefix template {prefix_pattern} is given '
+                    '{shards:d} shards'),
+      target_fixture='error')
+def _(prefix_pattern: str, shards: int):
+    """the prefix template <prefix_pattern> is given <shards> shards."""
+    with pytest.raises(ValueError) as info:
+        PrefixTemplate(prefix_pattern, shards)
+
+    return info.value
+
+
+@then(parsers.parse('the rendered prefix holds for {resolution:d} seconds'))
+def _(resolution: int, template: PrefixTemplate):
+    """the rendered prefix holds for <resolution> seconds."""
+    assert template.resolution == resolution
+
+
+@then(parsers.parse('the rendered prefixes are {prefixes}'))
+def _(prefixes: str, rendered: list):
+    """the rendered prefixes are <prefixes>."""
+    prefixes = prefixes.replace('<hostname>', socket.gethostname())
+    prefixes = prefixes.replace('<pid>', str(os.getpid()))
+    assert rendered == prefixes.split(',')
+
+
+@then(parsers.parse('{count:d} different prefixes are rendered'))
+def _(count: int, rendered: list):
+    """<count> different prefixes are rendered."""
+    assert len(set(rendered)) == count
+
+
+@then('each message ID is given the same prefix every time')
+def _(keys: list, template: PrefixTemplate, rendered: list):
+    """each message ID is given the same prefix every time."""
+    assert [template.render(key=key) for key in keys] == rendered
+
+
+@then('the prefix template is rejected')
+def _(error: ValueError):
+    """the prefix template is rejected."""
+    assert 'shards' in str(error)
@@ -0,0 +1,78 @@
+"""Recipient Policy feature tests."""
+import re
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.recipients import RecipientPolicy
+
+
+@scenario('../features/recipients.feature', 'Admit Recipients')
+def test_admit_recipients():
+    """Admit Recipients."""
+
+
+@scenario('../features/recipients.feature', 'Cache Regex Verdicts')
+def test_cache_regex_verdicts():
+    """Cache Regex Verdicts."""
+
+
+@pytest.fixture
+def options() -> dict:
+    """The arguments to create the recipient policy with."""
+    return {'recipients': [], 'cache_size': 10000}
+
+
+@given(parsers.parse('recipients {entries} are indexed'))
+def _(entries: str, options: dict):
+    """recipients <entries> are indexed."""
+    options['recipients'] = entries.split(',')
+
+
+@given(parsers.parse('the recipient regex is {regex}'))
+def _(regex: str, options: dict):
+    """the recipient regex is <regex>."""
+    options['pattern'] = re.compile(regex)
+
+
+@given(parsers.parse('a recipient cache of {size:d} verdicts'))
+def _(size: int, options: dict):
+    """a recipient cache of <size> verdicts."""
+    options['cache_size'] = size
+
+
+@when(parsers.parse('{address} is admitted'), target_fixture='admitted')
+def _(address: str, options: dict):
+    """<address> is admitted."""
+    return RecipientPolicy(**options).admit(address)
+
+
+@when(parsers.parse('{addresses} are admitted'), target_fixture='policy')
+def _(addresses: str, options: dict):
+    """<addresses> are admitted."""
+    policy = RecipientPolicy(**options)
+
+    for address in addresses.split(','):
+        policy.admit(address)
+
+    return policy
+
+
+@then(parsers.parse('the recipient is {outcome}'))
+def _(outcome: str, admitted: bool):
+    """the recipient is <outcome>."""
+    assert admitted == (outcome == 'accepted')
+
+
+@then(parsers.parse('the recipient cache has {hits:d} hits and {misses:d} '
+                    'misses'))
+def _(hits: int, misses: int, policy: RecipientPolicy):
+    """the recipient cache has <hits> hits and <misses> misses."""
+    info = policy.cache_info()
+    assert (info.hits, info.misses) == (hits, misses)
+
+
+@then(parsers.parse('the recipient cache holds {size:d} verdicts'))
+def _(size: int, policy: RecipientPolicy):
+    """the recipient cache holds <size> verdicts."""
+    assert policy.cache_info().currsize == size
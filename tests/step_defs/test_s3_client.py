@@ -0,0 +1,71 @@
+"""S3 Client feature tests."""
+import asyncio
+
+import pytest
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.handler import Handler
+
+logger = get_logger('Testing')
+
+
+@scenario('../features/s3_client.feature', 'Configure The S3 Client')
+def test_configure_the_s3_client():
+    """Configure The S3 Client."""
+
+
+@scenario('../features/s3_client.feature', 'Prewarm S3 Connections')
+def test_prewarm_s3_connections():
+    """Prewarm S3 Connections."""
+
+
+@pytest.fixture
+def environ() -> dict:
+    """The environment to configure the handler from."""
+    return {
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket/{YYYY}'
+    }
+
+
+@given(parsers.parse('the environment variable {variable} is set to '
+                     '{value}'))
+def _(variable: str, value: str, environ: dict):
+    """the environment variable <variable> is set to <value>."""
+    environ[variable] = value
+
+
+@when('the handler creates its S3 client', target_fixture='client_config')
+def _(environ: dict):
+    """the handler creates its S3 client."""
+    handler = Handler(EnvironmentConfig(environ), logger)
+    return handler.get_transport_params()['client'].meta.config
+
+
+@when('the handler is started with a fake S3 client',
+      target_fixture='client')
+def _(environ: dict):
+    """the handler is started with a fake S3 client."""
+    handler = Handler(EnvironmentConfig(environ), logger)
+    client = handler.transport_params['client'] = FakeS3Client()
+    asyncio.run(handler.start())
+    return client
+
+
+@then(parsers.parse('the S3 client {setting} is {expected}'))
+def _(setting: str, expected: str, client_config):
+    """the S3 client <setting> is <expected>."""
+    if setting.startswith('retry '):
+        value = client_config.retries[setting.split()[1]]
+    else:
+        value = getattr(client_config, setting)
+
+    assert str(value) == expected
+
+
+@then(parsers.parse('{count:d} head_bucket requests have been made'))
+def _(count: int, client: FakeS3Client):
+    """<count> head_bucket requests have been made."""
+    assert client.requests['head_bucket'] == count
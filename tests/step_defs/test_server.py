@@ -0,0 +1,363 @@
+"""SMTP Server feature tests."""
+import asyncio
+import hashlib
+import json
+import smtplib
+import socket
+import threading
+import time
+
+import pytest
+from aiosmtpd.smtp import SMTP
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.dnsbl import DNSBL, DNSBLCache
+from smtp2s3.envelope import decode_envelope
+from smtp2s3.handler import Handler
+from smtp2s3.server import SMTPServer
+from smtp2s3.service import SMTPService
+
+logger = get_logger('Testing')
+
+
+@scenario('../features/server.feature',
+          'Allow And Deny Peers By CIDR Range')
+def test_allow_and_deny_peers_by_cidr_range():
+    """Allow And Deny Peers By CIDR Range."""
+
+
+@scenario('../features/server.feature',
+          'List A Streamed Message In A Manifest')
+def test_list_a_streamed_message_in_a_manifest():
+    """List A Streamed Message In A Manifest."""
+
+
+@scenario('../features/server.feature', 'Reject Listed Peers')
+def test_reject_listed_peers():
+    """Reject Listed Peers."""
+
+
+@scenario('../features/server.feature',
+          'Rely On The Internals Of aiosmtpd')
+def test_rely_on_the_internals_of_aiosmtpd():
+    """Rely On The Internals Of aiosmtpd."""
+
+
+@scenario('../features/server.feature', 'Share The Port Between Workers')
+def test_share_the_port_between_workers():
+    """Share The Port Between Workers."""
+
+
+@scenario('../features/server.feature', 'Stream Messages')
+def test_stream_messages():
+    """Stream Messages."""
+
+
+@scenario('../features/server.feature', 'Stream An Oversized Message')
+def test_stream_an_oversized_message():
+    """Stream An Oversized Message."""
+
+
+class ListingResolver:
+    """Resolve every DNSBL name as listed, after a tenth of a second."""
+
+    def __init__(self) -> None:
+        self.qnames = []
+
+    async def resolve(self, qname: str) -> tuple:
+        """Resolve a DNSBL name."""
+        self.qnames.append(qname)
+        await asyncio.sleep(0.1)
+        return True, 60
+
+
+@pytest.fixture
+def lookups() -> list:
+    """The number of DNSBL lookups made at each point of the dialogue."""
+    return []
+
+
+def free_port() -> int:
+    """Get a free TCP port on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def loop():
+    """Run an event loop in a thread for the services."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+@pytest.fixture
+def services(loop):
+    """Stop the services once the scenario is complete."""
+    services = []
+    yield services
+
+    for service in services:
+        asyncio.run_coroutine_threadsafe(service.stop(), loop).result()
+        service.handler.uploader.shutdown()
+
+
+def create_handler(environ: dict) -> Handler:
+    """Create a handler writing to a fake S3."""
+    config = EnvironmentConfig(dict({
+        'COMPRESSION_CODEC': 'none',
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket',
+        'SMTP_RECIPIENT_REGEX': r'.*@example\.com',
+        'SMTP_STREAMING_PART_SIZE': str(5 * 1024 * 1024)
+    }, **environ))
+    handler = Handler(config, logger)
+    handler.transport_params['client'] = FakeS3Client()
+    return handler
+
+
+def start_service(loop, services: list, handler: Handler, port: int,
+                  reuse_port: bool = False) -> Handler:
+    """Start an SMTP service for a handler."""
+    service = SMTPService(handler, logger, '127.0.0.1', port,
+                          data_size_limit=12000000, reuse_port=reuse_port)
+    asyncio.run_coroutine_threadsafe(service.start(), loop).result()
+    services.append(service)
+    return handler
+
+
+def connect(services: list) -> smtplib.SMTP:
+    """Connect an SMTP client to the port of the services."""
+    return smtplib.SMTP('127.0.0.1', services[0]._port)
+
+
+@given(parsers.parse('{count:d} SMTP servers sharing a port'),
+       target_fixture='handler')
+def _(count: int, loop, services: list):
+    """<count> SMTP servers sharing a port."""
+    port = free_port()
+
+    for _ in range(count):
+        start_service(loop, services, create_handler({}), port,
+                      reuse_port=True)
+
+    return services[0].handler
+
+
+@given(parsers.parse('an SMTP server with {allow} allowed and {deny} denied'),
+       target_fixture='handler')
+def _(allow: str, deny: str, loop, services: list):
+    """an SMTP server with <allow> allowed and <deny> denied."""
+    handler = create_handler({
+        'CIDR_ALLOW': allow,
+        'CIDR_DENY': deny,
+        'DNSBL_ZONES': 'dnsbl.example.com'
+    })
+    handler.dnsbl = DNSBL(handler.dnsbl.zones, DNSBLCache(10), ttl=60,
+                          negative_ttl=60, resolver=ListingResolver())
+    return start_service(loop, services, handler, free_port())
+
+
+@given(parsers.parse('an SMTP server rejecting DNSBL listed peers at '
+                     '{stage} with streaming {streaming}'),
+       target_fixture='handler')
+def _(stage: str, streaming: str, loop, services: list):
+    """an SMTP server rejecting DNSBL listed peers at <stage>."""
+    handler = create_handler({
+        'DNSBL_STAGE': stage,
+        'DNSBL_ZONES': 'dnsbl.example.com',
+        'SMTP_STREAMING': streaming
+    })
+    handler.dnsbl = DNSBL(handler.dnsbl.zones, DNSBLCache(10), ttl=60,
+                          negative_ttl=60, resolver=ListingResolver())
+    return start_service(loop, services, handler, free_port())
+
+
+@given(parsers.parse('an SMTP server streaming to the {layout} storage layout'),
+       target_fixture='handler')
+def _(layout: str, loop, services: list):
+    """an SMTP server streaming to the <layout> storage layout."""
+    handler = create_handler({
+        'SMTP_STREAMING': 'true',
+        'STORAGE_LAYOUT': layout
+    })
+    return start_service(loop, services, handler, free_port())
+
+
+@given('an SMTP server streaming to manifests', target_fixture='handler')
+def _(loop, services: list):
+    """an SMTP server streaming to manifests."""
+    handler = create_handler({
+        'MANIFEST_ENABLED': 'true',
+        'MANIFEST_MAX_BYTES': '1',
+        'SMTP_STREAMING': 'true'
+    })
+    return start_service(loop, services, handler, free_port())
+
+
+@when('a message is sent from a listed peer', target_fixture='replies')
+def _(services: list, handler: Handler, lookups: list):
+    """a message is sent from a listed peer."""
+    qnames = handler.dnsbl._resolver.qnames
+    lookups.append(len(qnames))
+    client = connect(services)
+    client.helo()
+    lookups.append(len(qnames))
+    replies = {
+        'MAIL': client.mail('anne@example.com')[0],
+        'RCPT': client.rcpt('bob@example.com')[0]
+    }
+
+    if replies['RCPT'] == 250:
+        replies['DATA'] = client.data(b'Subject: Test\r\n\r\nHello\r\n')[0]
+
+    client.quit()
+    lookups.append(len(qnames))
+    return replies
+
+
+@when('an SMTP server is made outside a service', target_fixture='server')
+def _(loop):
+    """an SMTP server is made outside a service."""
+    handler = create_handler({})
+    server = SMTPServer(handler, loop=loop)
+    handler.uploader.shutdown()
+    return server
+
+
+@when(parsers.parse('a message of {size:d} bytes is sent'),
+      target_fixture='sent')
+def _(size: int, handler: Handler, services: list):
+    """a message of <size> bytes is sent."""
+    line = b'.' + b'A' * 75 + b'\r\n'
+    body = (line * (size // len(line) + 1))[:size - 2] + b'\r\n'
+    message = b'Message-ID: <1@example.com>\r\nSubject: Test\r\n\r\n' + body
+    client = connect(services)
+    client.helo()
+    client.mail('anne@example.com')
+    client.rcpt('bob@example.com')
+    code, _ = client.data(message)
+    client.quit()
+    return {'code': code, 'message': message}
+
+
+@then(parsers.parse('the reply code is {code:d}'))
+def _(code: int, sent: dict):
+    """the reply code is <code>."""
+    assert sent['code'] == code
+
+
+def eml_paths(handler: Handler) -> list[str]:
+    """Get the paths of the message objects written."""
+    objects = handler.transport_params['client'].objects
+    return [path for path in objects if '.eml' in path]
+
+
+@then('the stored message matches the message sent')
+def _(handler: Handler, sent: dict):
+    """the stored message matches the message sent."""
+    objects = handler.transport_params['client'].objects
+    eml_path, = eml_paths(handler)
+    json_path = eml_path.replace('.eml', '.json')
+    assert objects[eml_path]['Body'] == sent['message']
+
+    if handler.storage_layout == 'single':
+        metadata = decode_envelope(objects[eml_path]['Metadata'])
+        assert metadata['path'] == eml_path
+    else:
+        assert json_path in objects
+
+
+def manifest_paths(handler: Handler) -> list[str]:
+    """Get the paths of the manifests written."""
+    objects = handler.transport_params['client'].objects
+    return [path for path in objects if '/manifest-' in path]
+
+
+def manifest_entries(handler: Handler, timeout: float = 5) -> list[dict]:
+    """Wait for a manifest to be written, then read the entries of all."""
+    objects = handler.transport_params['client'].objects
+    deadline = time.monotonic() + timeout
+
+    while not manifest_paths(handler) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return [json.loads(line) for path in manifest_paths(handler)
+            for line in objects[path]['Body'].splitlines()]
+
+
+@then('a manifest lists the message with its size and digest')
+def _(handler: Handler, sent: dict):
+    """a manifest lists the message with its size and digest."""
+    entry, = manifest_entries(handler)
+    assert [entry['path']] == eml_paths(handler)
+    assert entry['size'] == len(sent['message'])
+    assert entry['sha256'] == hashlib.sha256(sent['message']).hexdigest()
+
+
+@then(parsers.parse('the message was uploaded in {part_count:d} parts'))
+def _(part_count: int, handler: Handler):
+    """the message was uploaded in <part_count> parts."""
+    objects = handler.transport_params['client'].objects
+    eml_path, = eml_paths(handler)
+    assert objects[eml_path]['Parts'] == part_count
+
+
+@then('one of the servers stored the message')
+def _(services: list):
+    """one of the servers stored the message."""
+    stored = [eml_paths(service.handler) for service in services]
+    assert sum(map(len, stored)) == 1
+
+
+@then(parsers.parse('aiosmtpd still has the {member} {kind}'))
+def _(member: str, kind: str, server: SMTPServer):
+    """aiosmtpd still has the <member> <kind>."""
+    if kind == 'method':
+        assert callable(vars(SMTP).get(member)), (
+            f'aiosmtpd.smtp.SMTP no longer has the {member} method.'
+        )
+    else:
+        assert member in vars(server), (
+            f'aiosmtpd.smtp.SMTP no longer sets the {member} attribute.'
+        )
+
+
+@then('no message is stored')
+def _(handler: Handler):
+    """no message is stored."""
+    assert handler.transport_params['client'].objects == {}
+
+
+@then(parsers.parse('the {stage} command is rejected with {code:d}'))
+def _(stage: str, code: int, replies: dict):
+    """the <stage> command is rejected with <code>."""
+    index = list(replies).index(stage)
+    assert replies[stage] == code
+    assert list(replies.values())[:index] == [250] * index
+
+
+@then('the peer was looked up once when the client connected')
+def _(lookups: list):
+    """the peer was looked up once when the client connected."""
+    before_connect, after_helo, after_quit = lookups
+    assert after_helo == before_connect + 1
+    assert after_quit == after_helo
+
+
+@then(parsers.parse('the replies are {codes}'))
+def _(codes: str, replies: dict):
+    """the replies are <replies>."""
+    assert ','.join(map(str, replies.values())) == codes
+
+
+@then('the peer was not looked up')
+def _(handler: Handler):
+    """the peer was not looked up."""
+    assert handler.dnsbl._resolver.qnames == []
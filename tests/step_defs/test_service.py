@@ -0,0 +1,319 @@
+"""SMTP Service feature tests."""
+import asyncio
+import smtplib
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from fake_s3 import FakeS3Client
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.handler import Handler
+from smtp2s3.service import SMTPService, loop_factory
+
+logger = get_logger('Testing')
+
+
+@scenario('../features/service.feature', 'Acknowledge A Retried Message Once')
+def test_acknowledge_a_retried_message_once():
+    """Acknowledge A Retried Message Once."""
+
+
+@scenario('../features/service.feature', 'Answer Probes')
+def test_answer_probes():
+    """Answer Probes."""
+
+
+@scenario('../features/service.feature', 'Choose The Event Loop')
+def test_choose_the_event_loop():
+    """Choose The Event Loop."""
+
+
+@scenario('../features/service.feature', 'Drain A Message In Progress')
+def test_drain_a_message_in_progress():
+    """Drain A Message In Progress."""
+
+
+@scenario('../features/service.feature', 'Refuse Sessions Over The Limit')
+def test_refuse_sessions_over_the_limit():
+    """Refuse Sessions Over The Limit."""
+
+
+@scenario('../features/service.feature', 'Scrape The Metrics')
+def test_scrape_the_metrics():
+    """Scrape The Metrics."""
+
+
+@scenario('../features/service.feature', 'Time Out The Drain')
+def test_time_out_the_drain():
+    """Time Out The Drain."""
+
+
+def free_port() -> int:
+    """Get a free TCP port on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def scrape(service: SMTPService) -> dict:
+    """Scrape the metrics of a service, by series."""
+    url = f'http://127.0.0.1:{service._http_port}/metrics'
+    samples = {}
+
+    for line in urllib.request.urlopen(url).read().decode().splitlines():
+        if line and not line.startswith('#'):
+            key, value = line.rsplit(' ', 1)
+            samples[key] = float(value)
+
+    return samples
+
+
+def wait_for(predicate, timeout: float = 5) -> bool:
+    """Wait for a predicate to be true, returning its final value."""
+    deadline = time.monotonic() + timeout
+
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return predicate()
+
+
+@pytest.fixture
+def loop():
+    """Run an event loop in a thread for the service."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+@pytest.fixture
+def clients() -> dict:
+    """The SMTP clients of the scenario."""
+    clients = {}
+    yield clients
+
+    for client in clients.values():
+        client.close()
+
+
+def start_service(loop, drain_delay: float = 0, drain_timeout: float = 5,
+                  **environ: str) -> SMTPService:
+    """Start an SMTP service writing to a fake S3."""
+    config = EnvironmentConfig({
+        'COMPRESSION_CODEC': 'none',
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket',
+        'SMTP_RECIPIENT_REGEX': r'.*@example\.com',
+        **environ
+    })
+    handler = Handler(config, logger)
+    handler.transport_params['client'] = FakeS3Client()
+    service = SMTPService(handler, logger, '127.0.0.1', free_port(),
+                          drain_delay=drain_delay,
+                          drain_timeout=drain_timeout, http_port=free_port())
+    asyncio.run_coroutine_threadsafe(service.start(), loop).result()
+    return service
+
+
+@given(parsers.parse('an SMTP service with a drain delay of {delay:g} '
+                     'seconds'), target_fixture='service')
+def _(delay: float, loop):
+    """an SMTP service with a drain delay of <delay> seconds."""
+    return start_service(loop, drain_delay=delay)
+
+
+@given(parsers.parse('an SMTP service remembering deliveries in {store}'),
+       target_fixture='service')
+def _(store: str, loop, tmp_path):
+    """an SMTP service remembering deliveries in <store>."""
+    environ = {'DEDUP_CACHE_SIZE': '100'}
+
+    if store == 'database':
+        environ['DEDUP_DATABASE'] = str(tmp_path / 'dedup.sqlite')
+
+    return start_service(loop, **environ)
+
+
+@given(parsers.parse('an SMTP service draining for up to {timeout:g} '
+                     'seconds'), target_fixture='service')
+def _(timeout: float, loop):
+    """an SMTP service draining for up to <timeout> seconds."""
+    return start_service(loop, drain_timeout=timeout)
+
+
+@given(parsers.parse('an SMTP service allowing {count:d} session'),
+       target_fixture='service')
+def _(count: int, loop):
+    """an SMTP service allowing <count> session."""
+    return start_service(loop, SMTP_MAX_SESSIONS=str(count))
+
+
+@when(parsers.parse('{path} is probed {when} the service is stopped'),
+      target_fixture='status')
+def _(path: str, when: str, service: SMTPService, loop):
+    """<path> is probed <when> the service is stopped."""
+    if when == 'after':
+        asyncio.run_coroutine_threadsafe(service.stop(), loop)
+        assert wait_for(lambda: not service.ready)
+
+    url = f'http://127.0.0.1:{service._http_port}{path}'
+
+    try:
+        return urllib.request.urlopen(url).status
+    except urllib.error.HTTPError as ex:
+        return ex.code
+
+
+@when(parsers.parse('the {name} event loop is chosen'),
+      target_fixture='event_loop')
+def _(name: str):
+    """the <name> event loop is chosen."""
+    with asyncio.Runner(loop_factory=loop_factory(name, logger)) as runner:
+        return runner.get_loop()
+
+
+@when('a client is part way through sending a message')
+def _(service: SMTPService, clients: dict):
+    """a client is part way through sending a message."""
+    client = smtplib.SMTP('127.0.0.1', service._port)
+    client.helo()
+    client.mail('anne@example.com')
+    client.rcpt('bob@example.com')
+    assert client.docmd('DATA')[0] == 354
+    client.send(b'Message-ID: <1@example.com>\r\nSubject: Test\r\n\r\n')
+    assert wait_for(lambda: any(s.in_data for s in service.connections))
+    clients['sender'] = client
+
+
+@when('a message is sent to the service', target_fixture='scrapes')
+def _(service: SMTPService):
+    """a message is sent to the service."""
+    before = scrape(service)
+
+    with smtplib.SMTP('127.0.0.1', service._port) as client:
+        client.sendmail('anne@example.com', ['bob@example.com'],
+                        b'Message-ID: <1@example.com>\r\n\r\nHello\r\n')
+
+    return before, scrape(service)
+
+
+@when('another client connects', target_fixture='refusal')
+def _(service: SMTPService):
+    """another client connects."""
+    with pytest.raises(smtplib.SMTPConnectError) as info:
+        smtplib.SMTP('127.0.0.1', service._port)
+
+    return info.value
+
+
+@when('another client has said HELO')
+def _(service: SMTPService, clients: dict):
+    """another client has said HELO."""
+    client = smtplib.SMTP('127.0.0.1', service._port)
+    client.helo()
+    clients['other'] = client
+
+
+@when('the service is stopped', target_fixture='stopped')
+def _(service: SMTPService, loop):
+    """the service is stopped."""
+    stopped = asyncio.run_coroutine_threadsafe(service.stop(), loop)
+    assert wait_for(lambda: all(s.draining for s in service.connections))
+    return stopped
+
+
+@then(parsers.parse('the event loop is from the {module} module'))
+def _(module: str, event_loop: asyncio.AbstractEventLoop):
+    """the event loop is from the <module> module."""
+    assert type(event_loop).__module__.split('.')[0] == module
+
+
+@then(parsers.parse('the metrics count {count:d} more message with the '
+                    'reply {code}'))
+def _(count: int, code: str, scrapes: tuple):
+    """the metrics count <count> more message with the reply <code>."""
+    before, after = scrapes
+    key = f'smtp2s3_messages_total{{code="{code}"}}'
+    assert after[key] - before.get(key, 0) == count
+
+
+@then(parsers.parse('the metrics count {count:d} more deduplicated message'))
+def _(count: int, scrapes: tuple):
+    """the metrics count <count> more deduplicated message."""
+    before, after = scrapes
+    key = 'smtp2s3_messages_deduplicated_total'
+    assert after[key] - before.get(key, 0) == count
+
+
+@then(parsers.parse('the metrics count {count:d} more observation of the '
+                    '{stage} stage'))
+def _(count: int, stage: str, scrapes: tuple):
+    """the metrics count <count> more observation of the <stage> stage."""
+    before, after = scrapes
+    key = f'smtp2s3_stage_duration_seconds_count{{stage="{stage}"}}'
+    assert after[key] - before.get(key, 0) == count
+
+
+@then(parsers.parse('the other client is refused with {code:d}'))
+def _(code: int, refusal: smtplib.SMTPConnectError):
+    """the other client is refused with <code>."""
+    assert refusal.smtp_code == code
+
+
+@then(parsers.parse('the probe is answered with {code:d}'))
+def _(code: int, status: int):
+    """the probe is answered with <code>."""
+    assert status == code
+
+
+@then(parsers.parse('the other client is answered with {code:d}'))
+def _(code: int, clients: dict):
+    """the other client is answered with <code>."""
+    assert clients['other'].noop()[0] == code
+
+
+@then(parsers.parse('the message is finished with the reply {code:d}'))
+def _(code: int, clients: dict):
+    """the message is finished with the reply <code>."""
+    client = clients['sender']
+    client.send(b'Hello\r\n.\r\n')
+    assert client.getreply()[0] == code
+
+
+@then('the service has stopped')
+def _(stopped):
+    """the service has stopped."""
+    stopped.result(timeout=5)
+
+
+@then('the client has been disconnected')
+def _(clients: dict):
+    """the client has been disconnected."""
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        clients['sender'].noop()
+
+
+def stored(service: SMTPService) -> list[str]:
+    """Get the paths of the message objects written."""
+    objects = service.handler.transport_params['client'].objects
+    return [path for path in objects if '.eml' in path]
+
+
+@then('the message is stored')
+def _(service: SMTPService):
+    """the message is stored."""
+    assert len(stored(service)) == 1
+
+
+@then('no message is stored')
+def _(service: SMTPService):
+    """no message is stored."""
+    assert stored(service) == []
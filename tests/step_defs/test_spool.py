@@ -0,0 +1,238 @@
+"""Spool feature tests."""
+import asyncio
+import contextlib
+import glob
+import os
+
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import get_logger
+from smtp2s3.spool import (DEAD_LETTERS, Spool, SpoolFull, adopt_orphans,
+                           read_records)
+from smtp2s3.uploader import is_outage
+
+logger = get_logger('Testing')
+logger.setLevel('DEBUG')
+
+
+@scenario('../features/spool.feature',
+          'Move Failing Messages To The Dead Letters')
+def test_move_failing_messages_to_the_dead_letters():
+    """Move Failing Messages To The Dead Letters."""
+
+
+@scenario('../features/spool.feature', 'Orphaned Spools Are Replayed')
+def test_orphaned_spools_are_replayed():
+    """Orphaned Spools Are Replayed."""
+
+
+@scenario('../features/spool.feature',
+          'Refuse Messages Once The Spool Is Full')
+def test_refuse_messages_once_the_spool_is_full():
+    """Refuse Messages Once The Spool Is Full."""
+
+
+@scenario('../features/spool.feature', 'Spooled Messages Are Uploaded')
+def test_spooled_messages_are_uploaded():
+    """Spooled Messages Are Uploaded."""
+
+
+@scenario('../features/spool.feature', 'Spool Is Replayed On Startup')
+def test_spool_is_replayed_on_startup():
+    """Spool Is Replayed On Startup."""
+
+
+@scenario('../features/spool.feature', 'Torn Record Is Ignored')
+def test_torn_record_is_ignored():
+    """Torn Record Is Ignored."""
+
+
+async def run_spool(directory: str, message_count: int, stored: list,
+                    available: bool = True) -> None:
+    """Spool some messages then wait for the spool to drain."""
+    async def store(header: dict, content: bytes) -> None:
+        if not available:
+            raise ConnectionError('S3 is unavailable.')
+
+        stored.append((header, content))
+
+    spool = Spool(directory, store, logger, batch_size=4)
+    await spool.start()
+    appends = [
+        spool.append({'eml_path': f's3://mybucket/{n}.eml.gz'}, b'Hello')
+        for n in range(message_count)
+    ]
+    await asyncio.gather(*appends)
+
+    if available:
+        await spool.drain()
+
+    await spool.stop()
+
+
+async def drain_failing(directory: str, message_count: int, drains: int,
+                        error: type) -> set:
+    """Spool some messages, the second always failing, and drain them."""
+    stored = set()
+
+    async def store(header: dict, content: bytes) -> None:
+        if header['eml_path'] == 's3://mybucket/1.eml.gz':
+            raise error('The message failed.')
+
+        stored.add(header['eml_path'])
+
+    spool = Spool(directory, store, logger, batch_size=4, max_attempts=drains,
+                  is_outage=is_outage)
+    await spool.start()
+    await asyncio.gather(*[
+        spool.append({'eml_path': f's3://mybucket/{n}.eml.gz'}, b'Hello')
+        for n in range(message_count)
+    ])
+
+    for _ in range(drains):
+        with contextlib.suppress(error):
+            await spool.drain()
+
+    await spool.stop()
+    return stored
+
+
+async def fill_spool(directory: str, message_count: int,
+                     max_bytes: int) -> list:
+    """Spool some messages to a spool of a maximum size, without draining."""
+    async def store(header: dict, content: bytes) -> None:
+        raise ConnectionError('S3 is unavailable.')
+
+    spool = Spool(directory, store, logger, max_bytes=max_bytes)
+    await spool.start()
+    results = []
+
+    for n in range(message_count):
+        try:
+            results.append(await spool.append(
+                {'eml_path': f's3://mybucket/{n}.eml.gz'}, b'Hello'
+            ))
+        except SpoolFull as ex:
+            results.append(ex)
+
+    await spool.stop()
+    return results
+
+
+@given('a spool directory', target_fixture='spool_directory')
+def _(tmp_path):
+    """a spool directory."""
+    return str(tmp_path / 'spool')
+
+
+@when(parsers.parse('{message_count:d} messages are spooled'),
+      target_fixture='stored')
+def _(message_count: int, spool_directory: str):
+    """<message_count> messages are spooled."""
+    stored = []
+    asyncio.run(run_spool(spool_directory, message_count, stored))
+    return stored
+
+
+@when(parsers.parse(
+    '{message_count:d} messages are spooled while S3 is unavailable'))
+def _(message_count: int, spool_directory: str):
+    """<message_count> messages are spooled while S3 is unavailable."""
+    asyncio.run(run_spool(spool_directory, message_count, [], False))
+
+
+@when(parsers.parse('{message_count:d} messages are spooled to {orphan} while '
+                    'S3 is unavailable'))
+def _(message_count: int, orphan: str, spool_directory: str):
+    """<message_count> messages are spooled to <orphan> while S3 is down."""
+    directory = os.path.join(spool_directory, orphan)
+    asyncio.run(run_spool(directory, message_count, [], False))
+
+
+@when(parsers.parse('the spool of {target} is restarted with {workers:d} '
+                    'workers'), target_fixture='stored')
+def _(target: str, workers: int, spool_directory: str):
+    """the spool of <target> is restarted with <workers> workers."""
+    stored = []
+    adopt_orphans(spool_directory, workers, logger)
+    directory = os.path.join(spool_directory, target)
+    asyncio.run(run_spool(directory, 0, stored))
+    return stored
+
+
+@when(parsers.parse('{message_count:d} messages are spooled and drained '
+                    '{drains:d} times with message 1 failing with {error}'),
+      target_fixture='stored')
+def _(message_count: int, drains: int, error: str, spool_directory: str):
+    """<message_count> messages are spooled and drained with one failing."""
+    errors = {'ConnectionError': ConnectionError, 'ValueError': ValueError}
+    return asyncio.run(drain_failing(spool_directory, message_count, drains,
+                                     errors[error]))
+
+
+@when(parsers.parse('{message_count:d} messages are spooled to a spool of at '
+                    'most {max_bytes:d} byte'), target_fixture='results')
+def _(message_count: int, max_bytes: int, spool_directory: str):
+    """<message_count> messages are spooled to a spool of at most <bytes>."""
+    return asyncio.run(fill_spool(spool_directory, message_count, max_bytes))
+
+
+@when('the last spooled record is torn')
+def _(spool_directory: str):
+    """the last spooled record is torn."""
+    path = sorted(glob.glob(os.path.join(spool_directory, '*.wal')))[0]
+    os.truncate(path, os.path.getsize(path) - 1)
+
+
+@when('the spool is restarted', target_fixture='stored')
+def _(spool_directory: str):
+    """the spool is restarted."""
+    stored = []
+    asyncio.run(run_spool(spool_directory, 0, stored))
+    return stored
+
+
+@then(parsers.parse('{message_count:d} messages are stored from the spool'))
+def _(message_count: int, stored: list):
+    """<message_count> messages are stored from the spool."""
+    assert len(stored) == message_count
+
+    for header, content in stored:
+        assert header['eml_path'].startswith('s3://mybucket/')
+        assert content == b'Hello'
+
+
+@then(parsers.parse('the spool holds {segment_count:d} segment'))
+def _(segment_count: int, spool_directory: str):
+    """the spool holds <segment_count> segment."""
+    segments = glob.glob(os.path.join(spool_directory, '*.wal'))
+    assert len(segments) == segment_count
+
+
+@then(parsers.parse('no segments are left in {orphan}'))
+def _(orphan: str, spool_directory: str):
+    """no segments are left in <orphan>."""
+    segments = glob.glob(os.path.join(spool_directory, orphan, '*.wal'))
+    assert segments == []
+
+
+@then(parsers.parse('the messages stored from the spool are {indexes}'))
+def _(indexes: str, stored: set):
+    """the messages stored from the spool are <stored>."""
+    assert stored == {f's3://mybucket/{n}.eml.gz' for n in indexes.split(',')}
+
+
+@then(parsers.parse('{count:d} messages are in the dead letters'))
+def _(count: int, spool_directory: str):
+    """<count> messages are in the dead letters."""
+    path = os.path.join(spool_directory, DEAD_LETTERS)
+    records = read_records(path, 0, None, 100) if count else []
+    assert len(records) == count
+    assert os.path.exists(path) == bool(count)
+
+
+@then('the last message is refused as the spool is full')
+def _(results: list):
+    """the last message is refused as the spool is full."""
+    assert results[:-1] == [None] * (len(results) - 1)
+    assert isinstance(results[-1], SpoolFull)
@@ -0,0 +1,80 @@
+"""Startup feature tests."""
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import EnvironmentConfig, get_logger
+from smtp2s3.handler import Handler
+from smtp2s3.startup import StartupProfile
+
+logger = get_logger('Testing')
+
+
+@scenario('../features/startup.feature', 'Defer The Work Of Starting')
+def test_defer_the_work_of_starting():
+    """Defer The Work Of Starting."""
+
+
+@scenario('../features/startup.feature', 'Time The Startup Phases')
+def test_time_the_startup_phases():
+    """Time The Startup Phases."""
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    """The clock of the startup profile."""
+    return Clock()
+
+
+@given('a startup profile', target_fixture='profile')
+def _(clock: Clock):
+    """a startup profile."""
+    return StartupProfile(clock)
+
+
+@given('a handler', target_fixture='handler')
+def _():
+    """a handler."""
+    config = EnvironmentConfig({
+        'COMPRESSION_WORKERS': '0',
+        'S3_PREFIX_PATTERN': 's3://mybucket/{YYYY}'
+    })
+    return Handler(config, logger)
+
+
+@when(parsers.parse('the {name} phase takes {seconds:g} second'))
+@when(parsers.parse('the {name} phase takes {seconds:g} seconds'))
+def _(name: str, seconds: float, profile: StartupProfile, clock: Clock):
+    """the <name> phase takes <seconds> seconds."""
+    with profile.phase(name):
+        clock.now += seconds
+
+
+@when('the handler is warmed up')
+def _(handler: Handler):
+    """the handler is warmed up."""
+    handler.warm_up()
+
+
+@then(parsers.parse('the startup summary is "{summary}"'))
+def _(summary: str, profile: StartupProfile):
+    """the startup summary is "<summary>"."""
+    assert profile.summary('Listening') == summary
+
+
+@then(parsers.parse('the S3 client and recipient regex are {state}'))
+def _(state: str, handler: Handler):
+    """the S3 client and recipient regex are <state>."""
+    created = state == 'created'
+    assert ('client' in handler.transport_params) == created
+    assert ('regex' in vars(handler.recipients)) == created
@@ -0,0 +1,221 @@
+"""Uploader feature tests."""
+import asyncio
+import contextlib
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3.uploader import StorageUnavailable, UploadBreaker, Uploader
+
+
+@scenario('../features/uploader.feature', 'Adapt The Upload Limit')
+def test_adapt_the_upload_limit():
+    """Adapt The Upload Limit."""
+
+
+@scenario('../features/uploader.feature', 'Bounded Uploads')
+def test_bounded_uploads():
+    """Bounded Uploads."""
+
+
+@scenario('../features/uploader.feature', 'Break The Circuit')
+def test_break_the_circuit():
+    """Break The Circuit."""
+
+
+@scenario('../features/uploader.feature', 'Cancel A Trial Upload')
+def test_cancel_a_trial_upload():
+    """Cancel A Trial Upload."""
+
+
+@scenario('../features/uploader.feature', 'Invalid Maximum Uploads')
+def test_invalid_maximum_uploads():
+    """Invalid Maximum Uploads."""
+
+
+class Clock:
+    """A clock that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        """Get the time."""
+        return self.now
+
+
+def upload_that(outcome: str):
+    """Get a blocking upload with an outcome."""
+    def upload() -> None:
+        if outcome == 'is slow':
+            time.sleep(0.15)
+        elif outcome == 'cannot connect':
+            raise ConnectionError('Connection refused.')
+        elif outcome != 'succeeds':
+            code = 'SlowDown' if outcome == 'is throttled' else '404'
+            raise ClientError({'Error': {'Code': code}}, 'PutObject')
+
+    return upload
+
+
+def run_uploads(uploader: Uploader, outcomes: list) -> list:
+    """Run an upload for each outcome in turn, returning any exceptions."""
+    async def run() -> list:
+        results = []
+
+        for outcome in outcomes:
+            try:
+                results.append(await uploader.run(upload_that(outcome)))
+            except Exception as ex:
+                results.append(ex)
+
+        return results
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def clock() -> Clock:
+    """The clock of the breaker."""
+    return Clock()
+
+
+@given(parsers.parse('an uploader with a maximum of {max_uploads:d} uploads'),
+       target_fixture='uploader')
+def _(max_uploads: int):
+    """an uploader with a maximum of <max_uploads> uploads."""
+    try:
+        return Uploader(max_uploads)
+    except ValueError as ex:
+        return ex
+
+
+@given('an uploader with a maximum of 8 uploads and a latency target',
+       target_fixture='uploader')
+def _():
+    """an uploader with a maximum of 8 uploads and a latency target."""
+    return Uploader(8, latency_target=0.05)
+
+
+@given(parsers.parse('an uploader with a breaker opening at {threshold:g} of '
+                     '{window:d} uploads'), target_fixture='uploader')
+def _(threshold: float, window: int, clock: Clock):
+    """an uploader with a breaker opening at <threshold> of <window> uploads."""
+    return Uploader(4, breaker=UploadBreaker(threshold, window, 30, clock))
+
+
+@when(parsers.parse('an upload {outcome}'))
+def _(outcome: str, uploader: Uploader):
+    """an upload <outcome>."""
+    run_uploads(uploader, [outcome])
+
+
+@when(parsers.parse('{ok:d} uploads succeed and {failed:d} uploads are '
+                    'throttled'))
+def _(ok: int, failed: int, uploader: Uploader):
+    """<ok> uploads succeed and <failed> uploads are throttled."""
+    run_uploads(uploader, ['succeeds'] * ok + ['is throttled'] * failed)
+
+
+@when(parsers.parse('a trial upload is cancelled while {stage} after the '
+                    'cool down'))
+def _(stage: str, uploader: Uploader, clock: Clock):
+    """a trial upload is cancelled while <stage> after the cool down."""
+    clock.now += 30
+
+    if stage == 'waiting':
+        uploader.in_flight = uploader.max_uploads
+
+    async def cancel_trial() -> None:
+        trial = asyncio.ensure_future(uploader.run(time.sleep, 0.2))
+        await asyncio.sleep(0.05)
+        trial.cancel()
+
+        with contextlib.suppress(asyncio.CancelledError):
+            await trial
+
+    asyncio.run(cancel_trial())
+    uploader.in_flight = 0
+
+
+@when(parsers.parse('the cool down has passed and a trial upload {outcome}'))
+def _(outcome: str, uploader: Uploader, clock: Clock):
+    """the cool down has passed and a trial upload <outcome>."""
+    clock.now += 30
+    run_uploads(uploader, [outcome])
+
+
+@when(parsers.parse('{upload_count:d} blocking uploads are run'),
+      target_fixture='upload_stats')
+def _(upload_count: int, uploader: Uploader):
+    """<upload_count> blocking uploads are run."""
+    lock = threading.Lock()
+    stats = {'running': 0, 'peak': 0, 'completed': 0}
+
+    def blocking_upload() -> None:
+        with lock:
+            stats['running'] += 1
+            stats['peak'] = max(stats['peak'], stats['running'])
+
+        time.sleep(0.05)
+
+        with lock:
+            stats['running'] -= 1
+            stats['completed'] += 1
+
+    async def run_uploads() -> None:
+        uploads = [uploader.run(blocking_upload) for _ in range(upload_count)]
+        await asyncio.gather(*uploads)
+
+    asyncio.run(run_uploads())
+    uploader.shutdown()
+    return stats
+
+
+@then(parsers.parse('no more than {max_uploads:d} uploads ran at once'))
+def _(max_uploads: int, upload_stats: dict):
+    """no more than <max_uploads> uploads ran at once."""
+    assert upload_stats['peak'] <= max_uploads
+
+
+@then(parsers.parse('all {upload_count:d} uploads completed'))
+def _(upload_count: int, upload_stats: dict):
+    """all <upload_count> uploads completed."""
+    assert upload_stats['completed'] == upload_count
+
+
+@then(parsers.parse('the upload limit is {limit:d}'))
+def _(limit: int, uploader: Uploader):
+    """the upload limit is <limit>."""
+    assert int(uploader.limit.value) == limit
+
+
+@then(parsers.parse('the upload limit is {limit:d} after {count:d} healthy '
+                    'uploads'))
+def _(limit: int, count: int, uploader: Uploader):
+    """the upload limit is <limit> after <count> healthy uploads."""
+    run_uploads(uploader, ['succeeds'] * count)
+    assert int(uploader.limit.value) == limit
+
+
+@then(parsers.parse('the breaker is {state}'))
+def _(state: str, uploader: Uploader):
+    """the breaker is <state>."""
+    assert uploader.breaker.state == state
+    assert uploader.available() == (state == 'closed')
+
+
+@then('an upload is refused as storage is unavailable')
+def _(uploader: Uploader):
+    """an upload is refused as storage is unavailable."""
+    result, = run_uploads(uploader, ['succeeds'])
+    assert isinstance(result, StorageUnavailable)
+
+
+@then('a Value Error Exception is Raised by the uploader')
+def _(uploader):
+    """a Value Error Exception is Raised by the uploader."""
+    assert isinstance(uploader, ValueError)
@@ -0,0 +1,208 @@
+"""Worker Processes feature tests."""
+import functools
+import os
+import signal
+import time
+
+import pytest
+from pytest_bdd import given, parsers, scenario, then, when
+
+from smtp2s3 import get_logger
+from smtp2s3.workers import Supervisor, available_cpus
+
+logger = get_logger('Testing')
+
+
+@scenario('../features/workers.feature',
+          'Back Off Restarting A Crashing Worker')
+def test_back_off_restarting_a_crashing_worker():
+    """Back Off Restarting A Crashing Worker."""
+
+
+@scenario('../features/workers.feature', 'Count The Available CPUs')
+def test_count_the_available_cpus():
+    """Count The Available CPUs."""
+
+
+@scenario('../features/workers.feature', 'Pass Signals On To Workers')
+def test_pass_signals_on_to_workers():
+    """Pass Signals On To Workers."""
+
+
+@scenario('../features/workers.feature', 'Restart A Crashed Worker')
+def test_restart_a_crashed_worker():
+    """Restart A Crashed Worker."""
+
+
+@scenario('../features/workers.feature', 'Stop When Workers Keep Crashing')
+def test_stop_when_workers_keep_crashing():
+    """Stop When Workers Keep Crashing."""
+
+
+@scenario('../features/workers.feature', 'Stop Workers')
+def test_stop_workers():
+    """Stop Workers."""
+
+
+def worker(index: int, directory) -> None:
+    """Record each SIGHUP in the directory until terminated."""
+    signal.signal(signal.SIGHUP,
+                  lambda sig, frame: (directory / f'{index}.hup').touch())
+    (directory / f'{index}.ready').touch()
+
+    while True:
+        signal.pause()
+
+
+def wait_for(predicate, timeout: float = 5) -> bool:
+    """Wait for a predicate to be true, returning its final value."""
+    deadline = time.monotonic() + timeout
+
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return predicate()
+
+
+@pytest.fixture
+def pids() -> dict:
+    """The PID of each worker when it was first started."""
+    return {}
+
+
+@pytest.fixture
+def supervisors() -> list:
+    """Stop the supervisors once the scenario is complete."""
+    supervisors = []
+    yield supervisors
+
+    for supervisor in supervisors:
+        supervisor.stop()
+
+
+def start_supervisor(workers: int, pids: dict, supervisors: list, tmp_path,
+                     **kwargs) -> Supervisor:
+    """Start the workers of a supervisor, waiting for them to be ready."""
+    supervisor = Supervisor(
+        workers, functools.partial(worker, directory=tmp_path), logger,
+        **kwargs
+    )
+    supervisors.append(supervisor)
+
+    for index in range(workers):
+        supervisor.start_worker(index)
+        pids[index] = supervisor.processes[index].pid
+
+    assert wait_for(lambda: len(list(tmp_path.glob('*.ready'))) == workers)
+    return supervisor
+
+
+@given(parsers.parse('a supervisor of {workers:d} workers'),
+       target_fixture='supervisor')
+def _(workers: int, pids: dict, supervisors: list, tmp_path):
+    """a supervisor of <workers> workers."""
+    return start_supervisor(workers, pids, supervisors, tmp_path)
+
+
+@given(parsers.parse('a supervisor of 1 worker allowing {limit:d} restart'),
+       target_fixture='supervisor')
+def _(limit: int, pids: dict, supervisors: list, tmp_path):
+    """a supervisor of 1 worker allowing <limit> restart."""
+    return start_supervisor(1, pids, supervisors, tmp_path, restart_delay=0,
+                            restart_limit=limit)
+
+
+@given(parsers.parse('a supervisor of 1 worker restarting after {delay:g} '
+                     'seconds'), target_fixture='supervisor')
+def _(delay: float, pids: dict, supervisors: list, tmp_path):
+    """a supervisor of 1 worker restarting after <delay> seconds."""
+    return start_supervisor(1, pids, supervisors, tmp_path,
+                            restart_delay=delay)
+
+
+@given(parsers.parse('the CPU quota is {cpu_max}'), target_fixture='cpu_max')
+def _(cpu_max: str, tmp_path):
+    """the CPU quota is <cpu_max>."""
+    path = tmp_path / 'cpu.max'
+    path.write_text(f'{cpu_max}\n')
+    return str(path)
+
+
+@when(parsers.parse('worker {index:d} is killed'))
+def _(index: int, supervisor: Supervisor):
+    """worker <index> is killed."""
+    process = supervisor.processes[index]
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+
+
+@when('the supervisor checks its workers')
+def _(supervisor: Supervisor):
+    """the supervisor checks its workers."""
+    supervisor.restart_dead_workers()
+
+
+@when('the supervisor passes on a SIGHUP')
+def _(supervisor: Supervisor):
+    """the supervisor passes on a SIGHUP."""
+    supervisor.signal(signal.SIGHUP)
+
+
+@when('the supervisor stops')
+def _(supervisor: Supervisor):
+    """the supervisor stops."""
+    supervisor.stop()
+
+
+@when('the available CPUs are counted', target_fixture='cpus')
+def _(cpu_max: str):
+    """the available CPUs are counted."""
+    return available_cpus(cpu_max)
+
+
+@then(parsers.parse('worker {index:d} has been restarted'))
+def _(index: int, supervisor: Supervisor, pids: dict):
+    """worker <index> has been restarted."""
+    process = supervisor.processes[index]
+    assert process.is_alive()
+    assert process.pid != pids[index]
+
+
+@then(parsers.parse('worker {index:d} is waiting to be restarted'))
+def _(index: int, supervisor: Supervisor, pids: dict):
+    """worker <index> is waiting to be restarted."""
+    process = supervisor.processes[index]
+    assert not process.is_alive()
+    assert process.pid != pids[index]
+
+
+@then(parsers.parse('{restarts:d} worker has been restarted'))
+def _(restarts: int, supervisor: Supervisor):
+    """<restarts> worker has been restarted."""
+    assert supervisor.restarts == restarts
+
+
+@then(parsers.parse('the supervisor exits with the code {code:d}'))
+def _(code: int, supervisor: Supervisor):
+    """the supervisor exits with the code <code>."""
+    assert supervisor.exitcode == code
+
+
+@then('every worker receives the SIGHUP')
+def _(supervisor: Supervisor, tmp_path):
+    """every worker receives the SIGHUP."""
+    workers = len(supervisor.processes)
+    assert wait_for(lambda: len(list(tmp_path.glob('*.hup'))) == workers)
+
+
+@then('no worker is alive')
+def _(supervisor: Supervisor):
+    """no worker is alive."""
+    assert not any(p.is_alive() for p in supervisor.processes.values())
+
+
+@then(parsers.parse('there are {count} available CPUs'))
+def _(count: str, cpus: int):
+    """there are <count> available CPUs."""
+    expected = len(os.sched_getaffinity(0)) if count == 'affinity' else count
+    assert cpus == int(expected)